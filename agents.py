@@ -1,6 +1,5 @@
-from crewai import Agent, Task, Crew, Process
-
-from llms import cto_llm, coder_llm
+from code_changes import file_changes_instructions
+from llms import get_cto_llm, get_coder_llm
 
 
 technology_preferences = '''
@@ -8,7 +7,7 @@ technology_preferences = '''
     We accomplish this with the following files.
 '''
 
-# TODO: make this a setting of the target GITHUB repo
+# Used when the repository index (repo_index.py) is disabled or unavailable.
 project_description = '''
     - `app.py` for the FastAPI backend.
     - `index.html` for the React Native frontend.
@@ -19,6 +18,17 @@ project_description = '''
 
 planner_task_expected_output = 'A collection of working python, javascript css and/or html files.'
 
+def get_planner_prompt(title, body, message_history):
+    history_str = '\n'.join(f'{msg.role.upper()}: {msg.content}' for msg in message_history)
+
+    return f'''
+            {title}
+            {body}
+            
+            Message History:
+            {history_str}
+        '''
+
 def get_planner_task_description(prompt):
     return f'''
         Return the code that meets the requirements of the Issue:
@@ -59,43 +69,67 @@ def get_coder_refactor_task_description(pull_request, cto_spec, refactor_feedbac
         - Follow the company's coding standards and guidelines.
         - Write clean, efficient, and maintainable code.
         - Update the pull request with the refactored code.
+        {file_changes_instructions}
     '''
 
-agent_instructor = Agent(
-    role = "Coding-Agent Instructor",
-    llm = cto_llm,
-    allow_delegation = False,
-    verbose = True,
-    goal = f"""
-        You will provide instructions to a Coding Agent . Give it coding instructions in plain English.
+# The agents' personas, as plain strings so the async loop (async_loop.py) can prompt with them without CrewAI.
+instructor_role = "Coding-Agent Instructor"
+instructor_backstory = """
+        """
 
-        The web application is organized like this:
-        {project_description} .
-        
-    """,
-    backstory = """
-    """,
-)
-
-agent_coder = Agent(
-    role = "Programmer",
-    llm = coder_llm,
-    allow_delegation = True,
-    verbose = True,
-    goal = f"""
-        Return code that meets the requirements of the task. {technology_preferences}
-        {technology_preferences}
-    """,
-    backstory = """
-        You are an experienced Technical Lead with a strong background in software development and team management. 
-        You have a Master's degree in Computer Science and have worked on numerous successful projects in your career.
-
-        You have expertise in React Native, FastAPI, Postgres, git, bash, and ffmpeg. You are well-versed in the 
-        company's technology stack and best practices, and you are committed to ensuring that the development team 
-        delivers high-quality software solutions.
-
-        Your role is to respond to Github feature requests or bug requests with code that meets the requirements.
-        
-        You value simplicity, elegance and practical, working solutions.
-    """,
-)
\ No newline at end of file
+def get_instructor_goal(project_context=None):
+    return f"""
+            You will provide instructions to a Coding Agent . Give it coding instructions in plain English.
+
+            The web application is organized like this:
+            {project_context or project_description} .
+            
+        """
+
+def build_agent_instructor(llm=None, project_context=None):
+    '''
+    Agents hold per-crew state, so each crew gets its own instance. `llm` defaults to the CTO model.
+    `project_context` describes the target repository, by default `project_description`.
+    CrewAI is imported here rather than at module level so that importing this module stays cheap.
+    '''
+    from crewai import Agent
+
+    return Agent(
+        role = instructor_role,
+        llm = llm or get_cto_llm(),
+        allow_delegation = False,
+        verbose = True,
+        goal = get_instructor_goal(project_context),
+        backstory = instructor_backstory,
+    )
+
+coder_role = "Programmer"
+coder_goal = f"""
+            Return code that meets the requirements of the task. {technology_preferences}
+            {technology_preferences}
+        """
+coder_backstory = """
+            You are an experienced Technical Lead with a strong background in software development and team management. 
+            You have a Master's degree in Computer Science and have worked on numerous successful projects in your career.
+
+            You have expertise in React Native, FastAPI, Postgres, git, bash, and ffmpeg. You are well-versed in the 
+            company's technology stack and best practices, and you are committed to ensuring that the development team 
+            delivers high-quality software solutions.
+
+            Your role is to respond to Github feature requests or bug requests with code that meets the requirements.
+            
+            You value simplicity, elegance and practical, working solutions.
+        """
+
+def build_agent_coder(llm=None, tools=None):
+    from crewai import Agent
+
+    return Agent(
+        role = coder_role,
+        llm = llm or get_coder_llm(),
+        tools = tools or [],
+        allow_delegation = True,
+        verbose = True,
+        goal = coder_goal,
+        backstory = coder_backstory,
+    )
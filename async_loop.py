@@ -0,0 +1,438 @@
+import asyncio
+import base64
+from itertools import takewhile
+import os
+from time import monotonic
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+import httpx
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from agents import (
+    coder_backstory,
+    coder_goal,
+    coder_role,
+    get_instructor_goal,
+    instructor_backstory,
+    instructor_role,
+    get_planner_prompt,
+    get_planner_task_description,
+    get_coder_refactor_task_description,
+)
+from change_tracker import ChangeTracker, to_datetime
+from code_changes import extract_file_changes
+from git_commits import inline_content_max_bytes
+from llms import cto_llm_name
+from model_router import choose_route, get_route_llm, record_outcome
+from poll_scheduler import PollScheduler
+from prompt_budget import compact_message_history, count_tokens
+from repo_index import get_project_context
+from repo_context import gh_api_url, parse_repo_names, round_robin
+from rate_limit import call_with_backoff_async, github_bucket_names
+from snapshot import bot_flag_planner, snapshot_from_bodies
+from telemetry import record_github_request, stage
+from workflow_state import get_workflow_store, hash_plan, plan_branch_name
+
+
+load_dotenv()
+
+gh_base_branch = os.environ.get('GH_BASE_BRANCH', 'main')
+gh_access_token = os.environ.get('GH_ACCESS_TOKEN', '')
+gh_repo_name = os.environ.get('GH_REPO_NAME', 'kvnn/AIAgentsStarterKit')
+gh_repo_names = parse_repo_names(os.environ.get('GH_REPO_NAMES') or gh_repo_name, gh_base_branch)
+gh_full_sync_every = int(os.environ.get('GH_FULL_SYNC_EVERY') or 60)
+# How many GitHub requests and LLM calls may be in flight at once.
+async_max_connections = int(os.environ.get('ASYNC_MAX_CONNECTIONS') or 50)
+async_max_llm_calls = int(os.environ.get('ASYNC_MAX_LLM_CALLS') or 10)
+
+
+def build_http_client(token, base_url=gh_api_url, max_connections=async_max_connections):
+    '''The pooled `httpx.AsyncClient` shared by the GitHub clients of every repository.'''
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers={
+            'Authorization': f'token {token}',
+            'Accept': 'application/vnd.github+json',
+        },
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=30,
+    )
+
+
+class AsyncGithubClient:
+    '''
+    A small non-blocking GitHub REST client for one repository, over a shared `httpx.AsyncClient`.
+    Covers only the endpoints the agent loop reads and writes.
+    '''
+
+    def __init__(self, repo_name, base_branch, client):
+        self.repo_name = repo_name
+        self.repo_path = f'/repos/{repo_name}'
+        self.base_branch = base_branch
+        self.client = client
+
+    async def request(self, method, path, **kwargs):
+        response = await call_with_backoff_async(
+            lambda: self.client.request(method, path, **kwargs),
+            github_bucket_names(method),
+        )
+        record_github_request(method, response.status_code)
+        response.raise_for_status()
+        return response
+
+    async def paginate(self, path, params=None, keep=None):
+        '''
+        Read every page of `path`. With `keep`, stop at the first item it rejects; the listing must be
+        sorted so that every later item would be rejected too.
+        '''
+        items = []
+        url = f'{self.repo_path}{path}'
+        params = {'per_page': 100, **(params or {})}
+        while url:
+            response = await self.request('GET', url, params=params)
+            page = response.json()
+            kept = list(takewhile(keep, page)) if keep else page
+            items.extend(kept)
+            if len(kept) < len(page):
+                break
+            url = response.links.get('next', {}).get('url')
+            # The `next` link already carries the query string.
+            params = None
+        return items
+
+    async def get_open_issues(self, since=None):
+        params = {'state': 'open'}
+        if since:
+            params['since'] = since.strftime('%Y-%m-%dT%H:%M:%SZ')
+        return await self.paginate('/issues', params)
+
+    async def get_open_pulls(self, since=None):
+        # The pulls endpoint has no `since`; read newest-updated first and stop at the bound.
+        keep = (lambda pull: to_datetime(pull['updated_at']) >= since) if since else None
+        return await self.paginate('/pulls', {'state': 'open', 'sort': 'updated', 'direction': 'desc'}, keep)
+
+    async def get_issue_comments(self, number):
+        return await self.paginate(f'/issues/{number}/comments')
+
+    async def get_review_comments(self, number):
+        return await self.paginate(f'/pulls/{number}/comments')
+
+    async def get_pull_files(self, number):
+        return await self.paginate(f'/pulls/{number}/files')
+
+    async def create_comment(self, number, body):
+        response = await self.request('POST', f'{self.repo_path}/issues/{number}/comments', json={'body': body})
+        return response.json()
+
+    async def get_branch_sha(self, branch):
+        response = await self.request('GET', f'{self.repo_path}/branches/{branch}')
+        return response.json()['commit']['sha']
+
+    async def create_ref(self, ref, sha):
+        response = await self.request('POST', f'{self.repo_path}/git/refs', json={'ref': ref, 'sha': sha})
+        return response.json()
+
+    async def get_ref_sha(self, branch):
+        response = await self.request('GET', f'{self.repo_path}/git/ref/heads/{branch}')
+        return response.json()['object']['sha']
+
+    async def update_ref(self, branch, sha):
+        # Not forced: fails if the branch moved since `sha`'s parent was read.
+        response = await self.request('PATCH', f'{self.repo_path}/git/refs/heads/{branch}', json={'sha': sha})
+        return response.json()
+
+    async def tree_entry(self, path, content):
+        if len(content.encode('utf-8')) <= inline_content_max_bytes:
+            return {'path': path, 'mode': '100644', 'type': 'blob', 'content': content}
+        response = await self.request('POST', f'{self.repo_path}/git/blobs', json={
+            'content': base64.b64encode(content.encode('utf-8')).decode('utf-8'),
+            'encoding': 'base64',
+        })
+        return {'path': path, 'mode': '100644', 'type': 'blob', 'sha': response.json()['sha']}
+
+    async def build_commit(self, parent_sha, files, message):
+        '''Create one commit on top of `parent_sha` that writes all of `files` (see git_commits.py).'''
+        parent, tree = await asyncio.gather(
+            self.request('GET', f'{self.repo_path}/git/commits/{parent_sha}'),
+            asyncio.gather(*[self.tree_entry(path, content) for path, content in files.items()]),
+        )
+        tree_response = await self.request('POST', f'{self.repo_path}/git/trees', json={
+            'base_tree': parent.json()['tree']['sha'],
+            'tree': list(tree),
+        })
+        commit_response = await self.request('POST', f'{self.repo_path}/git/commits', json={
+            'message': message,
+            'tree': tree_response.json()['sha'],
+            'parents': [parent_sha],
+        })
+        return commit_response.json()['sha']
+
+    async def commit_files(self, branch, files, message):
+        commit_sha = await self.build_commit(await self.get_ref_sha(branch), files, message)
+        await self.update_ref(branch, commit_sha)
+        return commit_sha
+
+    async def create_branch_with_files(self, branch, base_sha, files, message):
+        commit_sha = await self.build_commit(base_sha, files, message)
+        await self.create_ref(f'refs/heads/{branch}', commit_sha)
+        return commit_sha
+
+    async def get_pull(self, number):
+        response = await self.request('GET', f'{self.repo_path}/pulls/{number}')
+        return response.json()
+
+    async def find_open_pull(self, branch):
+        owner = self.repo_name.split('/')[0]
+        pulls = await self.paginate('/pulls', {'state': 'open', 'head': f'{owner}:{branch}'})
+        return pulls[0] if pulls else None
+
+    async def create_pull_from_issue(self, issue_number, head, base):
+        response = await self.request('POST', f'{self.repo_path}/pulls', json={
+            'issue': issue_number,
+            'head': head,
+            'base': base,
+        })
+        return response.json()
+
+
+def agent_messages(persona, description):
+    '''
+    The same system framing CrewAI gives an agent, built from its `(role, goal, backstory)` strings
+    in agents.py, followed by the task description.
+    '''
+    agent_role, goal, backstory = persona
+    return [
+        SystemMessage(content=f'You are {agent_role}. {backstory}\nYour personal goal is: {goal}'),
+        HumanMessage(content=description),
+    ]
+
+
+async def invoke_agent(llm, messages, llm_slots):
+    async with llm_slots:
+        response = await llm.ainvoke(messages)
+    return response.content
+
+
+async def invoke_routed_agent(persona, role, description, refactor_rounds, llm_slots):
+    '''Run on the routed model, escalating to the full model when the cheap output fails the quick check.'''
+    route = choose_route(role, description, refactor_rounds)
+    messages = agent_messages(persona, description)
+    while True:
+        output = await invoke_agent(get_route_llm(route), messages, llm_slots)
+        escalation = record_outcome(route, output)
+        if not escalation:
+            return output
+        route = escalation
+
+
+async def run_planner(client, issue, message_history, llm_slots):
+    try:
+        body, compacted_history = compact_message_history(issue['title'], issue['body'], message_history, cto_llm_name)
+        prompt = get_planner_prompt(issue['title'], body, compacted_history)
+        print(f'[run_planner] #{issue["number"]}: {count_tokens(prompt, cto_llm_name)} prompt tokens')
+        refactor_rounds = len([message for message in message_history if message.role == 'refactor_request'])
+        # Retrieval may fetch the repository, so it runs off the event loop.
+        project_context = await asyncio.to_thread(
+            get_project_context, client.repo_name, client.base_branch, f'{issue["title"]}\n{issue["body"]}', gh_access_token
+        )
+        output = await invoke_routed_agent(
+            (instructor_role, get_instructor_goal(project_context), instructor_backstory),
+            'planner', get_planner_task_description(prompt), refactor_rounds, llm_slots,
+        )
+        await client.create_comment(issue['number'], f'''{bot_flag_planner}\n{output}''')
+    except Exception as e:
+        print(f'[run_planner] Error: {e}')
+        raise e
+
+
+async def create_pull_request_from_plan(client, issue, plan):
+    '''Open the pull request for an approved plan, resuming an interrupted attempt (see start.py).'''
+    try:
+        workflow_store = get_workflow_store()
+        key = ('issue', issue['number'])
+        description = f'''Automated PR for Issue #{issue['number']}
+        Plan: {plan}
+        '''
+        plan_hash = hash_plan(plan)
+        new_branch_name = plan_branch_name(issue['number'], plan_hash)
+
+        state = workflow_store.get(client.repo_name, key)
+        if state and state.pull_number and state.plan_hash == plan_hash:
+            pull_request = await client.get_pull(state.pull_number)
+            if pull_request['state'] == 'open':
+                print(f'[create_pull_request_from_plan] #{issue["number"]} already has pull request #{state.pull_number}')
+                return None
+            print(f'[create_pull_request_from_plan] #{issue["number"]} pull request #{state.pull_number} is closed')
+
+        base_sha = await client.get_branch_sha(client.base_branch)
+        workflow_store.begin_pull_request(client.repo_name, key, plan_hash, new_branch_name)
+        # The branch is created with the plan file in one commit; 422 means an interrupted attempt already did.
+        await ignore_unprocessable(client.create_branch_with_files(
+            new_branch_name,
+            base_sha,
+            {f'plan_{issue["id"]}.md': description},
+            f'Create plan for {issue["title"]}',
+        ))
+        pull_request = await client.find_open_pull(new_branch_name)
+        if pull_request is None:
+            pull_request = await client.create_pull_from_issue(issue['number'], new_branch_name, client.base_branch)
+        workflow_store.finish_pull_request(client.repo_name, key, pull_request['number'])
+        return pull_request
+    except Exception as e:
+        print(f'[create_pull_request_from_plan] Error: {e}')
+        raise e
+
+
+async def ignore_unprocessable(request):
+    try:
+        return await request
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 422:
+            raise
+        return None
+
+
+async def run_refactor(client, pull_request, llm_slots):
+    try:
+        issue_comments = [comment['body'] for comment in await client.get_issue_comments(pull_request['number'])]
+        plan = snapshot_from_bodies(pull_request, issue_comments).plan
+        refactor_feedback = '\n'.join(body for body in issue_comments if body.lower().startswith('refactor'))
+
+        description = get_coder_refactor_task_description(
+            SimpleNamespace(html_url=pull_request['html_url']), plan, refactor_feedback
+        )
+        project_context = await asyncio.to_thread(
+            get_project_context, client.repo_name, client.base_branch, f'{plan}\n{refactor_feedback}', gh_access_token
+        )
+        if project_context:
+            description += f'\nRelevant code from the repository:\n{project_context}'
+        refactor_rounds = len([body for body in issue_comments if body.lower().startswith('refactor')])
+        output = await invoke_routed_agent((coder_role, coder_goal, coder_backstory), 'coder', description, refactor_rounds, llm_slots)
+
+        files = await client.get_pull_files(pull_request['number'])
+        changes = extract_file_changes(output, files[0]['filename'] if len(files) == 1 else None)
+        if not changes:
+            raise ValueError(f'No file changes found in the output for pull request #{pull_request["number"]}')
+
+        await client.commit_files(
+            pull_request['head']['ref'],
+            changes,
+            f'Refactored code for pull request #{pull_request["number"]}',
+        )
+        await client.create_comment(
+            pull_request['number'],
+            f'Refactored code based on the provided feedback:\n\n{output}',
+        )
+        print(f'Updated pull request: {pull_request["html_url"]}')
+    except Exception as e:
+        print(f'[run_refactor] Error: {e}')
+        raise e
+
+
+async def collect_async_jobs(client, tracker, llm_slots):
+    '''
+    Fetch a repository's changed items and read all their comments concurrently. Returns the planner
+    calls, approvals and refactors to run, as coroutines that have not been started.
+    '''
+    since = tracker.since()
+    issues, pulls = await asyncio.gather(client.get_open_issues(since), client.get_open_pulls(since))
+
+    seen_keys = {('issue', issue['number']) for issue in issues} | {('pull', pull['number']) for pull in pulls}
+    issues = [issue for issue in issues if not tracker.is_unchanged(('issue', issue['number']), issue['updated_at'])]
+    pulls = [pull for pull in pulls if not tracker.is_unchanged(('pull', pull['number']), pull['updated_at'])]
+
+    # Open pull requests also appear in the issues list; they are handled through `pulls`.
+    plain_issues = [issue for issue in issues if 'pull_request' not in issue]
+    for issue in issues:
+        if 'pull_request' in issue:
+            tracker.record(('issue', issue['number']), issue['updated_at'], 'pull_request_open')
+
+    issue_comments, review_comments = await asyncio.gather(
+        asyncio.gather(*[client.get_issue_comments(issue['number']) for issue in plain_issues]),
+        asyncio.gather(*[client.get_review_comments(pull['number']) for pull in pulls]),
+    )
+
+    jobs = []
+    for issue, comments in zip(plain_issues, issue_comments):
+        snapshot = snapshot_from_bodies(issue, [comment['body'] for comment in comments])
+        if snapshot.refactor_requested or not snapshot.planner_has_commented:
+            item_stage = 'needs_planner'
+            jobs.append(run_planner(client, issue, snapshot.message_history, llm_slots))
+        elif snapshot.approved:
+            item_stage = 'approved'
+            jobs.append(create_pull_request_from_plan(client, issue, snapshot.plan))
+        else:
+            item_stage = 'awaiting_human'
+        tracker.record(('issue', issue['number']), issue['updated_at'], item_stage)
+
+    for pull, comments in zip(pulls, review_comments):
+        if comments and comments[-1]['body'].lower().startswith('refactor'):
+            item_stage = 'needs_refactor'
+            jobs.append(run_refactor(client, pull, llm_slots))
+        else:
+            item_stage = 'awaiting_human'
+        tracker.record(('pull', pull['number']), pull['updated_at'], item_stage)
+
+    tracker.prune(seen_keys, full_sync=since is None)
+    print(f'- {client.repo_name}: {tracker.count("awaiting_human")} human tasks, {len(jobs)} bot jobs')
+    return jobs
+
+
+async def run_async_pass(repos, llm_slots):
+    '''
+    One pass of the loop over every repository: collect each repository's jobs, then run them all
+    concurrently. Jobs are started round-robin across repositories, so they queue for `llm_slots`
+    fairly. Failures are reported and retried next pass.
+    '''
+    job_groups = await asyncio.gather(
+        *[collect_async_jobs(client, tracker, llm_slots) for client, tracker in repos],
+        return_exceptions=True,
+    )
+    for (client, tracker), jobs in zip(repos, job_groups):
+        if isinstance(jobs, Exception):
+            print(f'[run_async_pass] {client.repo_name} Error: {jobs}')
+    jobs = round_robin([jobs for jobs in job_groups if not isinstance(jobs, Exception)])
+
+    print(f'- Bot job count: {len(jobs)}')
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        print(f'- Failed jobs: {len(failures)}')
+
+
+async def async_agent_loop(repo_names=gh_repo_names):
+    http_client = build_http_client(gh_access_token)
+    repos = [
+        (
+            AsyncGithubClient(repo_name, base_branch, http_client),
+            ChangeTracker(gh_full_sync_every, store=get_workflow_store(), repo_name=repo_name),
+        )
+        for repo_name, base_branch in repo_names
+    ]
+    llm_slots = asyncio.Semaphore(async_max_llm_calls)
+    poll_scheduler = PollScheduler()
+    loop_index = 0
+
+    try:
+        while True:
+            print(f'[async_agent_loop] Starting loop {loop_index}...')
+            start_time = monotonic()
+            changes = sum(tracker.changes for _, tracker in repos)
+            with stage('async_pass', loop_index=loop_index):
+                await run_async_pass(repos, llm_slots)
+            loop_index += 1
+            delay, reason = poll_scheduler.next_delay(
+                sum(tracker.changes for _, tracker in repos) - changes, monotonic() - start_time
+            )
+            print(f'[async_agent_loop] Next loop in {delay:.1f}s: {reason}')
+            await asyncio.sleep(delay)
+    except Exception as e:
+        print(f'[async_agent_loop] Error: {e}')
+        raise e
+    finally:
+        await http_client.aclose()
+
+
+def start_async_agent_loop():
+    asyncio.run(async_agent_loop())
@@ -0,0 +1,638 @@
+'''
+An in-memory fake of the GitHub REST endpoints the agent loop uses, and of the GraphQL queries of its
+`GH_FETCH_BACKEND=graphql` backend, for benchmarks.
+
+It serves one repository seeded with a configurable number of issues, comments and pull requests, and
+behaves like GitHub where it matters for throughput: paginated lists with `Link` headers, ETags and 304s
+(which are not counted against the rate limit), `X-RateLimit-*` headers with 403s once the quota is spent,
+and an injected latency per request. Every request is counted by method and route.
+
+Run it on its own with `python -m benchmarks.fake_github --port 8100`, or let `run_benchmark` start it.
+'''
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import random
+import re
+import threading
+from time import time
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+import uvicorn
+
+
+user = {'login': 'octocat', 'id': 1, 'type': 'User'}
+bot_flag_planner = '[coding agent]'
+seed_files = {
+    'package.json': '{\n  "name": "demo",\n  "version": "0.1.0"\n}\n',
+    'src/App.js': 'export default function App() {\n  return <h1>Hello</h1>;\n}\n',
+    'src/index.js': 'import App from "./App";\n',
+}
+
+
+def now():
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def object_sha(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class FakeGithub:
+    '''
+    The repository's state. Issues and pull requests share one number space, as on GitHub, and open
+    pull requests are also listed as issues. Issue `kind`s, in rotation, are: waiting for the planner,
+    waiting for a human, approved, and plain discussion; every `refactor_every`th pull request ends
+    with a refactor request.
+    '''
+
+    def __init__(self, repo_name='bench/repo', base_branch='main', issues=50, comments=5, pulls=10,
+                 review_comments=3, refactor_every=2, latency=0.0, rate_limit=5000, rate_window=3600):
+        self.repo_name = repo_name
+        self.owner = repo_name.split('/')[0]
+        self.base_branch = base_branch
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.rate_used = 0
+        self.rate_reset = int(time()) + rate_window
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.not_modified = 0
+        self.rate_limited = 0
+
+        self.issues = {}
+        self.pulls = {}
+        self.comments = {}
+        self.review_comments = {}
+        self.next_comment_id = 1
+        self.commits = {}
+        self.trees = {}
+        self.refs = {}
+
+        root = self.create_commit(self.create_tree(seed_files, None), [], 'Initial commit')
+        self.refs[f'refs/heads/{base_branch}'] = root
+        created_at = now() - timedelta(days=1)
+
+        for number in range(1, issues + 1):
+            self.issues[number] = {
+                'number': number,
+                'title': f'Issue {number}: change the heading of the app',
+                'body': f'The heading of App.js should say something else ({number}).',
+                'created_at': created_at,
+                'updated_at': created_at,
+            }
+            bodies = [f'Some discussion of issue {number} ({index}).' for index in range(comments)]
+            kind = number % 4
+            if kind in (1, 2):
+                bodies.append(f'{bot_flag_planner} Plan for issue {number}: update src/App.js.')
+            if kind == 2:
+                bodies.append('Approved, go ahead.')
+            for body in bodies:
+                self.add_comment(number, body, created_at)
+
+        for index in range(pulls):
+            number = issues + index + 1
+            branch = f'feature/seeded-{number}'
+            files = {'src/App.js': f'export default function App() {{\n  return <h1>Pull {number}</h1>;\n}}\n'}
+            tree = self.create_tree(files, self.commits[root]['tree'])
+            self.refs[f'refs/heads/{branch}'] = self.create_commit(tree, [root], f'Change for #{number}')
+            self.add_pull(number, f'Pull request {number}', f'Automated PR {number}', branch, list(files), created_at)
+            for comment_index in range(review_comments):
+                self.add_review_comment(number, f'Looks fine so far ({comment_index}).', created_at)
+            if index % refactor_every == 0:
+                self.add_review_comment(number, 'Refactor: make the heading configurable.', created_at)
+
+    # State changes
+
+    def add_comment(self, number, body, created_at=None):
+        created_at = created_at or now()
+        comment = {'id': self.next_comment_id, 'number': number, 'body': body,
+                   'created_at': created_at, 'updated_at': created_at}
+        self.next_comment_id += 1
+        self.comments[comment['id']] = comment
+        self.issues[number]['updated_at'] = created_at
+        return comment
+
+    def add_review_comment(self, number, body, created_at=None):
+        created_at = created_at or now()
+        comment = {'id': self.next_comment_id, 'number': number, 'body': body,
+                   'created_at': created_at, 'updated_at': created_at}
+        self.next_comment_id += 1
+        self.review_comments[comment['id']] = comment
+        self.pulls[number]['updated_at'] = created_at
+        self.issues[number]['updated_at'] = created_at
+        return comment
+
+    def add_pull(self, number, title, body, branch, files, created_at=None):
+        created_at = created_at or now()
+        if number not in self.issues:
+            self.issues[number] = {'number': number, 'title': title, 'body': body, 'created_at': created_at}
+        self.issues[number]['updated_at'] = created_at
+        self.pulls[number] = {'number': number, 'title': title, 'body': body, 'branch': branch, 'files': files,
+                              'created_at': created_at, 'updated_at': created_at}
+        return self.pulls[number]
+
+    def create_tree(self, files, base_tree):
+        contents = {**(self.trees[base_tree] if base_tree else {}), **files}
+        sha = object_sha('tree', contents)
+        self.trees[sha] = contents
+        return sha
+
+    def create_commit(self, tree, parents, message):
+        sha = object_sha('commit', tree, parents, message, uuid.uuid4().hex)
+        self.commits[sha] = {'tree': tree, 'parents': parents, 'message': message}
+        return sha
+
+    def churn(self, count, seed=None):
+        '''Simulate activity between passes: a human comment on `count` random open items.'''
+        rng = random.Random(seed)
+        with self.lock:
+            numbers = rng.sample(sorted(self.issues), min(count, len(self.issues)))
+            for number in numbers:
+                if number in self.pulls and rng.random() < 0.5:
+                    self.add_review_comment(number, 'Refactor: simplify this.')
+                elif number in self.pulls:
+                    self.add_comment(number, 'Any news on this one?')
+                else:
+                    self.add_comment(number, rng.choice(['Refactor: cover the edge cases too.', 'Approved.',
+                                                         'Any news on this one?']))
+        return numbers
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': sum(self.calls.values()),
+                'by_route': {f'{method} {route}': count for (method, route), count in sorted(self.calls.items())},
+                'not_modified': self.not_modified,
+                'rate_limited': self.rate_limited,
+                'rate_used': self.rate_used,
+                'pulls': len(self.pulls),
+                'comments': len(self.comments),
+            }
+
+    def take_rate_limit(self):
+        '''Count a request against the quota. Returns False once it is spent.'''
+        with self.lock:
+            if time() >= self.rate_reset:
+                self.rate_used = 0
+                self.rate_reset = int(time()) + self.rate_window
+            if self.rate_used >= self.rate_limit:
+                self.rate_limited += 1
+                return False
+            self.rate_used += 1
+            return True
+
+    def rate_limit_headers(self):
+        return {
+            'X-RateLimit-Limit': str(self.rate_limit),
+            'X-RateLimit-Remaining': str(max(0, self.rate_limit - self.rate_used)),
+            'X-RateLimit-Used': str(self.rate_used),
+            'X-RateLimit-Reset': str(self.rate_reset),
+            'X-RateLimit-Resource': 'core',
+        }
+
+    # JSON representations
+
+    def repo_json(self, base):
+        return {
+            'id': 1, 'name': self.repo_name.split('/')[1], 'full_name': self.repo_name,
+            'owner': {**user, 'login': self.owner}, 'private': False, 'default_branch': self.base_branch,
+            'url': f'{base}/repos/{self.repo_name}', 'html_url': f'https://github.com/{self.repo_name}',
+        }
+
+    def issue_json(self, base, issue):
+        number = issue['number']
+        url = f'{base}/repos/{self.repo_name}/issues/{number}'
+        data = {
+            'id': 1000 + number, 'number': number, 'title': issue['title'], 'body': issue['body'],
+            'state': 'open', 'user': user, 'labels': [],
+            'comments': sum(1 for comment in self.comments.values() if comment['number'] == number),
+            'created_at': timestamp(issue['created_at']), 'updated_at': timestamp(issue['updated_at']),
+            'url': url, 'comments_url': f'{url}/comments', 'repository_url': f'{base}/repos/{self.repo_name}',
+            'html_url': f'https://github.com/{self.repo_name}/issues/{number}',
+        }
+        if number in self.pulls:
+            data['pull_request'] = {
+                'url': f'{base}/repos/{self.repo_name}/pulls/{number}',
+                'html_url': f'https://github.com/{self.repo_name}/pull/{number}',
+            }
+        return data
+
+    def comment_json(self, base, comment, review=False):
+        kind = 'pulls' if review else 'issues'
+        return {
+            'id': comment['id'], 'body': comment['body'], 'user': user,
+            'created_at': timestamp(comment['created_at']), 'updated_at': timestamp(comment['updated_at']),
+            'url': f'{base}/repos/{self.repo_name}/{kind}/comments/{comment["id"]}',
+            'html_url': f'https://github.com/{self.repo_name}/issues/{comment["number"]}#comment-{comment["id"]}',
+            'issue_url': f'{base}/repos/{self.repo_name}/issues/{comment["number"]}',
+        }
+
+    def pull_json(self, base, pull):
+        number = pull['number']
+        url = f'{base}/repos/{self.repo_name}/pulls/{number}'
+        head_sha = self.refs.get(f'refs/heads/{pull["branch"]}')
+        base_sha = self.refs[f'refs/heads/{self.base_branch}']
+        return {
+            'id': 5000 + number, 'number': number, 'title': pull['title'], 'body': pull['body'], 'state': 'open',
+            'user': user, 'merged': False, 'draft': False,
+            'created_at': timestamp(pull['created_at']), 'updated_at': timestamp(pull['updated_at']),
+            'url': url, 'html_url': f'https://github.com/{self.repo_name}/pull/{number}',
+            'issue_url': f'{base}/repos/{self.repo_name}/issues/{number}',
+            'comments_url': f'{base}/repos/{self.repo_name}/issues/{number}/comments',
+            'review_comments_url': f'{url}/comments',
+            'head': {'ref': pull['branch'], 'sha': head_sha, 'label': f'{self.owner}:{pull["branch"]}',
+                     'user': user, 'repo': self.repo_json(base)},
+            'base': {'ref': self.base_branch, 'sha': base_sha, 'label': f'{self.owner}:{self.base_branch}',
+                     'user': user, 'repo': self.repo_json(base)},
+        }
+
+    def ref_json(self, base, ref):
+        sha = self.refs[ref]
+        return {
+            'ref': ref, 'url': f'{base}/repos/{self.repo_name}/git/{ref}',
+            'object': {'sha': sha, 'type': 'commit', 'url': f'{base}/repos/{self.repo_name}/git/commits/{sha}'},
+        }
+
+    def commit_json(self, base, sha):
+        commit = self.commits[sha]
+        return {
+            'sha': sha, 'message': commit['message'], 'url': f'{base}/repos/{self.repo_name}/git/commits/{sha}',
+            'tree': {'sha': commit['tree'], 'url': f'{base}/repos/{self.repo_name}/git/trees/{commit["tree"]}'},
+            'parents': [{'sha': parent, 'url': f'{base}/repos/{self.repo_name}/git/commits/{parent}'}
+                        for parent in commit['parents']],
+        }
+
+
+def graphql_page_sizes(query):
+    '''The `first:` argument of each connection in a query, by field name, e.g. `{'issues': 50, 'comments': 100}`.'''
+    return {field: int(size) for field, size in re.findall(r'(\w+)\([^()]*?first: (\d+)', query)}
+
+
+def connection(items, first, after, node):
+    '''A GraphQL connection over `items`; cursors are plain offsets.'''
+    start = int(after) if after else 0
+    page = items[start:start + first]
+    return {
+        'pageInfo': {'hasNextPage': start + first < len(items), 'endCursor': str(start + len(page))},
+        'nodes': [node(item) for item in page],
+    }
+
+
+def resolve_graphql(fake, query, variables):
+    '''
+    Answer the agent's own GraphQL queries (see `github_graphql`), recognized by their root fields rather
+    than parsed. Each review comment is its own review thread, as separate line comments are on GitHub.
+    '''
+    sizes = graphql_page_sizes(query)
+    cursor = variables.get('cursor')
+
+    def comments_of(number, first=None, after=None):
+        comments = [comment for comment in fake.comments.values() if comment['number'] == number]
+        return connection(comments, first or sizes['comments'], after, lambda comment: {'body': comment['body']})
+
+    def thread_comments(comment, after=None):
+        return connection([comment], sizes['comments'], after, lambda comment: {
+            'body': comment['body'], 'createdAt': timestamp(comment['created_at']),
+        })
+
+    def threads_of(number, after=None):
+        comments = [comment for comment in fake.review_comments.values() if comment['number'] == number]
+        return connection(comments, sizes['reviewThreads'], after, lambda comment: {
+            'id': f'thread-{comment["id"]}', 'comments': thread_comments(comment),
+        })
+
+    def issue_node(issue):
+        return {
+            'databaseId': 1000 + issue['number'], 'number': issue['number'], 'title': issue['title'],
+            'body': issue['body'], 'updatedAt': timestamp(issue['updated_at']), 'comments': comments_of(issue['number']),
+        }
+
+    def pull_node(pull):
+        return {
+            'databaseId': 5000 + pull['number'], 'number': pull['number'], 'title': pull['title'], 'body': pull['body'],
+            'url': f'https://github.com/{fake.repo_name}/pull/{pull["number"]}', 'state': 'OPEN',
+            'updatedAt': timestamp(pull['updated_at']), 'headRefName': pull['branch'],
+            'comments': comments_of(pull['number']), 'reviewThreads': threads_of(pull['number']),
+        }
+
+    if 'node(id:' in query:
+        comment = fake.review_comments[int(variables['id'].split('-')[1])]
+        return {'node': {'comments': thread_comments(comment, cursor)}}
+    if 'item: ' in query:
+        return {'repository': {'item': {'comments': comments_of(variables['number'], after=cursor)}}}
+    if 'pullRequest(number:' in query:
+        return {'repository': {'pullRequest': {'reviewThreads': threads_of(variables['number'], cursor)}}}
+    if 'pullRequests(' in query:
+        pulls = sorted(fake.pulls.values(), key=lambda pull: pull['updated_at'], reverse=True)
+        return {'repository': {'pullRequests': connection(pulls, sizes['pullRequests'], cursor, pull_node)}}
+    # Open pull requests are not issues here, unlike in the REST issues list.
+    issues = sorted(
+        (issue for issue in fake.issues.values() if issue['number'] not in fake.pulls),
+        key=lambda issue: issue['created_at'], reverse=True,
+    )
+    if variables.get('since'):
+        bound = datetime.fromisoformat(variables['since'].replace('Z', '+00:00'))
+        issues = [issue for issue in issues if issue['updated_at'] >= bound]
+    return {'repository': {'issues': connection(issues, sizes['issues'], cursor, issue_node)}}
+
+
+def paginate(request, items):
+    '''Slice `items` like GitHub, with `next` and `last` links carrying the rest of the query string.'''
+    per_page = min(100, int(request.query_params.get('per_page') or 30))
+    page = int(request.query_params.get('page') or 1)
+    last_page = max(1, -(-len(items) // per_page))
+    links = []
+    if page < last_page:
+        links.append(f'<{request.url.include_query_params(page=page + 1)}>; rel="next"')
+        links.append(f'<{request.url.include_query_params(page=last_page)}>; rel="last"')
+    return items[(page - 1) * per_page:page * per_page], {'Link': ', '.join(links)} if links else {}
+
+
+def respond(request, data, headers=None, status_code=200):
+    '''A JSON response with an ETag, or a bodyless 304 if the client already has this version.'''
+    body = json.dumps(data).encode('utf-8')
+    etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+    headers = {**(headers or {}), 'ETag': etag}
+    if request.method == 'GET' and request.headers.get('If-None-Match') == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+
+def build_app(fake):
+    app = FastAPI()
+    repo_path = '/repos/{owner}/{name}'
+
+    # PyGithub tells a missing object (UnknownObjectException) from other errors by GitHub's `message`.
+    @app.exception_handler(StarletteHTTPException)
+    async def github_error(request, exc):
+        return JSONResponse({'message': exc.detail}, status_code=exc.status_code)
+
+    @app.middleware('http')
+    async def simulate_github(request, call_next):
+        if request.url.path.startswith('/_bench'):
+            return await call_next(request)
+        if fake.latency:
+            await asyncio.sleep(fake.latency)
+        # As on GitHub, a conditional request answered with 304 does not use up the quota.
+        conditional = request.method == 'GET' and 'If-None-Match' in request.headers
+        if not conditional and not fake.take_rate_limit():
+            response = JSONResponse({'message': 'API rate limit exceeded'}, status_code=403)
+        else:
+            response = await call_next(request)
+            if response.status_code == 304:
+                with fake.lock:
+                    fake.not_modified += 1
+            elif conditional and not fake.take_rate_limit():
+                response = JSONResponse({'message': 'API rate limit exceeded'}, status_code=403)
+        route = request.scope.get('route')
+        with fake.lock:
+            fake.calls[(request.method, route.path if route else request.url.path)] += 1
+        response.headers.update(fake.rate_limit_headers())
+        return response
+
+    def base_url(request):
+        return str(request.base_url).rstrip('/')
+
+    def get_issue_or_404(number):
+        if number not in fake.issues:
+            raise HTTPException(404, 'Not Found')
+        return fake.issues[number]
+
+    def get_pull_or_404(number):
+        if number not in fake.pulls:
+            raise HTTPException(404, 'Not Found')
+        return fake.pulls[number]
+
+    @app.get('/_bench/stats')
+    def get_stats():
+        return fake.stats()
+
+    @app.post('/_bench/churn')
+    def post_churn(count: int = 5, seed: int = None):
+        return {'touched': fake.churn(count, seed)}
+
+    @app.post('/graphql')
+    async def graphql(request: Request):
+        payload = await request.json()
+        with fake.lock:
+            return {'data': resolve_graphql(fake, payload['query'], payload.get('variables') or {})}
+
+    @app.get(repo_path)
+    def get_repo(request: Request):
+        return respond(request, fake.repo_json(base_url(request)))
+
+    @app.get(repo_path + '/issues')
+    def list_issues(request: Request, since: str = None):
+        with fake.lock:
+            issues = sorted(fake.issues.values(), key=lambda issue: issue['created_at'], reverse=True)
+            if since:
+                bound = datetime.fromisoformat(since.replace('Z', '+00:00'))
+                issues = [issue for issue in issues if issue['updated_at'] >= bound]
+            page, headers = paginate(request, issues)
+            return respond(request, [fake.issue_json(base_url(request), issue) for issue in page], headers)
+
+    @app.get(repo_path + '/issues/{number}')
+    def get_issue(request: Request, number: int):
+        with fake.lock:
+            return respond(request, fake.issue_json(base_url(request), get_issue_or_404(number)))
+
+    @app.get(repo_path + '/issues/{number}/comments')
+    def list_issue_comments(request: Request, number: int):
+        with fake.lock:
+            get_issue_or_404(number)
+            comments = [comment for comment in fake.comments.values() if comment['number'] == number]
+            page, headers = paginate(request, comments)
+            return respond(request, [fake.comment_json(base_url(request), comment) for comment in page], headers)
+
+    @app.post(repo_path + '/issues/{number}/comments')
+    async def create_issue_comment(request: Request, number: int):
+        payload = await request.json()
+        with fake.lock:
+            get_issue_or_404(number)
+            comment = fake.add_comment(number, payload['body'])
+            return respond(request, fake.comment_json(base_url(request), comment), status_code=201)
+
+    @app.patch(repo_path + '/issues/comments/{comment_id}')
+    async def edit_issue_comment(request: Request, comment_id: int):
+        payload = await request.json()
+        with fake.lock:
+            if comment_id not in fake.comments:
+                raise HTTPException(404, 'Not Found')
+            comment = fake.comments[comment_id]
+            comment['body'] = payload['body']
+            comment['updated_at'] = now()
+            fake.issues[comment['number']]['updated_at'] = comment['updated_at']
+            return respond(request, fake.comment_json(base_url(request), comment))
+
+    @app.get(repo_path + '/pulls')
+    def list_pulls(request: Request, head: str = None, direction: str = 'desc'):
+        with fake.lock:
+            pulls = sorted(fake.pulls.values(), key=lambda pull: pull['updated_at'], reverse=direction == 'desc')
+            if head:
+                pulls = [pull for pull in pulls if f'{fake.owner}:{pull["branch"]}' == head]
+            page, headers = paginate(request, pulls)
+            return respond(request, [fake.pull_json(base_url(request), pull) for pull in page], headers)
+
+    # Registered before /pulls/{number} so that "comments" is not read as a number.
+    @app.get(repo_path + '/pulls/comments')
+    def list_review_comments(request: Request):
+        with fake.lock:
+            page, headers = paginate(request, list(fake.review_comments.values()))
+            return respond(request, [fake.comment_json(base_url(request), comment, review=True) for comment in page], headers)
+
+    @app.get(repo_path + '/pulls/{number}')
+    def get_pull(request: Request, number: int):
+        with fake.lock:
+            return respond(request, fake.pull_json(base_url(request), get_pull_or_404(number)))
+
+    @app.get(repo_path + '/pulls/{number}/comments')
+    def list_pull_review_comments(request: Request, number: int):
+        with fake.lock:
+            get_pull_or_404(number)
+            comments = [comment for comment in fake.review_comments.values() if comment['number'] == number]
+            page, headers = paginate(request, comments)
+            return respond(request, [fake.comment_json(base_url(request), comment, review=True) for comment in page], headers)
+
+    @app.get(repo_path + '/pulls/{number}/files')
+    def list_pull_files(request: Request, number: int):
+        with fake.lock:
+            files = [
+                {'filename': path, 'status': 'modified', 'additions': 1, 'deletions': 1, 'changes': 2,
+                 'sha': object_sha('blob', path)}
+                for path in get_pull_or_404(number)['files']
+            ]
+            page, headers = paginate(request, files)
+            return respond(request, page, headers)
+
+    @app.post(repo_path + '/pulls')
+    async def create_pull(request: Request):
+        payload = await request.json()
+        with fake.lock:
+            branch = payload['head'].split(':')[-1]
+            if f'refs/heads/{branch}' not in fake.refs:
+                raise HTTPException(422, 'Validation Failed')
+            if any(pull['branch'] == branch for pull in fake.pulls.values()):
+                raise HTTPException(422, 'A pull request already exists')
+            if 'issue' in payload:
+                number = int(payload['issue'])
+                issue = get_issue_or_404(number)
+                title, body = issue['title'], issue['body']
+            else:
+                number = max(fake.issues) + 1
+                title, body = payload['title'], payload.get('body', '')
+            files = list(fake.trees[fake.commits[fake.refs[f'refs/heads/{branch}']]['tree']])
+            pull = fake.add_pull(number, title, body, branch, files)
+            return respond(request, fake.pull_json(base_url(request), pull), status_code=201)
+
+    @app.get(repo_path + '/branches/{branch:path}')
+    def get_branch(request: Request, branch: str):
+        with fake.lock:
+            ref = f'refs/heads/{branch}'
+            if ref not in fake.refs:
+                raise HTTPException(404, 'Branch not found')
+            return respond(request, {'name': branch, 'commit': fake.commit_json(base_url(request), fake.refs[ref])})
+
+    # PyGithub reads a ref from git/refs/..., the REST docs (and the async client) from git/ref/...
+    @app.get(repo_path + '/git/ref/{ref:path}')
+    @app.get(repo_path + '/git/refs/{ref:path}')
+    def get_ref(request: Request, ref: str):
+        with fake.lock:
+            if f'refs/{ref}' not in fake.refs:
+                raise HTTPException(404, 'Not Found')
+            return respond(request, fake.ref_json(base_url(request), f'refs/{ref}'))
+
+    @app.post(repo_path + '/git/refs')
+    async def create_ref(request: Request):
+        payload = await request.json()
+        with fake.lock:
+            if payload['ref'] in fake.refs:
+                raise HTTPException(422, 'Reference already exists')
+            if payload['sha'] not in fake.commits:
+                raise HTTPException(422, 'Object does not exist')
+            fake.refs[payload['ref']] = payload['sha']
+            return respond(request, fake.ref_json(base_url(request), payload['ref']), status_code=201)
+
+    @app.patch(repo_path + '/git/refs/{ref:path}')
+    async def update_ref(request: Request, ref: str):
+        payload = await request.json()
+        with fake.lock:
+            name = f'refs/{ref}'
+            if name not in fake.refs:
+                raise HTTPException(404, 'Not Found')
+            # Not a fast-forward unless the current tip is a parent of the new commit.
+            if not payload.get('force') and fake.refs[name] not in fake.commits[payload['sha']]['parents']:
+                raise HTTPException(422, 'Update is not a fast forward')
+            fake.refs[name] = payload['sha']
+            return respond(request, fake.ref_json(base_url(request), name))
+
+    @app.get(repo_path + '/git/commits/{sha}')
+    def get_commit(request: Request, sha: str):
+        with fake.lock:
+            if sha not in fake.commits:
+                raise HTTPException(404, 'Not Found')
+            return respond(request, fake.commit_json(base_url(request), sha))
+
+    @app.post(repo_path + '/git/commits')
+    async def create_commit(request: Request):
+        payload = await request.json()
+        with fake.lock:
+            sha = fake.create_commit(payload['tree'], payload['parents'], payload['message'])
+            return respond(request, fake.commit_json(base_url(request), sha), status_code=201)
+
+    @app.post(repo_path + '/git/blobs')
+    async def create_blob(request: Request):
+        payload = await request.json()
+        sha = object_sha('blob', payload['content'])
+        return respond(request, {'sha': sha, 'url': f'{base_url(request)}/repos/{fake.repo_name}/git/blobs/{sha}'},
+                       status_code=201)
+
+    @app.post(repo_path + '/git/trees')
+    async def create_tree(request: Request):
+        payload = await request.json()
+        with fake.lock:
+            # Only the paths matter here; blob contents are not kept.
+            files = {entry['path']: entry.get('content', entry.get('sha')) for entry in payload['tree']}
+            sha = fake.create_tree(files, payload.get('base_tree'))
+            return respond(request, {
+                'sha': sha, 'url': f'{base_url(request)}/repos/{fake.repo_name}/git/trees/{sha}', 'tree': [],
+            }, status_code=201)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake GitHub REST and GraphQL API for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--repo', default='bench/repo')
+    parser.add_argument('--issues', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=5, help='comments per issue')
+    parser.add_argument('--pulls', type=int, default=10)
+    parser.add_argument('--review-comments', type=int, default=3, help='review comments per pull request')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--rate-limit', type=int, default=5000, help='requests per rate-limit window')
+    parser.add_argument('--rate-window', type=int, default=3600, help='rate-limit window in seconds')
+    args = parser.parse_args()
+
+    fake = FakeGithub(
+        repo_name=args.repo, issues=args.issues, comments=args.comments, pulls=args.pulls,
+        review_comments=args.review_comments, latency=args.latency, rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+    )
+    uvicorn.run(build_app(fake), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
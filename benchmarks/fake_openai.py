@@ -0,0 +1,216 @@
+'''
+A fake OpenAI-compatible server for benchmarks: `/v1/chat/completions` (plain, streamed, and tool calls)
+and `/v1/embeddings`.
+
+Completions are generated at a configurable token rate after a fixed time to first token, and read
+like a CrewAI agent's final answer: a short plan and one changed file. Tool-call requests (CrewAI's
+task evaluations) get arguments filled in from the tool's JSON schema.
+
+Run it on its own with `python -m benchmarks.fake_openai --port 8101`, or let `run_benchmark` start it.
+'''
+import argparse
+import asyncio
+import base64
+from collections import Counter
+import hashlib
+import json
+import threading
+from time import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import numpy as np
+import uvicorn
+
+
+embedding_dimensions = 64
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get('content') or ''
+        if isinstance(content, list):
+            content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+        parts.append(content)
+    return '\n'.join(parts)
+
+
+def sample_from_schema(schema, definitions):
+    '''A small value that validates against a JSON schema, enough for pydantic-parsed tool arguments.'''
+    if '$ref' in schema:
+        return sample_from_schema(definitions[schema['$ref'].split('/')[-1]], definitions)
+    for combinator in ('anyOf', 'oneOf', 'allOf'):
+        if combinator in schema:
+            return sample_from_schema(schema[combinator][0], definitions)
+    if 'enum' in schema:
+        return schema['enum'][0]
+    kind = schema.get('type', 'object')
+    if kind == 'object':
+        return {name: sample_from_schema(value, definitions) for name, value in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items', {'type': 'string'}), definitions)]
+    if kind in ('number', 'integer'):
+        return 8
+    if kind == 'boolean':
+        return True
+    if kind == 'null':
+        return None
+    return 'benchmark'
+
+
+def embed(text):
+    '''A deterministic unit vector, so identical texts embed identically.'''
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:4], 'little')
+    vector = np.random.default_rng(seed).standard_normal(embedding_dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class FakeOpenAI:
+    def __init__(self, tokens_per_second=50.0, first_token_latency=0.5, completion_tokens=300):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.completion_tokens = completion_tokens
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.tokens = Counter()
+
+    def record(self, kind, prompt_tokens, completion_tokens=0):
+        with self.lock:
+            self.calls[kind] += 1
+            self.tokens['prompt'] += prompt_tokens
+            self.tokens['completion'] += completion_tokens
+
+    def stats(self):
+        with self.lock:
+            return {'requests': sum(self.calls.values()), 'by_kind': dict(self.calls), 'tokens': dict(self.tokens)}
+
+    def answer(self):
+        '''A final answer with a plan and one changed file, padded to about `completion_tokens`.'''
+        code = 'export default function App() {\n  return <h1>Benchmark</h1>;\n}\n'
+        answer = f'Plan: update the heading.\n\nFile: src/App.js\n```js\n{code}```\n'
+        padding = max(0, self.completion_tokens - estimate_tokens(answer) - 10)
+        notes = ' '.join(['note'] * padding)
+        return f'Thought: I now know the final answer\nFinal Answer: {answer}\n{notes}'.rstrip()
+
+    def generation_seconds(self, completion_tokens):
+        return self.first_token_latency + completion_tokens / self.tokens_per_second
+
+
+def build_app(fake):
+    app = FastAPI()
+
+    @app.get('/_bench/stats')
+    def get_stats():
+        return fake.stats()
+
+    @app.post('/v1/chat/completions')
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        model = payload.get('model', 'gpt-3.5-turbo')
+        prompt_tokens = estimate_tokens(message_text(payload.get('messages', [])))
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time())
+
+        tools = [tool['function'] for tool in payload.get('tools', [])] or payload.get('functions', [])
+        if tools:
+            tool = tools[0]
+            parameters = tool.get('parameters', {})
+            arguments = json.dumps(sample_from_schema(parameters, parameters.get('$defs', parameters.get('definitions', {}))))
+            completion_tokens = estimate_tokens(arguments)
+            fake.record('tool_call', prompt_tokens, completion_tokens)
+            await asyncio.sleep(fake.generation_seconds(completion_tokens))
+            if 'tools' in payload:
+                message = {'role': 'assistant', 'content': None, 'tool_calls': [{
+                    'id': f'call_{uuid.uuid4().hex[:12]}', 'type': 'function',
+                    'function': {'name': tool['name'], 'arguments': arguments},
+                }]}
+                finish_reason = 'tool_calls'
+            else:
+                message = {'role': 'assistant', 'content': None,
+                           'function_call': {'name': tool['name'], 'arguments': arguments}}
+                finish_reason = 'function_call'
+            return {
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens},
+            }
+
+        content = fake.answer()
+        completion_tokens = estimate_tokens(content)
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                 'total_tokens': prompt_tokens + completion_tokens}
+
+        if payload.get('stream'):
+            fake.record('stream', prompt_tokens, completion_tokens)
+
+            def chunk(delta, finish_reason=None):
+                data = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+                return f'data: {json.dumps(data)}\n\n'
+
+            async def events():
+                await asyncio.sleep(fake.first_token_latency)
+                yield chunk({'role': 'assistant', 'content': ''})
+                # About four characters per token, a few tokens per chunk.
+                step = 16
+                for start in range(0, len(content), step):
+                    yield chunk({'content': content[start:start + step]})
+                    await asyncio.sleep(step / 4 / fake.tokens_per_second)
+                yield chunk({}, 'stop')
+                yield 'data: [DONE]\n\n'
+
+            return StreamingResponse(events(), media_type='text/event-stream')
+
+        fake.record('completion', prompt_tokens, completion_tokens)
+        await asyncio.sleep(fake.generation_seconds(completion_tokens))
+        return {
+            'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage,
+        }
+
+    @app.post('/v1/embeddings')
+    async def embeddings(request: Request):
+        payload = await request.json()
+        texts = payload['input'] if isinstance(payload['input'], list) else [payload['input']]
+        prompt_tokens = sum(estimate_tokens(str(text)) for text in texts)
+        fake.record('embedding', prompt_tokens)
+        data = []
+        for index, text in enumerate(texts):
+            vector = embed(str(text))
+            # The OpenAI SDK asks for base64 by default when numpy is installed.
+            if payload.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(vector.tobytes()).decode('ascii')
+            else:
+                embedding = vector.tolist()
+            data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+        return {
+            'object': 'list', 'data': data, 'model': payload.get('model', 'text-embedding-3-small'),
+            'usage': {'prompt_tokens': prompt_tokens, 'total_tokens': prompt_tokens},
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake OpenAI-compatible API for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8101)
+    parser.add_argument('--tokens-per-second', type=float, default=50.0)
+    parser.add_argument('--first-token-latency', type=float, default=0.5)
+    parser.add_argument('--completion-tokens', type=int, default=300)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.tokens_per_second, args.first_token_latency, args.completion_tokens)
+    uvicorn.run(build_app(fake), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
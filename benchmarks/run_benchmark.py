@@ -0,0 +1,213 @@
+'''
+Measure the agent loop offline: `start.run_poll_pass()` (one pass of `start_agent_loop`) against the fake
+GitHub and OpenAI servers, each started in its own process so that their work does not count against
+the loop's.
+
+    python -m benchmarks.run_benchmark --issues 200 --pulls 40 --loops 5 --github-latency 0.05 --output after.json
+    python -m benchmarks.run_benchmark --issues 200 --pulls 40 --loops 5 --github-latency 0.05 --baseline before.json
+
+Reports, per pass and overall: GitHub requests (and how many were answered with 304), LLM requests,
+wall time and tasks run, then tasks per minute and the peak RSS of the process. The first pass is a
+full sync with cold caches, so the steady-state figures are reported separately. Settings that are not
+about where requests go (AGENT_WORKERS, LLM_MAX_RPM, MODEL_ROUTER, COMMENT_STREAMING, ...) are read
+from the environment as usual, so the same scenario can be compared across them.
+'''
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import monotonic, sleep
+
+from dotenv import load_dotenv
+import requests
+
+
+def start_server(module, port, options):
+    process = subprocess.Popen([sys.executable, '-m', module, '--port', str(port), *options])
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(f'{url}/_bench/stats', timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{module} exited with {process.returncode}')
+            sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'{module} did not start on port {port}')
+
+
+def get_stats(url):
+    return requests.get(f'{url}/_bench/stats', timeout=10).json()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def configure_environment(args, github_url, openai_url, data_dir):
+    '''Point the agent at the fake servers and keep all of its state in `data_dir`.'''
+    load_dotenv()
+    if 'OPENROUTER_API_KEY' in os.environ:
+        sys.exit('OPENROUTER_API_KEY is set (in the environment or .env); remove it so that LLM calls go to the fake server.')
+
+    os.environ.update({
+        'GH_API_URL': github_url,
+        'GH_REPO_NAME': args.repo,
+        'GH_REPO_NAMES': '',
+        'GH_BASE_BRANCH': 'main',
+        'GH_ACCESS_TOKEN': 'benchmark',
+        'GH_FETCH_BACKEND': args.fetch_backend,
+        'GH_GRAPHQL_URL': f'{github_url}/graphql',
+        'GH_EVENT_MODE': 'poll',
+        'QUEUE_ROLE': '',
+        'ASYNC_MODE': '',
+        'LLM_BASE_URL': f'{openai_url}/v1',
+        'OPENAI_API_KEY': 'benchmark',
+        # The fake GitHub serves no git remote.
+        'GIT_WORKTREES': '',
+        'REPO_INDEX': '',
+        'METRICS_PORT': '',
+        'OTEL_EXPORTER_OTLP_ENDPOINT': '',
+        'OTEL_SDK_DISABLED': 'true',
+        'GH_HTTP_CACHE_PATH': os.path.join(data_dir, 'github_http_cache.sqlite'),
+        'LLM_CACHE_PATH': os.path.join(data_dir, 'llm_cache.sqlite'),
+        'MODEL_STATS_PATH': os.path.join(data_dir, 'model_stats.sqlite'),
+        'WORKFLOW_STATE_PATH': os.path.join(data_dir, 'workflow_state.sqlite'),
+        'WORK_QUEUE_PATH': os.path.join(data_dir, 'work_queue.sqlite'),
+        'MEMORY_STORE_PATH': os.path.join(data_dir, 'crew_memory.sqlite'),
+        'REPO_INDEX_PATH': os.path.join(data_dir, 'repo_index.sqlite'),
+        'GIT_CACHE_DIR': os.path.join(data_dir, 'git_cache'),
+    })
+
+
+def summarize(passes):
+    steady = passes[1:] or passes
+    total_seconds = sum(row['seconds'] for row in passes)
+    total_tasks = sum(row['tasks'] for row in passes)
+    return {
+        'passes': len(passes),
+        'first_pass_seconds': passes[0]['seconds'],
+        'first_pass_github_requests': passes[0]['github_requests'],
+        'steady_pass_seconds': statistics.mean(row['seconds'] for row in steady),
+        'steady_github_requests_per_pass': statistics.mean(row['github_requests'] for row in steady),
+        'github_requests_per_pass': statistics.mean(row['github_requests'] for row in passes),
+        'llm_requests_per_pass': statistics.mean(row['llm_requests'] for row in passes),
+        'tasks': total_tasks,
+        'failed_tasks': sum(row['failed_tasks'] for row in passes),
+        'tasks_per_minute': total_tasks / total_seconds * 60 if total_seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def print_summary(summary, baseline=None):
+    print('\nSummary')
+    for name, value in summary.items():
+        line = f'  {name:36} {value:10.2f}' if isinstance(value, float) else f'  {name:36} {value:10}'
+        if baseline and isinstance(baseline.get(name), (int, float)) and baseline[name]:
+            line += f'  ({(value - baseline[name]) / baseline[name]:+.1%} vs baseline {baseline[name]:.2f})'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the agent loop against fake GitHub and OpenAI servers.')
+    parser.add_argument('--loops', type=int, default=3, help='polling passes to run')
+    parser.add_argument('--repo', default='bench/repo')
+    parser.add_argument('--issues', type=int, default=50)
+    parser.add_argument('--comments', type=int, default=5, help='comments per issue')
+    parser.add_argument('--pulls', type=int, default=10)
+    parser.add_argument('--review-comments', type=int, default=3, help='review comments per pull request')
+    parser.add_argument('--github-latency', type=float, default=0.0, help='seconds added to every GitHub request')
+    parser.add_argument('--rate-limit', type=int, default=5000, help='GitHub requests per rate-limit window')
+    parser.add_argument('--rate-window', type=int, default=3600, help='rate-limit window in seconds')
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help='fake LLM generation speed')
+    parser.add_argument('--first-token-latency', type=float, default=0.5)
+    parser.add_argument('--completion-tokens', type=int, default=300)
+    parser.add_argument('--churn', type=int, default=0, help='items commented on by a "human" between passes')
+    parser.add_argument('--fetch-backend', choices=['rest', 'graphql'], default='rest', help='GH_FETCH_BACKEND to run with')
+    # Fixed ports, because recorded GitHub responses carry absolute URLs (see CASSETTE_MODE).
+    parser.add_argument('--github-port', type=int, default=8100)
+    parser.add_argument('--openai-port', type=int, default=8101)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    args = parser.parse_args()
+
+    github, github_url = start_server('benchmarks.fake_github', args.github_port, [
+        '--repo', args.repo, '--issues', str(args.issues), '--comments', str(args.comments),
+        '--pulls', str(args.pulls), '--review-comments', str(args.review_comments),
+        '--latency', str(args.github_latency), '--rate-limit', str(args.rate_limit),
+        '--rate-window', str(args.rate_window),
+    ])
+    openai, openai_url = start_server('benchmarks.fake_openai', args.openai_port, [
+        '--tokens-per-second', str(args.tokens_per_second), '--first-token-latency', str(args.first_token_latency),
+        '--completion-tokens', str(args.completion_tokens),
+    ])
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='agent-benchmark-') as data_dir:
+            configure_environment(args, github_url, openai_url, data_dir)
+            # Imported only now: modules read their configuration at import time.
+            import start
+            from telemetry import metrics
+
+            passes = []
+            for loop_index in range(args.loops):
+                github_before, llm_before = get_stats(github_url), get_stats(openai_url)
+                tasks_before = metrics.total('agent_stage_seconds', stage='task')
+                failed_before = metrics.total('agent_stage_errors_total', stage='task')
+                start_time = monotonic()
+                start.run_poll_pass()
+                # The pass only queues its work; wait for it so the pass's numbers include the tasks.
+                start.scheduler.wait_idle()
+                seconds = monotonic() - start_time
+                github_after, llm_after = get_stats(github_url), get_stats(openai_url)
+
+                row = {
+                    'loop': loop_index,
+                    'seconds': seconds,
+                    'github_requests': github_after['requests'] - github_before['requests'],
+                    'github_not_modified': github_after['not_modified'] - github_before['not_modified'],
+                    'github_rate_limited': github_after['rate_limited'] - github_before['rate_limited'],
+                    'llm_requests': llm_after['requests'] - llm_before['requests'],
+                    'tasks': metrics.total('agent_stage_seconds', stage='task') - tasks_before,
+                    'failed_tasks': metrics.total('agent_stage_errors_total', stage='task') - failed_before,
+                }
+                passes.append(row)
+                print(
+                    f'[run_benchmark] Pass {loop_index}: {seconds:.2f}s, {row["github_requests"]} GitHub requests '
+                    f'({row["github_not_modified"]} not modified, {row["github_rate_limited"]} rate limited), '
+                    f'{row["llm_requests"]} LLM requests, {row["tasks"]} tasks ({row["failed_tasks"]} failed)'
+                )
+                if args.churn and loop_index < args.loops - 1:
+                    requests.post(f'{github_url}/_bench/churn', params={'count': args.churn, 'seed': loop_index}, timeout=10)
+
+            summary = summarize(passes)
+            baseline = None
+            if args.baseline:
+                with open(args.baseline) as file:
+                    baseline = json.load(file)['summary']
+            print_summary(summary, baseline)
+            if args.output:
+                with open(args.output, 'w') as file:
+                    json.dump({
+                        'config': vars(args),
+                        'passes': passes,
+                        'summary': summary,
+                        'github_routes': get_stats(github_url)['by_route'],
+                        'llm': get_stats(openai_url),
+                    }, file, indent=2)
+                print(f'[run_benchmark] Wrote {args.output}')
+            start.scheduler.executor.shutdown()
+    finally:
+        github.terminate()
+        openai.terminate()
+
+
+if __name__ == '__main__':
+    main()
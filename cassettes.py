@@ -0,0 +1,226 @@
+from collections import Counter, deque
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+load_dotenv()
+
+# `record` writes every GitHub request and LLM call, with its response, to CASSETTE_PATH; `replay` answers them
+# from it without touching the network, rate limiters or caches. Empty (default) is off.
+cassette_mode = os.environ.get('CASSETTE_MODE') or ''
+cassette_path = os.environ.get('CASSETTE_PATH') or '.cassette.jsonl.gz'
+
+# Only the headers the agent reads back are kept; bodies are stored decoded.
+kept_headers = ('content-type', 'etag', 'last-modified', 'link', 'location', 'retry-after', 'x-ratelimit-')
+not_recorded_status = 404
+
+
+def request_key(method, url, body):
+    '''`(method, path and query, body digest)`; the host is left out so a cassette works against any base URL.'''
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return method.upper(), target, hashlib.sha256(body or b'').hexdigest()[:16]
+
+
+def encode_content(content):
+    try:
+        return {'text': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(content).decode('ascii')}
+
+
+def decode_content(entry):
+    if 'base64' in entry:
+        return base64.b64decode(entry['base64'])
+    return entry['text'].encode('utf-8')
+
+
+class Cassette:
+    '''
+    Recorded HTTP exchanges, one JSON line each in a gzip file.
+
+    Replay matches a request on method, path, query and body first, then on method, path and query alone,
+    so that a prompt that changed slightly (e.g. different memory context) still gets an answer. Requests
+    made several times are answered in recorded order; the last answer is repeated once they run out.
+    A request that was never recorded gets a 404 saying so.
+    '''
+
+    def __init__(self, path, mode):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'CASSETTE_MODE must be record or replay, not {mode!r}')
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.file = None
+        self.exact = {}
+        self.loose = {}
+        if mode == 'record':
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+            atexit.register(self.close)
+        else:
+            self.load()
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    entry = json.loads(line)
+                    key = tuple(entry['key'])
+                    self.exact.setdefault(key, deque()).append(entry)
+                    self.loose.setdefault(key[:2], deque()).append(entry)
+            except EOFError:
+                # The recording process was killed; everything flushed before that is still usable.
+                pass
+        print(f'[Cassette.load] {sum(map(len, self.exact.values()))} exchanges from {self.path}')
+
+    def record(self, method, url, body, status, headers, content):
+        entry = {
+            'key': request_key(method, url, body),
+            'status': status,
+            'headers': {name: value for name, value in headers.items() if name.lower().startswith(kept_headers)},
+            **encode_content(content),
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            # Flushed per exchange so that a killed process leaves a readable cassette.
+            self.file.flush()
+            self.stats['recorded'] += 1
+
+    def play(self, method, url, body):
+        '''The recorded entry for a request, or None.'''
+        key = request_key(method, url, body)
+        with self.lock:
+            responses = self.exact.get(key)
+            if responses:
+                self.stats['exact'] += 1
+            else:
+                responses = self.loose.get(key[:2])
+                self.stats['loose' if responses else 'missing'] += 1
+            if not responses:
+                print(f'[Cassette.play] Not recorded: {method} {url}')
+                return None
+            return responses.popleft() if len(responses) > 1 else responses[0]
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def play_requests(self, method, url, body):
+        '''Replay as a `requests.Response`, for PyGithub and the GraphQL client.'''
+        entry = self.play(method, url, body)
+        response = requests.Response()
+        response.url = url
+        response.encoding = 'utf-8'
+        if entry is None:
+            response.status_code = not_recorded_status
+            response.headers = CaseInsensitiveDict({'content-type': 'application/json'})
+            response._content = json.dumps({'message': f'Not in cassette: {method} {url}'}).encode('utf-8')
+            return response
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = decode_content(entry)
+        return response
+
+    def record_requests(self, method, url, body, response):
+        self.record(method, url, body, response.status_code, response.headers, response.content)
+
+    def play_httpx(self, request):
+        entry = self.play(request.method, str(request.url), request.content)
+        if entry is None:
+            return httpx.Response(not_recorded_status, request=request, json={
+                'error': {'message': f'Not in cassette: {request.method} {request.url}'},
+            })
+        return httpx.Response(entry['status'], headers=entry['headers'], content=decode_content(entry), request=request)
+
+    def record_httpx(self, request, response):
+        self.record(request.method, str(request.url), request.content, response.status_code, response.headers,
+                    response.content)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    '''
+    An httpx transport (the OpenAI SDK's) that records through `inner` or replays. A recorded response is
+    read whole before it is returned, so streamed completions arrive in one piece while recording.
+    '''
+
+    def __init__(self, cassette, inner=None):
+        self.cassette = cassette
+        self.inner = inner or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        if self.cassette.replaying:
+            return self.cassette.play_httpx(request)
+        response = self.inner.handle_request(request)
+        response.read()
+        self.cassette.record_httpx(request, response)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette, inner=None):
+        self.cassette = cassette
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        if self.cassette.replaying:
+            return self.cassette.play_httpx(request)
+        response = await self.inner.handle_async_request(request)
+        await response.aread()
+        self.cassette.record_httpx(request, response)
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def send_through_cassette(method, url, body, send):
+    '''
+    Call `send()` (returning a `requests.Response`) and record the exchange, or answer from the cassette
+    instead when replaying. Without a cassette this is just `send()`.
+    '''
+    cassette = get_cassette()
+    if cassette is None:
+        return send()
+    if cassette.replaying:
+        return cassette.play_requests(method, url, body)
+    response = send()
+    cassette.record_requests(method, url, body, response)
+    return response
+
+
+cassette = None
+cassette_lock = threading.Lock()
+
+
+def get_cassette():
+    '''The process's cassette, or None when CASSETTE_MODE is off.'''
+    global cassette
+    if not cassette_mode:
+        return None
+    with cassette_lock:
+        if cassette is None:
+            cassette = Cassette(cassette_path, cassette_mode)
+        return cassette
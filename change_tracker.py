@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+
+# Stages that only a human can move forward, or (`queued`) that the work queue now owns. Items in
+# these stages are skipped until GitHub reports a newer `updated_at` for them.
+settled_stages = ('awaiting_human', 'pull_request_open', 'queued')
+
+
+def to_datetime(value):
+    '''Normalize PyGithub datetimes and GraphQL ISO-8601 strings to aware UTC datetimes.'''
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class ChangeTracker:
+    '''
+    Local state table of each issue's and pull request's last-known `updated_at` and workflow stage.
+    Keys are `('issue', number)` or `('pull', number)`. With a `store` (a `WorkflowStore`), the table
+    is loaded from and written through to disk, so a restart skips items whose stage has not changed.
+    '''
+
+    def __init__(self, full_sync_every=60, store=None, repo_name=None):
+        self.store = store
+        self.repo_name = repo_name
+        self.items = store.items(repo_name) if store else {}
+        self.full_sync_every = full_sync_every
+        self.passes = 0
+        # Items seen with a new `updated_at`, counted across passes; the poll scheduler reads this as activity.
+        self.changes = 0
+
+    def since(self):
+        '''
+        The `since=` bound for the next fetch, or None for a full sync.
+        Unsettled items pin the bound so they are fetched again until their work is done.
+        '''
+        self.passes += 1
+        if not self.items or (self.full_sync_every and (self.passes - 1) % self.full_sync_every == 0):
+            return None
+
+        pending = [updated_at for updated_at, stage in self.items.values() if stage not in settled_stages]
+        high_water_mark = min(pending) if pending else max(updated_at for updated_at, _ in self.items.values())
+        # GitHub's `since` filter is documented as "after"; step back so the boundary item is re-read.
+        return high_water_mark - timedelta(seconds=1)
+
+    def is_unchanged(self, key, updated_at):
+        if key not in self.items:
+            return False
+        known_updated_at, stage = self.items[key]
+        return known_updated_at == to_datetime(updated_at) and stage in settled_stages
+
+    def record(self, key, updated_at, stage):
+        if key not in self.items or self.items[key][0] != to_datetime(updated_at):
+            self.changes += 1
+        self.items[key] = (to_datetime(updated_at), stage)
+        if self.store:
+            self.store.record_stage(self.repo_name, key, updated_at, stage)
+
+    def prune(self, seen_keys, full_sync):
+        '''
+        Drop items that are no longer open. After a full sync that is everything not seen; after an
+        incremental pass it is only unsettled items, since those are always inside the `since` window.
+        '''
+        for key in list(self.items):
+            if key in seen_keys:
+                continue
+            if full_sync or self.items[key][1] not in settled_stages:
+                del self.items[key]
+                if self.store:
+                    self.store.delete(self.repo_name, key)
+
+    def count(self, stage):
+        return len([key for key, (_, item_stage) in self.items.items() if item_stage == stage])
@@ -0,0 +1,39 @@
+import re
+
+
+fenced_block_pattern = re.compile(r'```[^\n]*\n(.*?)```', re.DOTALL)
+# A `File: path` line (optionally in bold or a heading) followed by a fenced block, or a path as the fence's info string.
+file_block_pattern = re.compile(
+    r'^[#*\s]*File:\s*`?(?P<header_path>[^\s`*]+)`?\**\s*\n+```[^\n]*\n(?P<header_body>.*?)```'
+    r'|^```(?:\w+\s+)?(?P<info_path>[\w.-]*[/.][\w./-]+)\n(?P<info_body>.*?)```',
+    re.DOTALL | re.MULTILINE,
+)
+
+file_changes_instructions = '''
+        Give the complete new contents of every file you change, each as a line `File: <path from the repository root>`
+        followed by a fenced code block with the file's contents.
+'''
+
+
+def extract_code_changes(output):
+    '''
+    Return the code from an agent's output: the first fenced code block, or the whole output if it has none.
+    '''
+    match = fenced_block_pattern.search(output)
+    if match:
+        return match.group(1)
+    return output.strip() + '\n'
+
+
+def extract_file_changes(output, default_path=None):
+    '''
+    Return `{path: contents}` for every file in an agent's output, in the format of `file_changes_instructions`.
+    Output without file paths is taken as the new contents of `default_path`, when there is one.
+    '''
+    changes = {}
+    for match in file_block_pattern.finditer(output):
+        path = (match.group('header_path') or match.group('info_path')).removeprefix('./')
+        changes[path] = match.group('header_body') if match.group('header_path') else match.group('info_body')
+    if not changes and default_path:
+        changes[default_path] = extract_code_changes(output)
+    return changes
@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+import os
+import threading
+from time import monotonic
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+load_dotenv()
+
+streaming_enabled = os.environ.get('COMMENT_STREAMING') == 'True'
+# Minimum seconds between edits of a streamed comment. Edits count against GitHub's content-creation limit.
+stream_interval_seconds = float(os.environ.get('COMMENT_STREAM_INTERVAL') or 5)
+# Drafts must not start with `bot_flag_planner`, or a draft left behind by a crash would read as a finished plan.
+draft_flag = '[coding agent: drafting]'
+
+pending_streams = {}
+pending_lock = threading.Lock()
+active = threading.local()
+
+
+class CommentStream:
+    '''
+    Mirrors an agent's output into one issue comment while it is generated. The comment is created on the
+    first token, edited in the background at most every `stream_interval_seconds`, and replaced with the
+    final body by `finish()`. Each new LLM call (one agent step) replaces the draft text.
+    '''
+
+    def __init__(self, key, issue_loader):
+        self.key = key
+        self.issue_loader = issue_loader
+        self.comment = None
+        self.text = ''
+        self.last_flush = 0
+        self.flush_thread = None
+        self.lock = threading.Lock()
+
+    def start_call(self):
+        with self.lock:
+            self.text = ''
+
+    def append(self, token):
+        with self.lock:
+            self.text += token
+            due = self.comment is None or monotonic() - self.last_flush >= stream_interval_seconds
+            idle = self.flush_thread is None or not self.flush_thread.is_alive()
+            if not (due and idle):
+                return
+            self.last_flush = monotonic()
+            body = f'{draft_flag}\n{self.text}\n\n_Still generating..._'
+            # Write in the background so a slow or rate-limited GitHub call never stalls the token stream.
+            self.flush_thread = threading.Thread(target=self.flush, args=(body,), daemon=True)
+            self.flush_thread.start()
+
+    def write(self, body):
+        if self.comment is None:
+            self.comment = self.issue_loader().create_comment(body=body)
+        else:
+            self.comment.edit(body)
+
+    def flush(self, body):
+        '''A background draft update. A failed one is only reported; the next flush or `finish` rewrites it.'''
+        try:
+            self.write(body)
+        except Exception as e:
+            print(f'[CommentStream.flush] Error: {e}')
+
+    def wait(self):
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+
+    def finish(self, body):
+        '''Replace the draft with the final body. Raises if that fails, so the task fails and is retried.'''
+        self.wait()
+        self.write(body)
+
+    def abandon(self):
+        self.wait()
+        if self.comment is not None:
+            self.write(f'{draft_flag}\nThis draft was interrupted and will be retried.')
+
+
+def register_stream(key, issue_loader):
+    '''
+    Stream the next run of work item `key` into a comment. A re-run inside an active stream for the
+    same item (a model escalation) keeps writing to the existing comment.
+    '''
+    if not streaming_enabled:
+        return
+    current = current_stream()
+    if current is not None and current.key == key:
+        return
+    with pending_lock:
+        pending_streams[key] = CommentStream(key, issue_loader)
+
+
+def current_stream():
+    return getattr(active, 'stream', None)
+
+
+@contextmanager
+def activate_stream(key):
+    '''Route LLM tokens on this thread to the stream registered for `key`, if any.'''
+    with pending_lock:
+        stream = pending_streams.pop(key, None)
+    if stream is None:
+        yield current_stream()
+        return
+
+    previous = current_stream()
+    active.stream = stream
+    try:
+        yield stream
+    except Exception:
+        stream.abandon()
+        raise
+    finally:
+        active.stream = previous
+
+
+class CommentStreamHandler(BaseCallbackHandler):
+    '''Forwards streamed tokens to the comment stream active on the calling thread.'''
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        stream = current_stream()
+        if stream is not None:
+            stream.start_call()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.on_llm_start(serialized, messages, **kwargs)
+
+    def on_llm_new_token(self, token, **kwargs):
+        stream = current_stream()
+        if stream is not None:
+            stream.append(token)
@@ -0,0 +1,222 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from time import time
+
+from dotenv import load_dotenv
+import numpy as np
+from crewai import Crew
+from pydantic import Field, model_validator
+
+from llms import get_provider, get_sdk_clients
+
+
+load_dotenv()
+
+memory_store_path = os.environ.get('MEMORY_STORE_PATH') or '.crew_memory.sqlite'
+# The store is kept under these bounds; the least recently used entries go first.
+memory_max_items = int(os.environ.get('MEMORY_MAX_ITEMS') or 5000)
+memory_ttl_seconds = int(os.environ.get('MEMORY_TTL_DAYS') or 30) * 24 * 3600
+# `none` falls back to word-overlap search, as do providers without an embeddings endpoint.
+memory_embedding_model = os.environ.get('MEMORY_EMBEDDING_MODEL') or (
+    'text-embedding-3-small' if get_provider() == 'openai' else ''
+)
+if memory_embedding_model.lower() == 'none':
+    memory_embedding_model = ''
+# Eviction runs every this many writes rather than on each one.
+evict_every = 50
+# Only the most recently used entries of a scope are searched.
+max_candidates = 300
+embedding_batch_size = 100
+word_pattern = re.compile(r'[a-z0-9_]{3,}')
+
+
+def words(text):
+    return set(word_pattern.findall((text or '').lower()))
+
+
+class MemoryStore:
+    '''
+    One SQLite store behind the memory of every crew, kept across loops. Entries are scoped (by repository,
+    issue or pull request), capped at `max_items` with LRU eviction and expired after `ttl_seconds`.
+
+    Entries are written without embeddings. A search embeds the entries of its scope that still lack one,
+    together with the query, in as few batched calls as possible.
+    '''
+
+    def __init__(self, path, max_items, ttl_seconds, embedding_model):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.embedding_model = embedding_model
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS memories_scope ON memories (kind, scope, used_at);
+            CREATE INDEX IF NOT EXISTS memories_used_at ON memories (used_at);
+        ''')
+        self.db.commit()
+
+    def save(self, kind, scope, content, metadata=None):
+        now = time()
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT INTO memories (kind, scope, content, metadata, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, scope, content, json.dumps(metadata or {}, default=str), now, now),
+            )
+            self.writes += 1
+            if self.writes % evict_every == 0:
+                self.evict()
+
+    def evict(self):
+        self.db.execute('DELETE FROM memories WHERE used_at < ?', (time() - self.ttl_seconds,))
+        self.db.execute('''
+            DELETE FROM memories WHERE id IN (
+                SELECT id FROM memories ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_items,))
+
+    def embed(self, texts):
+        client = get_sdk_clients(get_provider())[0]
+        vectors = []
+        for start in range(0, len(texts), embedding_batch_size):
+            response = client.embeddings.create(model=self.embedding_model, input=texts[start:start + embedding_batch_size])
+            vectors.extend(np.array(item.embedding, dtype=np.float32) for item in response.data)
+        return vectors
+
+    def search(self, kind, scope, query, limit=3, min_score=0.35):
+        '''The entries of a scope most similar to `query`, as `(content, metadata, score)`, best first.'''
+        with self.lock:
+            rows = self.db.execute('''
+                SELECT id, content, metadata, embedding FROM memories
+                WHERE kind = ? AND scope = ? ORDER BY used_at DESC LIMIT ?
+            ''', (kind, scope, max_candidates)).fetchall()
+        if not rows:
+            return []
+
+        if self.embedding_model:
+            missing = [row for row in rows if row[3] is None]
+            vectors = self.embed([query] + [row[1] for row in missing])
+            query_vector = vectors[0]
+            new_embeddings = {row[0]: vector for row, vector in zip(missing, vectors[1:])}
+            with self.lock, self.db:
+                self.db.executemany(
+                    'UPDATE memories SET embedding = ? WHERE id = ?',
+                    [(vector.tobytes(), id) for id, vector in new_embeddings.items()],
+                )
+            matrix = np.stack([
+                new_embeddings[row[0]] if row[0] in new_embeddings else np.frombuffer(row[3], dtype=np.float32)
+                for row in rows
+            ])
+            scores = matrix @ query_vector / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector) + 1e-9)
+        else:
+            query_words = words(query)
+            scores = [len(query_words & words(row[1])) / (len(query_words) or 1) for row in rows]
+
+        ranked = sorted(zip(rows, scores), key=lambda pair: pair[1], reverse=True)
+        results = [(row, float(score)) for row, score in ranked[:limit] if score >= min_score]
+        with self.lock, self.db:
+            self.db.executemany('UPDATE memories SET used_at = ? WHERE id = ?', [(time(), row[0]) for row, _ in results])
+        return [(row[1], json.loads(row[2]), score) for row, score in results]
+
+    def latest(self, kind, scope, limit):
+        with self.lock:
+            rows = self.db.execute('''
+                SELECT content, metadata FROM memories WHERE kind = ? AND scope = ? ORDER BY created_at DESC LIMIT ?
+            ''', (kind, scope, limit)).fetchall()
+        return [(content, json.loads(metadata)) for content, metadata in rows]
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM memories').fetchone()[0]
+
+
+memory_store = None
+memory_store_lock = threading.Lock()
+
+
+def get_memory_store():
+    global memory_store
+    with memory_store_lock:
+        if memory_store is None:
+            memory_store = MemoryStore(memory_store_path, memory_max_items, memory_ttl_seconds, memory_embedding_model)
+        return memory_store
+
+
+class ScopedShortTermMemory:
+    '''CrewAI's short-term memory interface over the shared store, scoped to one issue or pull request.'''
+
+    kind = 'short_term'
+
+    def __init__(self, store, scope):
+        self.store = store
+        self.scope = scope
+
+    def save(self, item):
+        '''Save a CrewAI `ShortTermMemoryItem`.'''
+        self.store.save(self.kind, self.scope, str(item.data), {**item.metadata, 'agent': item.agent})
+
+    def search(self, query, score_threshold=0.35):
+        return [
+            {'context': content, 'metadata': metadata, 'score': score}
+            for content, metadata, score in self.store.search(self.kind, self.scope, query, min_score=score_threshold)
+        ]
+
+
+class ScopedEntityMemory(ScopedShortTermMemory):
+    kind = 'entity'
+
+    def save(self, item):
+        self.store.save(self.kind, self.scope, f'{item.name}({item.type}): {item.description}', {
+            'relationships': item.relationships,
+        })
+
+
+class ScopedLongTermMemory:
+    '''CrewAI's long-term memory (task evaluations and their suggestions), scoped to a repository.'''
+
+    def __init__(self, store, scope):
+        self.store = store
+        self.scope = scope
+
+    def save(self, item):
+        metadata = {**item.metadata, 'agent': item.agent, 'expected_output': item.expected_output}
+        self.store.save('long_term', self.scope, item.task, {**metadata, 'datetime': item.datetime, 'quality': item.quality})
+
+    def search(self, task, latest_n=3):
+        return [
+            {'metadata': metadata, 'datetime': metadata.get('datetime'), 'score': metadata.get('quality')}
+            for content, metadata, score in self.store.search('long_term', self.scope, task, limit=latest_n, min_score=0)
+        ]
+
+
+class ManagedMemoryCrew(Crew):
+    '''
+    A crew whose memory lives in the shared `MemoryStore` instead of new Chroma and SQLite stores per crew.
+    `memory_scope` is the work item key, `(repo_name, kind, number)`.
+    '''
+
+    memory_scope: tuple = Field(default=('', '', 0))
+
+    @model_validator(mode='after')
+    def create_crew_memory(self) -> 'ManagedMemoryCrew':
+        if self.memory:
+            store = get_memory_store()
+            repo_name, kind, number = self.memory_scope
+            self._short_term_memory = ScopedShortTermMemory(store, f'{repo_name}:{kind}:{number}')
+            self._entity_memory = ScopedEntityMemory(store, f'{repo_name}:{kind}:{number}')
+            self._long_term_memory = ScopedLongTermMemory(store, repo_name)
+        return self
@@ -0,0 +1,42 @@
+from github import InputGitTreeElement
+
+
+# Files up to this size are sent inline in the tree request; larger ones are uploaded as blobs first.
+inline_content_max_bytes = 64 * 1024
+
+
+def tree_elements(repo, files):
+    elements = []
+    for path, content in files.items():
+        if len(content.encode('utf-8')) <= inline_content_max_bytes:
+            elements.append(InputGitTreeElement(path, '100644', 'blob', content=content))
+        else:
+            blob = repo.create_git_blob(content, 'utf-8')
+            elements.append(InputGitTreeElement(path, '100644', 'blob', sha=blob.sha))
+    return elements
+
+
+def build_commit(repo, parent_sha, files, message):
+    '''Create one commit on top of `parent_sha` that writes all of `files` (`{path: contents}`).'''
+    parent = repo.get_git_commit(parent_sha)
+    tree = repo.create_git_tree(tree_elements(repo, files), base_tree=parent.tree)
+    return repo.create_git_commit(message, tree, [parent])
+
+
+def commit_files(repo, branch, files, message):
+    '''
+    Commit all of `files` to `branch` as a single commit and move the branch to it. The ref update is
+    not forced, so if the branch moved in the meantime it fails rather than dropping the other commit,
+    and nothing is half-applied.
+    '''
+    ref = repo.get_git_ref(f'heads/{branch}')
+    commit = build_commit(repo, ref.object.sha, files, message)
+    ref.edit(commit.sha)
+    return commit
+
+
+def create_branch_with_files(repo, branch, base_sha, files, message):
+    '''Create `branch` from `base_sha` with one commit adding `files`; the branch only appears once it is complete.'''
+    commit = build_commit(repo, base_sha, files, message)
+    repo.create_git_ref(ref=f'refs/heads/{branch}', sha=commit.sha)
+    return commit
@@ -0,0 +1,193 @@
+import base64
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Give the coder a local checkout of the pull request branch to read and edit, and push one commit at the end.
+worktrees_enabled = os.environ.get('GIT_WORKTREES') == 'True'
+git_cache_dir = os.environ.get('GIT_CACHE_DIR') or '.git_cache'
+# Point at another git server, e.g. a local one for testing. `{repo_name}` is `owner/name`.
+git_remote_url = os.environ.get('GIT_REMOTE_URL') or 'https://github.com/{repo_name}.git'
+# Files larger than this are not returned whole by the read tool.
+worktree_read_max_chars = 100_000
+
+worktree_tool_instructions = '''
+        You have a checkout of the pull request branch. Use the list_files and read_file tools to read the code
+        you are changing, and the write_file tool to save each changed file; your writes are committed together.
+'''
+
+
+def run_git(args, cwd=None, auth_header=None):
+    command = ['git']
+    if auth_header:
+        # Pass the token per command rather than storing it in a remote URL on disk.
+        command += ['-c', f'http.extraHeader={auth_header}']
+    result = subprocess.run(command + args, cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'git {args[0]} failed: {result.stderr.strip()}')
+    return result.stdout
+
+
+class Worktree:
+    '''One task's checkout of a branch. Paths given to its methods are relative to the repository root.'''
+
+    def __init__(self, engine, repo_name, branch, path):
+        self.engine = engine
+        self.repo_name = repo_name
+        self.branch = branch
+        self.path = path
+        self.written = set()
+
+    def resolve(self, relative_path):
+        path = os.path.realpath(os.path.join(self.path, relative_path))
+        if os.path.commonpath([path, os.path.realpath(self.path)]) != os.path.realpath(self.path):
+            raise ValueError(f'{relative_path} is outside the repository')
+        return path
+
+    def list_files(self):
+        return run_git(['ls-files'], cwd=self.path).splitlines()
+
+    def read_file(self, relative_path):
+        with open(self.resolve(relative_path), encoding='utf-8', errors='replace') as file:
+            return file.read(worktree_read_max_chars)
+
+    def write_file(self, relative_path, content):
+        path = self.resolve(relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.written.add(relative_path)
+
+    def commit_and_push(self, message):
+        '''Commit everything written and push it to the branch. Returns False if there was nothing to commit.'''
+        run_git(['add', '-A'], cwd=self.path)
+        if not run_git(['status', '--porcelain'], cwd=self.path).strip():
+            return False
+        run_git(['-c', 'user.name=coding-agent', '-c', 'user.email=coding-agent@users.noreply.github.com',
+                 'commit', '-q', '-m', message], cwd=self.path)
+        # Not forced: the push is rejected if the branch moved since it was fetched.
+        run_git(['push', '-q', self.engine.remote_url(self.repo_name), f'HEAD:refs/heads/{self.branch}'],
+                cwd=self.path, auth_header=self.engine.auth_header)
+        return True
+
+
+class WorktreeEngine:
+    '''
+    Keeps one bare clone per repository under `cache_dir`, fetched incrementally, and checks out a
+    lightweight `git worktree` from it per task. After the first clone a task's setup is one small
+    fetch of its branch plus a local checkout.
+    '''
+
+    def __init__(self, cache_dir, token):
+        self.cache_dir = os.path.abspath(cache_dir)
+        credentials = base64.b64encode(f'x-access-token:{token}'.encode('utf-8')).decode('utf-8')
+        self.auth_header = f'Authorization: Basic {credentials}' if token else None
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def remote_url(self, repo_name):
+        return git_remote_url.format(repo_name=repo_name)
+
+    def repo_lock(self, repo_name):
+        with self.locks_lock:
+            return self.locks.setdefault(repo_name, threading.Lock())
+
+    def mirror_path(self, repo_name):
+        return os.path.join(self.cache_dir, repo_name.replace('/', '__') + '.git')
+
+    def ensure_mirror(self, repo_name, branch):
+        '''Clone the repository once, then fetch only `branch` before each task.'''
+        mirror = self.mirror_path(repo_name)
+        if not os.path.isdir(mirror):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            run_git(['clone', '-q', '--bare', self.remote_url(repo_name), mirror], auth_header=self.auth_header)
+        # Forget worktrees whose directories are gone, e.g. after a crash.
+        run_git(['worktree', 'prune'], cwd=mirror)
+        run_git(['fetch', '-q', self.remote_url(repo_name), f'+refs/heads/{branch}:refs/heads/{branch}'],
+                cwd=mirror, auth_header=self.auth_header)
+        return mirror
+
+    def open(self, repo_name, branch):
+        with self.repo_lock(repo_name):
+            mirror = self.ensure_mirror(repo_name, branch)
+            path = os.path.join(self.cache_dir, 'worktrees', f'{repo_name.replace("/", "__")}-{uuid.uuid4().hex[:8]}')
+            run_git(['worktree', 'add', '-q', '--detach', path, f'refs/heads/{branch}'], cwd=mirror)
+        return Worktree(self, repo_name, branch, path)
+
+    def close(self, worktree):
+        with self.repo_lock(worktree.repo_name):
+            try:
+                run_git(['worktree', 'remove', '--force', worktree.path], cwd=self.mirror_path(worktree.repo_name))
+            except RuntimeError as e:
+                print(f'[WorktreeEngine.close] Error: {e}')
+                shutil.rmtree(worktree.path, ignore_errors=True)
+
+
+class WorktreeSession:
+    '''
+    A task's worktree, opened on first use so that tasks queued but not yet run hold no checkout.
+    `tools()` are the file tools given to the coder agent.
+    '''
+
+    def __init__(self, engine, repo_name, branch):
+        self.engine = engine
+        self.repo_name = repo_name
+        self.branch = branch
+        self.worktree = None
+        self.lock = threading.Lock()
+
+    def get_worktree(self):
+        with self.lock:
+            if self.worktree is None:
+                self.worktree = self.engine.open(self.repo_name, self.branch)
+            return self.worktree
+
+    @property
+    def has_changes(self):
+        return self.worktree is not None and bool(self.worktree.written)
+
+    def commit_and_push(self, message):
+        return self.get_worktree().commit_and_push(message)
+
+    def close(self):
+        with self.lock:
+            if self.worktree is not None:
+                self.engine.close(self.worktree)
+                self.worktree = None
+
+    def tools(self):
+        from langchain_core.tools import StructuredTool
+
+        def list_files() -> str:
+            '''List every file in the repository.'''
+            return '\n'.join(self.get_worktree().list_files())
+
+        def read_file(path: str) -> str:
+            '''Read a file, given its path from the repository root.'''
+            return self.get_worktree().read_file(path)
+
+        def write_file(path: str, content: str) -> str:
+            '''Replace a file's whole contents, given its path from the repository root. Creates the file if needed.'''
+            self.get_worktree().write_file(path, content)
+            return f'Wrote {path}'
+
+        return [StructuredTool.from_function(function) for function in (list_files, read_file, write_file)]
+
+
+worktree_engine = None
+worktree_engine_lock = threading.Lock()
+
+
+def get_worktree_engine(token):
+    global worktree_engine
+    with worktree_engine_lock:
+        if worktree_engine is None:
+            worktree_engine = WorktreeEngine(git_cache_dir, token)
+        return worktree_engine
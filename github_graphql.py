@@ -0,0 +1,275 @@
+from collections import namedtuple
+import json
+
+import requests
+
+from cassettes import send_through_cassette
+from change_tracker import to_datetime
+from rate_limit import call_with_backoff
+
+
+Comment = namedtuple('Comment', ['body'])
+
+page_size_issues = 50
+# Pull requests also pull their review threads, so they use smaller pages to stay
+# well under GitHub's 500,000 node limit per query.
+page_size_pulls = 20
+page_size_comments = 100
+page_size_threads = 50
+page_size_thread_comments = 50
+
+comment_fields = '''
+    pageInfo { hasNextPage endCursor }
+    nodes { body }
+'''
+
+thread_fields = f'''
+    pageInfo {{ hasNextPage endCursor }}
+    nodes {{
+        id
+        comments(first: {page_size_thread_comments}) {{ pageInfo {{ hasNextPage endCursor }} nodes {{ body createdAt }} }}
+    }}
+'''
+
+issues_query = f'''
+query($owner: String!, $name: String!, $cursor: String, $since: DateTime) {{
+    repository(owner: $owner, name: $name) {{
+        issues(states: OPEN, first: {page_size_issues}, after: $cursor, orderBy: {{field: CREATED_AT, direction: DESC}},
+               filterBy: {{since: $since}}) {{
+            pageInfo {{ hasNextPage endCursor }}
+            nodes {{
+                databaseId number title body updatedAt
+                comments(first: {page_size_comments}) {{ {comment_fields} }}
+            }}
+        }}
+    }}
+}}
+'''
+
+pulls_query = f'''
+query($owner: String!, $name: String!, $cursor: String) {{
+    repository(owner: $owner, name: $name) {{
+        pullRequests(states: OPEN, first: {page_size_pulls}, after: $cursor, orderBy: {{field: UPDATED_AT, direction: DESC}}) {{
+            pageInfo {{ hasNextPage endCursor }}
+            nodes {{
+                databaseId number title body url state updatedAt headRefName
+                comments(first: {page_size_comments}) {{ {comment_fields} }}
+                reviewThreads(first: {page_size_threads}) {{ {thread_fields} }}
+            }}
+        }}
+    }}
+}}
+'''
+
+# `kind` is either `issue` or `pullRequest`.
+more_comments_query = f'''
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {{
+    repository(owner: $owner, name: $name) {{
+        item: %s(number: $number) {{
+            comments(first: {page_size_comments}, after: $cursor) {{ {comment_fields} }}
+        }}
+    }}
+}}
+'''
+
+
+more_threads_query = f'''
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {{
+    repository(owner: $owner, name: $name) {{
+        pullRequest(number: $number) {{
+            reviewThreads(first: {page_size_threads}, after: $cursor) {{ {thread_fields} }}
+        }}
+    }}
+}}
+'''
+
+more_thread_comments_query = f'''
+query($id: ID!, $cursor: String) {{
+    node(id: $id) {{
+        ... on PullRequestReviewThread {{
+            comments(first: {page_size_thread_comments}, after: $cursor) {{
+                pageInfo {{ hasNextPage endCursor }}
+                nodes {{ body createdAt }}
+            }}
+        }}
+    }}
+}}
+'''
+
+
+class IssueRecord:
+    '''
+    A read-only, in-memory issue hydrated from GraphQL.
+    Mirrors the parts of PyGithub's `Issue` the agent loop reads; writes go through `rest_object()`.
+    '''
+    pull_request = None
+
+    def __init__(self, number, id, title, body, updated_at, comments, rest_loader):
+        self.number = number
+        self.id = id
+        self.title = title
+        self.body = body
+        self.updated_at = updated_at
+        self.comments = comments
+        self._rest_loader = rest_loader
+
+    def __repr__(self):
+        return f'IssueRecord(title="{self.title}", number={self.number})'
+
+    def get_comments(self):
+        return self.comments
+
+    def rest_object(self):
+        return self._rest_loader().get_issue(self.number)
+
+
+class PullRequestRecord:
+    '''
+    A read-only, in-memory pull request hydrated from GraphQL.
+    `get_comments()` returns review comments and `get_issue_comments()` returns conversation
+    comments, matching PyGithub's `PullRequest`.
+    '''
+
+    def __init__(self, number, id, title, body, html_url, state, updated_at, head_ref, review_comments,
+                 issue_comments, rest_loader):
+        self.number = number
+        self.id = id
+        self.title = title
+        self.body = body
+        self.html_url = html_url
+        self.state = state
+        self.updated_at = updated_at
+        self.head_ref = head_ref
+        self.review_comments = review_comments
+        self.issue_comments = issue_comments
+        self._rest_loader = rest_loader
+
+    def __repr__(self):
+        return f'PullRequestRecord(title="{self.title}", number={self.number})'
+
+    def get_comments(self):
+        return self.review_comments
+
+    def get_issue_comments(self):
+        return self.issue_comments
+
+    def rest_object(self):
+        return self._rest_loader().get_pull(self.number)
+
+
+def run_query(url, token, query, variables):
+    body = {'query': query, 'variables': variables}
+    response = send_through_cassette('POST', url, json.dumps(body, sort_keys=True, default=str), lambda: call_with_backoff(
+        lambda: requests.post(
+            url,
+            json=body,
+            headers={'Authorization': f'bearer {token}'},
+            timeout=30,
+        ),
+        ['github_graphql'],
+    ))
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get('errors'):
+        raise RuntimeError(f'GraphQL errors: {payload["errors"]}')
+    return payload['data']
+
+
+def paginate(url, token, query, variables, connection):
+    cursor = None
+    while True:
+        data = run_query(url, token, query, {**variables, 'cursor': cursor})
+        page = data['repository'][connection]
+        yield from page['nodes']
+        if not page['pageInfo']['hasNextPage']:
+            return
+        cursor = page['pageInfo']['endCursor']
+
+
+def collect_comments(url, token, variables, kind, number, first_page):
+    '''Return every comment body of an issue or pull request, following pagination past the first page.'''
+    bodies = [node['body'] for node in first_page['nodes']]
+    page_info = first_page['pageInfo']
+    while page_info['hasNextPage']:
+        data = run_query(url, token, more_comments_query % kind, {
+            **variables,
+            'number': number,
+            'cursor': page_info['endCursor'],
+        })
+        page = data['repository']['item']['comments']
+        bodies.extend(node['body'] for node in page['nodes'])
+        page_info = page['pageInfo']
+    return [Comment(body) for body in bodies]
+
+
+def collect_review_comments(url, token, variables, number, first_page):
+    '''
+    Return every review comment of a pull request, oldest first, following the pagination of both its
+    review threads and each thread's comments, so a new refactor request on a busy pull request is not missed.
+    '''
+    threads = list(first_page['nodes'])
+    page_info = first_page['pageInfo']
+    while page_info['hasNextPage']:
+        data = run_query(url, token, more_threads_query, {**variables, 'number': number, 'cursor': page_info['endCursor']})
+        page = data['repository']['pullRequest']['reviewThreads']
+        threads.extend(page['nodes'])
+        page_info = page['pageInfo']
+
+    comments = []
+    for thread in threads:
+        page = thread['comments']
+        comments.extend(page['nodes'])
+        while page['pageInfo']['hasNextPage']:
+            data = run_query(url, token, more_thread_comments_query, {'id': thread['id'], 'cursor': page['pageInfo']['endCursor']})
+            page = data['node']['comments']
+            comments.extend(page['nodes'])
+    comments.sort(key=lambda comment: comment['createdAt'])
+    return [Comment(comment['body']) for comment in comments]
+
+
+def fetch_open_items(repo_name, token, url, rest_loader, since=None):
+    '''
+    Fetch open issues and pull requests with all the comments the agent loop needs in a few
+    paginated GraphQL queries. `rest_loader` returns the PyGithub repository used for writes.
+    With `since`, only items updated at or after it are fetched.
+    '''
+    try:
+        owner, name = repo_name.split('/')
+        variables = {'owner': owner, 'name': name}
+        since_iso = since.strftime('%Y-%m-%dT%H:%M:%SZ') if since else None
+
+        issues = []
+        for node in paginate(url, token, issues_query, {**variables, 'since': since_iso}, 'issues'):
+            issues.append(IssueRecord(
+                number=node['number'],
+                id=node['databaseId'],
+                title=node['title'],
+                body=node['body'],
+                updated_at=node['updatedAt'],
+                comments=collect_comments(url, token, variables, 'issue', node['number'], node['comments']),
+                rest_loader=rest_loader,
+            ))
+
+        pulls = []
+        for node in paginate(url, token, pulls_query, variables, 'pullRequests'):
+            # Pull requests come newest-updated first, so stop paging once they fall behind `since`.
+            if since and to_datetime(node['updatedAt']) < since:
+                break
+            pulls.append(PullRequestRecord(
+                number=node['number'],
+                id=node['databaseId'],
+                title=node['title'],
+                body=node['body'],
+                html_url=node['url'],
+                state=node['state'].lower(),
+                updated_at=node['updatedAt'],
+                head_ref=node['headRefName'],
+                review_comments=collect_review_comments(url, token, variables, node['number'], node['reviewThreads']),
+                issue_comments=collect_comments(url, token, variables, 'pullRequest', node['number'], node['comments']),
+                rest_loader=rest_loader,
+            ))
+
+        return issues, pulls
+    except Exception as e:
+        print(f'[fetch_open_items] Error: {e}')
+        raise e
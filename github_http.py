@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+from time import time
+
+from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from github.Requester import Requester, RequestsResponse, HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+
+from cassettes import send_through_cassette
+from rate_limit import call_with_backoff, github_bucket_names
+from telemetry import record_github_request
+
+
+load_dotenv()
+
+# The cache is kept under these bounds; the least recently used responses go first. Incremental `since=`
+# list URLs change with every update, so without a bound an active repository grows the cache forever.
+http_cache_max_entries = int(os.environ.get('GH_HTTP_CACHE_MAX_ENTRIES') or 5000)
+http_cache_ttl_seconds = int(os.environ.get('GH_HTTP_CACHE_TTL_DAYS') or 7) * 24 * 3600
+# Eviction runs every this many writes rather than on each one.
+evict_every = 100
+
+# Headers that describe the live 304 response rather than the cached body.
+refreshed_headers = ('date', 'x-ratelimit-limit', 'x-ratelimit-remaining', 'x-ratelimit-reset', 'x-ratelimit-used')
+
+
+class ConditionalCache:
+    '''
+    ETag / Last-Modified cache for GitHub GET responses, persisted in SQLite so restarts stay warm.
+    Capped at `max_entries` with LRU eviction, and entries unused for `ttl_seconds` are dropped.
+    '''
+
+    def __init__(self, path, max_entries=http_cache_max_entries, ttl_seconds=http_cache_ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL
+            )
+        ''')
+        # Caches written before eviction existed lack the column; they count as just used.
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(responses)')]
+        if 'used_at' not in columns:
+            self.db.execute(f'ALTER TABLE responses ADD COLUMN used_at REAL NOT NULL DEFAULT {time()}')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT etag, last_modified, headers, body FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE responses SET used_at = ? WHERE url = ?', (time(), url))
+        if row is None:
+            return None
+        etag, last_modified, headers, body = row
+        return {'etag': etag, 'last_modified': last_modified, 'headers': json.loads(headers), 'body': body}
+
+    def put(self, url, response):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses (url, etag, last_modified, headers, body, used_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    url,
+                    response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'),
+                    json.dumps(dict(response.headers)),
+                    response.content,
+                    time(),
+                ),
+            )
+            self.writes += 1
+            if self.writes % evict_every == 0:
+                self.evict()
+
+    def evict(self):
+        self.db.execute('DELETE FROM responses WHERE used_at < ?', (time() - self.ttl_seconds,))
+        self.db.execute('''
+            DELETE FROM responses WHERE url IN (
+                SELECT url FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self, reset=False):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+            if reset:
+                self.hits = 0
+                self.misses = 0
+        return hits, misses
+
+
+class ConditionalCacheAdapter(HTTPAdapter):
+    '''
+    Sends GETs with If-None-Match / If-Modified-Since and answers 304s from the cache.
+    GitHub does not count 304 responses against the rate limit.
+    '''
+
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            response = super().send(request, **kwargs)
+            record_github_request(request.method, response.status_code)
+            return response
+
+        cached = self.cache.get(request.url)
+        if cached:
+            if cached['etag']:
+                request.headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                request.headers['If-Modified-Since'] = cached['last_modified']
+
+        response = super().send(request, **kwargs)
+        record_github_request(request.method, response.status_code)
+
+        if response.status_code == 304 and cached:
+            self.cache.record(hit=True)
+            return self.build_cached_response(request, cached, response)
+
+        self.cache.record(hit=False)
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.put(request.url, response)
+        return response
+
+    def build_cached_response(self, request, cached, not_modified):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(cached['headers'])
+        for name in refreshed_headers:
+            if name in not_modified.headers:
+                response.headers[name] = not_modified.headers[name]
+        response._content = cached['body']
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        # Served for a 304, which the rate limiter does not charge for.
+        response.not_modified = True
+        return response
+
+
+def install_github_http(path):
+    '''
+    Route every PyGithub request through the shared rate limiter and a `ConditionalCacheAdapter`.
+    Must run before `Github()` is created. Returns the cache.
+    '''
+    cache = ConditionalCache(path)
+    Requester.injectConnectionClasses(
+        caching_connection_class(HTTPRequestsConnectionClass, cache),
+        caching_connection_class(HTTPSRequestsConnectionClass, cache),
+    )
+    # `injectConnectionClasses` also turns off connection reuse (it exists for PyGithub's replay tests);
+    # turn it back on so we keep one pooled session.
+    Requester._Requester__persist = True
+    return cache
+
+
+def caching_connection_class(base, cache):
+    '''
+    A PyGithub connection class sending through `ConditionalCacheAdapter` and the rate limiter. Plain HTTP
+    is covered too, for GitHub Enterprise or a local fake server (GH_API_URL).
+    '''
+
+    class CachingConnection(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.adapter = ConditionalCacheAdapter(
+                cache,
+                max_retries=self.retry,
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+            )
+            self.session.mount(f'{self.protocol}://', self.adapter)
+            self.pending = threading.local()
+
+        # PyGithub keeps one persistent connection and stores the pending request on it between
+        # `request()` and `getresponse()`. Keep that per thread so concurrent crews can share it.
+        def request(self, verb, url, input, headers):
+            self.pending.request = (verb, url, input, headers)
+
+        def getresponse(self):
+            verb, url, input, headers = self.pending.request
+            send = getattr(self.session, verb.lower())
+            response = send_through_cassette(verb, url, input, lambda: call_with_backoff(
+                lambda: send(
+                    f'{self.protocol}://{self.host}:{self.port}{url}',
+                    headers=headers,
+                    data=input,
+                    timeout=self.timeout,
+                    verify=self.verify,
+                    allow_redirects=False,
+                ),
+                github_bucket_names(verb),
+            ))
+            return RequestsResponse(response)
+
+    return CachingConnection
@@ -0,0 +1,83 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from time import time
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+
+whitespace_pattern = re.compile(r'\s+')
+
+
+def cache_key(prompt, llm_string):
+    '''
+    Hash of the rendered prompt with whitespace collapsed, plus LangChain's `llm_string`, which
+    carries the model name, temperature and every other generation parameter.
+    '''
+    normalized = whitespace_pattern.sub(' ', prompt).strip()
+    return hashlib.sha256(f'{normalized}\0{llm_string}'.encode('utf-8')).hexdigest()
+
+
+class SQLiteLLMCache(BaseCache):
+    '''
+    Disk-backed LLM response cache with a TTL and least-recently-used eviction past `max_entries`.
+    Passed to the chat models as `cache=`, so identical prompts cost no tokens the second time.
+    '''
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used_at)')
+        self.db.commit()
+
+    def lookup(self, prompt, llm_string):
+        key = cache_key(prompt, llm_string)
+        now = time()
+        with self.lock:
+            row = self.db.execute('SELECT value, created_at FROM generations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self.db.execute('DELETE FROM generations WHERE key = ?', (key,))
+                self.db.commit()
+                return None
+            self.db.execute('UPDATE generations SET last_used_at = ? WHERE key = ?', (now, key))
+            self.db.commit()
+        return loads(value)
+
+    def update(self, prompt, llm_string, return_val):
+        key = cache_key(prompt, llm_string)
+        now = time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO generations (key, value, created_at, last_used_at) VALUES (?, ?, ?, ?)',
+                (key, dumps(return_val), now, now),
+            )
+            self.evict(now)
+            self.db.commit()
+
+    def evict(self, now):
+        self.db.execute('DELETE FROM generations WHERE created_at < ?', (now - self.ttl_seconds,))
+        self.db.execute('''
+            DELETE FROM generations WHERE key IN (
+                SELECT key FROM generations ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.db.execute('DELETE FROM generations')
+            self.db.commit()
@@ -1,7 +1,7 @@
 import os
+import threading
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 
 
 load_dotenv()
@@ -13,27 +13,130 @@ else:
     cto_llm_name = os.environ.get('CTO_AGENT_LLM')
     coder_llm_name = os.environ.get('CODER_AGENT_LLM')
 
+cto_temperature = 0.2
+coder_temperature = 0.1
 
-def get_llm_client(model_name, temperature):
+# The OpenAI client retries 429s with exponential backoff, honoring Retry-After.
+llm_max_retries = int(os.environ.get('LLM_MAX_RETRIES') or 6)
+
+# Everything below is built on first use, so importing this module (and agents.py) does no client setup.
+# Clients are keyed by (provider, model, temperature, streaming); the OpenAI SDK clients underneath, and with them
+# the HTTP connection pools, are shared per provider.
+llm_clients = {}
+sdk_clients = {}
+llm_cache = None
+registry_lock = threading.RLock()
+
+
+def get_provider():
     # Its assumed that if you have an OPENROUTER_API_KEY you want to use OpenRouter.
     # Otherwise, you want to use OpenAI and OPENAI_API_KEY is required.
     if 'OPENROUTER_API_KEY' in os.environ:
-        return ChatOpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=os.environ['OPENROUTER_API_KEY'],
-            temperature=temperature
-        )
-    else:
-        return ChatOpenAI(
-            api_key=os.environ['OPENAI_API_KEY'],
-            temperature=temperature
-        )
-
-cto_llm = get_llm_client(
-    model_name=os.environ.get('CTO_AGENT_LLM'),
-    temperature=0.2
-)
-coder_llm = get_llm_client(
-    model_name=os.environ.get('CODER_AGENT_LLM'),
-    temperature=0.1
-)
\ No newline at end of file
+        return 'openrouter'
+    return 'openai'
+
+
+def get_llm_cache():
+    global llm_cache
+    with registry_lock:
+        if llm_cache is None:
+            from llm_cache import SQLiteLLMCache
+
+            llm_cache = SQLiteLLMCache(
+                path=os.environ.get('LLM_CACHE_PATH') or '.llm_cache.sqlite',
+                ttl_seconds=int(os.environ.get('LLM_CACHE_TTL_SECONDS') or 7 * 24 * 3600),
+                max_entries=int(os.environ.get('LLM_CACHE_MAX_ENTRIES') or 5000),
+            )
+        return llm_cache
+
+
+def get_provider_params(provider):
+    if provider == 'openrouter':
+        return {'base_url': 'https://openrouter.ai/api/v1', 'api_key': os.environ['OPENROUTER_API_KEY']}
+    params = {'api_key': os.environ['OPENAI_API_KEY']}
+    # Point at any OpenAI-compatible server, e.g. a local fake one for testing.
+    if os.environ.get('LLM_BASE_URL'):
+        params['base_url'] = os.environ['LLM_BASE_URL']
+    return params
+
+
+def get_sdk_clients(provider):
+    '''
+    The sync and async OpenAI SDK clients for a provider, each holding one connection pool. Chat completions
+    wait for their model's rate-limit bucket at the HTTP layer, below the response cache. With a cassette
+    (CASSETTE_MODE) their HTTP goes through it, so every prompt and completion is recorded or replayed;
+    a replay is not rate limited.
+    '''
+    with registry_lock:
+        if provider not in sdk_clients:
+            import httpx
+            import openai
+            from cassettes import AsyncCassetteTransport, CassetteTransport, get_cassette
+            from rate_limit import AsyncLLMRateLimitTransport, LLMRateLimitTransport
+
+            params = {**get_provider_params(provider), 'max_retries': llm_max_retries}
+            cassette = get_cassette()
+            sync_transport = CassetteTransport(cassette) if cassette else httpx.HTTPTransport()
+            async_transport = AsyncCassetteTransport(cassette) if cassette else httpx.AsyncHTTPTransport()
+            if not (cassette and cassette.replaying):
+                sync_transport = LLMRateLimitTransport(provider, sync_transport)
+                async_transport = AsyncLLMRateLimitTransport(provider, async_transport)
+            sdk_clients[provider] = (
+                openai.OpenAI(**params, http_client=openai.DefaultHttpxClient(transport=sync_transport)),
+                openai.AsyncOpenAI(**params, http_client=openai.DefaultAsyncHttpxClient(transport=async_transport)),
+            )
+        return sdk_clients[provider]
+
+
+def build_llm_client(provider, model_name, temperature, streaming=False):
+    from cassettes import get_cassette
+    from comment_streaming import CommentStreamHandler
+    from langchain_openai import ChatOpenAI
+    from model_stats import ModelStatsHandler
+    from telemetry import LLMTelemetryHandler
+
+    sync_client, async_client = get_sdk_clients(provider)
+    # ChatOpenAI still validates its own key and base URL even when handed SDK clients.
+    params = get_provider_params(provider)
+    if model_name:
+        params['model_name'] = model_name
+    # A cassette sees every call only if the response cache is off.
+    cassette = get_cassette()
+    return ChatOpenAI(
+        client=sync_client.chat.completions,
+        async_client=async_client.chat.completions,
+        temperature=temperature,
+        cache=False if cassette else get_llm_cache(),
+        streaming=streaming,
+        callbacks=[
+            ModelStatsHandler(model_name),
+            LLMTelemetryHandler(model_name),
+            *([CommentStreamHandler()] if streaming else []),
+        ],
+        **params
+    )
+
+
+def get_llm_client(model_name, temperature, streaming=False):
+    key = (get_provider(), model_name, temperature, streaming)
+    with registry_lock:
+        if key not in llm_clients:
+            llm_clients[key] = build_llm_client(*key)
+        return llm_clients[key]
+
+
+def get_cto_llm():
+    return get_llm_client(cto_llm_name, cto_temperature)
+
+
+def get_coder_llm():
+    return get_llm_client(coder_llm_name, coder_temperature)
+
+
+def __getattr__(name):
+    # `cto_llm` and `coder_llm` are still importable, but are only built when first accessed.
+    if name == 'cto_llm':
+        return get_cto_llm()
+    if name == 'coder_llm':
+        return get_coder_llm()
+    raise AttributeError(f"module 'llms' has no attribute '{name}'")
@@ -0,0 +1,82 @@
+from collections import namedtuple
+import os
+
+from dotenv import load_dotenv
+
+from llms import (
+    cto_llm_name,
+    coder_llm_name,
+    cto_temperature,
+    coder_temperature,
+    get_llm_client,
+)
+from model_stats import get_model_stats
+from prompt_budget import count_tokens
+
+
+load_dotenv()
+
+# Route each task to CHEAP_MODE_LLM or the role's full model instead of the all-or-nothing CHEAP_MODE.
+router_enabled = os.environ.get('MODEL_ROUTER') == 'True'
+cheap_llm_name = os.environ.get('CHEAP_MODE_LLM')
+# Prompts longer than this, or issues refactored this many times, go straight to the full model.
+router_cheap_max_tokens = int(os.environ.get('ROUTER_CHEAP_MAX_TOKENS') or 1500)
+router_cheap_max_refactors = int(os.environ.get('ROUTER_CHEAP_MAX_REFACTORS') or 2)
+# Stop routing a role to the cheap model when its recent success rate falls below this.
+router_min_cheap_success = float(os.environ.get('ROUTER_MIN_CHEAP_SUCCESS') or 0.6)
+router_min_samples = 10
+min_output_chars = 80
+
+Route = namedtuple('Route', ['role', 'tier', 'model_name', 'temperature'])
+
+role_models = {
+    'planner': (cto_llm_name, cto_temperature),
+    'coder': (coder_llm_name, coder_temperature),
+}
+
+
+def strong_route(role):
+    model_name, temperature = role_models[role]
+    return Route(role, 'strong', model_name, temperature)
+
+
+def choose_route(role, prompt, refactor_rounds):
+    '''Pick the cheap or the full model for one task.'''
+    if not router_enabled or not cheap_llm_name:
+        return strong_route(role)
+
+    if count_tokens(prompt) > router_cheap_max_tokens or refactor_rounds >= router_cheap_max_refactors:
+        return strong_route(role)
+
+    success_rate, samples = get_model_stats().success_rate(cheap_llm_name, role)
+    if samples >= router_min_samples and success_rate < router_min_cheap_success:
+        return strong_route(role)
+
+    return Route(role, 'cheap', cheap_llm_name, role_models[role][1])
+
+
+def get_route_llm(route, streaming=False):
+    return get_llm_client(route.model_name, route.temperature, streaming)
+
+
+def passes_quick_check(route, output, wrote_files=False):
+    '''
+    A cheap sanity check of an agent's output; failures on the cheap tier are retried on the full model.
+    A coder that wrote its changes with file tools need not repeat them as code blocks.
+    '''
+    text = (output or '').strip()
+    if len(text) < min_output_chars:
+        return False
+    if route.role == 'coder' and '```' not in text and not wrote_files:
+        return False
+    return True
+
+
+def record_outcome(route, output, wrote_files=False):
+    '''Record whether the output passed the quick check. Returns the route to escalate to, or None.'''
+    success = passes_quick_check(route, output, wrote_files)
+    get_model_stats().record_outcome(route.model_name or 'default', route.role, success)
+    if not success and route.tier == 'cheap':
+        print(f'[record_outcome] {route.role} output from {route.model_name} failed the quick check, escalating')
+        return strong_route(route.role)
+    return None
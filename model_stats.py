@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+from time import monotonic, time
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+load_dotenv()
+
+model_stats_path = os.environ.get('MODEL_STATS_PATH') or '.model_stats.sqlite'
+
+
+class ModelStats:
+    '''
+    Per-model latency, token usage and task outcomes, kept in SQLite so routing can be tuned from real data.
+    '''
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS calls (
+                model TEXT NOT NULL,
+                latency REAL NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                error INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS outcomes (
+                model TEXT NOT NULL,
+                role TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+        ''')
+        self.db.commit()
+
+    def record_call(self, model, latency, prompt_tokens=0, completion_tokens=0, error=False):
+        with self.lock:
+            self.db.execute(
+                'INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?)',
+                (model, latency, prompt_tokens, completion_tokens, int(error), time()),
+            )
+            self.db.commit()
+
+    def record_outcome(self, model, role, success):
+        with self.lock:
+            self.db.execute('INSERT INTO outcomes VALUES (?, ?, ?, ?)', (model, role, int(success), time()))
+            self.db.commit()
+
+    def success_rate(self, model, role, recent=50):
+        '''Success rate over the most recent outcomes, and how many outcomes it is based on.'''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT success FROM outcomes WHERE model = ? AND role = ? ORDER BY created_at DESC LIMIT ?',
+                (model, role, recent),
+            ).fetchall()
+        if not rows:
+            return None, 0
+        return sum(row[0] for row in rows) / len(rows), len(rows)
+
+    def summary(self):
+        with self.lock:
+            return self.db.execute('''
+                SELECT model, COUNT(*), AVG(latency), SUM(prompt_tokens), SUM(completion_tokens), SUM(error)
+                FROM calls GROUP BY model
+            ''').fetchall()
+
+
+model_stats = None
+model_stats_lock = threading.Lock()
+
+
+def get_model_stats():
+    global model_stats
+    with model_stats_lock:
+        if model_stats is None:
+            model_stats = ModelStats(model_stats_path)
+        return model_stats
+
+
+class ModelStatsHandler(BaseCallbackHandler):
+    '''Records the latency and token usage of every call made through an LLM client.'''
+
+    def __init__(self, model_name):
+        self.model_name = model_name or 'default'
+        self.started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.started[run_id] = monotonic()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.started[run_id] = monotonic()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        latency = monotonic() - self.started.pop(run_id, monotonic())
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        get_model_stats().record_call(
+            self.model_name,
+            latency,
+            usage.get('prompt_tokens', 0),
+            usage.get('completion_tokens', 0),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        latency = monotonic() - self.started.pop(run_id, monotonic())
+        get_model_stats().record_call(self.model_name, latency, error=True)
@@ -0,0 +1,83 @@
+import os
+from time import time
+
+from dotenv import load_dotenv
+
+from rate_limit import get_bucket
+from telemetry import metrics
+
+
+load_dotenv()
+
+# Passes start POLL_MIN_SECONDS apart while issues and pull requests keep changing, and back off by
+# POLL_BACKOFF per quiet pass up to POLL_MAX_SECONDS.
+poll_min_seconds = float(os.environ.get('POLL_MIN_SECONDS') or 5)
+poll_max_seconds = float(os.environ.get('POLL_MAX_SECONDS') or 300)
+poll_backoff = float(os.environ.get('POLL_BACKOFF') or 2)
+# Plan passes so that they would use at most this share of the remaining REST quota before it resets.
+quota_headroom = 0.8
+# Weight of the latest pass in the smoothed requests-per-pass estimate.
+requests_smoothing = 0.3
+
+
+def counted_github_requests():
+    '''GitHub REST requests made so far that count against the rate limit; 304s do not.'''
+    return metrics.total('agent_github_requests_total') - metrics.total('agent_github_requests_total', status=304)
+
+
+class PollScheduler:
+    '''
+    Chooses how long to wait after each polling pass instead of a fixed sleep. The interval is timed from
+    the start of a pass, so a long pass is not followed by a full wait as well. It is the longer of:
+
+    - the activity interval: `min_seconds` after a pass that saw changed issues or pull requests,
+      multiplied by `backoff` after each quiet pass, up to `max_seconds`;
+    - the quota interval: how far apart passes like the recent ones must be to leave `quota_headroom`
+      of the `github_rest` bucket's remaining quota unspent until it resets.
+    '''
+
+    def __init__(self, min_seconds=poll_min_seconds, max_seconds=poll_max_seconds, backoff=poll_backoff):
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.backoff = backoff
+        self.interval = min_seconds
+        self.quiet_passes = 0
+        self.requests_per_pass = None
+        self.requests_seen = counted_github_requests()
+
+    def quota_interval(self):
+        bucket = get_bucket('github_rest')
+        if bucket.remaining is None or bucket.reset_at is None or not self.requests_per_pass:
+            return 0.0, None
+        seconds_to_reset = max(1.0, bucket.reset_at - time())
+        passes_left = bucket.remaining * quota_headroom / self.requests_per_pass
+        interval = seconds_to_reset / passes_left if passes_left >= 1 else seconds_to_reset
+        return interval, f'{bucket.remaining} of {bucket.limit} requests left, reset in {seconds_to_reset:.0f}s'
+
+    def next_delay(self, changes, pass_seconds):
+        '''
+        Seconds to wait after a pass that saw `changes` changed items and took `pass_seconds`, and the reason.
+        '''
+        requests = counted_github_requests()
+        pass_requests = requests - self.requests_seen
+        self.requests_seen = requests
+        if self.requests_per_pass is None:
+            self.requests_per_pass = pass_requests
+        else:
+            self.requests_per_pass += requests_smoothing * (pass_requests - self.requests_per_pass)
+
+        if changes:
+            self.quiet_passes = 0
+            self.interval = self.min_seconds
+            reason = f'{changes} changed items'
+        else:
+            self.quiet_passes += 1
+            self.interval = min(self.max_seconds, self.interval * self.backoff)
+            reason = f'quiet for {self.quiet_passes} passes'
+
+        interval = self.interval
+        quota_interval, quota_reason = self.quota_interval()
+        if quota_interval > interval:
+            interval, reason = quota_interval, f'stretched for quota: {quota_reason}'
+        delay = max(0.0, interval - pass_seconds)
+        return delay, f'{reason} ({interval:.0f}s interval, pass took {pass_seconds:.1f}s, {pass_requests} requests)'
@@ -0,0 +1,131 @@
+from functools import lru_cache
+import hashlib
+import os
+
+from dotenv import load_dotenv
+import tiktoken
+
+from snapshot import Message
+
+
+load_dotenv()
+
+# Context windows of the models we commonly route to. Unknown models get the smallest one.
+context_windows = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'claude-3': 200000,
+}
+default_context_window = 8192
+# Share of the context window the issue prompt may use; the rest is for CrewAI's scaffolding and the answer.
+prompt_share = 0.5
+planner_token_budget = int(os.environ.get('PLANNER_PROMPT_TOKEN_BUDGET') or 0)
+# Room for the marker `truncate_tokens` appends.
+truncation_marker_tokens = 16
+omitted_comment = '[earlier comment omitted]'
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    try:
+        return tiktoken.encoding_for_model(model_name or '')
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(text, model_name=None):
+    return len(get_encoding(model_name).encode(text or ''))
+
+
+def truncate_tokens(text, max_tokens, model_name=None):
+    encoding = get_encoding(model_name)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + f'\n[... truncated {len(tokens) - max_tokens} tokens]'
+
+
+def get_token_budget(model_name):
+    if planner_token_budget:
+        return planner_token_budget
+    name = (model_name or '').split('/')[-1]
+    for prefix, window in sorted(context_windows.items(), key=lambda item: -len(item[0])):
+        if name.startswith(prefix):
+            return int(window * prompt_share)
+    return int(default_context_window * prompt_share)
+
+
+def summarize_plan(content, model_name=None):
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+    return f'[superseded plan {digest}, {count_tokens(content, model_name)} tokens omitted]'
+
+
+def compact_message_history(title, body, message_history, model_name=None):
+    '''
+    Fit an issue's comment history into the model's prompt budget.
+
+    The issue body and every comment after the latest planner response (the feedback being answered) are
+    kept verbatim where possible. Superseded planner responses collapse to a hash. If that is still over
+    budget, older human comments are dropped oldest first, then the latest planner response is truncated.
+    As a last resort the remaining older comments are truncated oldest first, then the body; the latest
+    human comment is never cut. Returns `(body, history)`.
+    '''
+    budget = get_token_budget(model_name)
+
+    latest_plan_index = None
+    latest_human_index = None
+    for index, message in enumerate(message_history):
+        if message.role == 'planner_response':
+            latest_plan_index = index
+        else:
+            latest_human_index = index
+
+    compacted = []
+    superseded = set()
+    for index, message in enumerate(message_history):
+        if message.role == 'planner_response' and index != latest_plan_index:
+            message = Message(message.role, summarize_plan(message.content, model_name))
+            superseded.add(index)
+        compacted.append(message)
+
+    # Counted once here and again only for the messages that change.
+    title_tokens = count_tokens(title, model_name)
+    body_tokens = count_tokens(body or '', model_name)
+    message_tokens = [count_tokens(message.content, model_name) for message in compacted]
+
+    def overflow():
+        return title_tokens + body_tokens + sum(message_tokens) - budget
+
+    def replace(index, content):
+        compacted[index] = Message(compacted[index].role, content)
+        message_tokens[index] = count_tokens(content, model_name)
+
+    # Older human comments, oldest first, are the next thing to give up.
+    older_indexes = [
+        index for index in range(latest_plan_index or 0)
+        if compacted[index].role != 'planner_response'
+    ]
+    for index in older_indexes:
+        if overflow() <= 0:
+            break
+        replace(index, omitted_comment)
+
+    if overflow() > 0 and latest_plan_index is not None:
+        keep = message_tokens[latest_plan_index] - overflow() - truncation_marker_tokens
+        replace(latest_plan_index, truncate_tokens(compacted[latest_plan_index].content, max(0, keep), model_name))
+
+    # Without a plan, or with long feedback after it, nothing above bounds the other comments or the body.
+    for index, message in enumerate(compacted):
+        if overflow() <= 0:
+            break
+        if index in (latest_human_index, latest_plan_index) or index in superseded or message.content == omitted_comment:
+            continue
+        keep = message_tokens[index] - overflow() - truncation_marker_tokens
+        replace(index, truncate_tokens(message.content, keep, model_name) if keep > 0 else omitted_comment)
+
+    if overflow() > 0 and body:
+        body = truncate_tokens(body, max(0, body_tokens - overflow() - truncation_marker_tokens), model_name)
+
+    return body, compacted
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import random
+import threading
+from time import monotonic, sleep, time
+
+from dotenv import load_dotenv
+import httpx
+
+
+load_dotenv()
+
+llm_max_rpm = int(os.environ.get('LLM_MAX_RPM') or 60)
+rate_limit_max_attempts = int(os.environ.get('RATE_LIMIT_MAX_ATTEMPTS') or 6)
+backoff_base_seconds = 2
+backoff_max_seconds = 300
+
+# (requests per second, burst capacity). GitHub REST and GraphQL allow 5,000 per hour; content-creating
+# requests have a secondary limit of 80 per minute and 500 per hour.
+bucket_defaults = {
+    'github_rest': (5000 / 3600, 100),
+    'github_graphql': (5000 / 3600, 50),
+    'github_write': (480 / 3600, 20),
+}
+
+
+class TokenBucket:
+    '''
+    A thread-safe token bucket. `update_from_headers` re-paces it from GitHub's `X-RateLimit-*` headers
+    so the remaining quota is spread evenly until the window resets.
+    '''
+
+    # Fraction of the reported remaining quota to plan for, leaving room for other clients of the token.
+    headroom = 0.9
+    min_rate = 0.01
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0
+        self.remaining = None
+        self.limit = None
+        self.reset_at = None
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        '''Take a token and return how many seconds the caller must wait before using it.'''
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        remaining = int(remaining)
+        seconds_to_reset = max(1.0, int(reset) - time())
+        with self.lock:
+            self.remaining = remaining
+            self.limit = int(headers.get('X-RateLimit-Limit', self.limit or 0)) or None
+            self.reset_at = int(reset)
+            self.rate = max(self.min_rate, remaining * self.headroom / seconds_to_reset)
+            self.tokens = min(self.tokens, remaining)
+            if remaining == 0:
+                self.paused_until = monotonic() + seconds_to_reset
+
+    def refund(self):
+        '''Give back a token taken for a request that turned out not to count, e.g. a 304.'''
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+buckets = {}
+buckets_lock = threading.Lock()
+
+
+def get_bucket(name):
+    '''Return the shared bucket for `name`, e.g. `github_rest`, `github_write` or `llm:<provider>:<model>`.'''
+    with buckets_lock:
+        if name not in buckets:
+            if name.startswith('llm:'):
+                rate, capacity = llm_max_rpm / 60, max(1, llm_max_rpm // 6)
+            else:
+                rate, capacity = bucket_defaults[name]
+            buckets[name] = TokenBucket(name, rate, capacity)
+        return buckets[name]
+
+
+def retry_delay(response, attempt):
+    '''
+    Seconds to wait before retrying a rate-limited response, or None if it is not rate limited.
+    Handles 429s, primary-limit 403s (remaining == 0) and secondary-limit ("abuse") 403s.
+    '''
+    if response.status_code not in (403, 429):
+        return None
+
+    headers = response.headers
+    retry_after = headers.get('Retry-After')
+    exhausted = headers.get('X-RateLimit-Remaining') == '0'
+    if response.status_code == 403 and not (retry_after or exhausted or 'secondary rate limit' in response.text.lower()):
+        # A plain permission error.
+        return None
+
+    if retry_after:
+        delay = float(retry_after)
+    elif exhausted and headers.get('X-RateLimit-Reset'):
+        delay = int(headers['X-RateLimit-Reset']) - time()
+    else:
+        delay = backoff_base_seconds * 2 ** attempt
+    delay = min(backoff_max_seconds, max(1.0, delay))
+    # Jitter so workers that were limited together do not retry together.
+    return delay * random.uniform(1.0, 1.25)
+
+
+def is_not_modified(response):
+    '''A 304, or a cached response served for one; GitHub does not count either against the quota.'''
+    return response.status_code == 304 or getattr(response, 'not_modified', False)
+
+
+def call_with_backoff(send, bucket_names):
+    '''
+    Call `send()` (returning a requests/httpx-style response) once a token is available in every bucket,
+    retrying rate-limited responses with jittered exponential backoff. The first bucket is re-paced from
+    the response headers. Tokens taken for a 304 are given back, so revalidation does not use up the pace.
+    '''
+    request_buckets = [get_bucket(name) for name in bucket_names]
+    for attempt in range(rate_limit_max_attempts):
+        for bucket in request_buckets:
+            bucket.acquire()
+        response = send()
+        request_buckets[0].update_from_headers(response.headers)
+        if is_not_modified(response):
+            for bucket in request_buckets:
+                bucket.refund()
+        delay = retry_delay(response, attempt)
+        if delay is None:
+            return response
+        print(f'[call_with_backoff] {bucket_names[0]} rate limited ({response.status_code}), retrying in {delay:.1f}s')
+        request_buckets[0].pause(delay)
+    return response
+
+
+async def call_with_backoff_async(send, bucket_names):
+    '''The asyncio counterpart of `call_with_backoff`; `send()` returns an awaitable.'''
+    request_buckets = [get_bucket(name) for name in bucket_names]
+    for attempt in range(rate_limit_max_attempts):
+        for bucket in request_buckets:
+            await bucket.acquire_async()
+        response = await send()
+        request_buckets[0].update_from_headers(response.headers)
+        if is_not_modified(response):
+            for bucket in request_buckets:
+                bucket.refund()
+        delay = retry_delay(response, attempt)
+        if delay is None:
+            return response
+        print(f'[call_with_backoff_async] {bucket_names[0]} rate limited ({response.status_code}), retrying in {delay:.1f}s')
+        request_buckets[0].pause(delay)
+    return response
+
+
+def github_bucket_names(method):
+    if method.upper() in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        return ['github_rest', 'github_write']
+    return ['github_rest']
+
+
+def llm_request_bucket(provider, request):
+    '''The bucket of the model a chat completion request is for, or None for other requests.'''
+    if request.method != 'POST' or not request.url.path.endswith('/chat/completions'):
+        return None
+    model_name = json.loads(request.content).get('model')
+    return get_bucket(f'llm:{provider}:{model_name}')
+
+
+class LLMRateLimitTransport(httpx.BaseTransport):
+    '''
+    An httpx transport (the OpenAI SDK's) that holds each chat completion until its model's bucket has
+    a token. It sits below LangChain's response cache, so cache hits cost nothing. 429s are retried by
+    the OpenAI client.
+    '''
+
+    def __init__(self, provider, inner=None):
+        self.provider = provider
+        self.inner = inner or httpx.HTTPTransport()
+
+    def handle_request(self, request):
+        bucket = llm_request_bucket(self.provider, request)
+        if bucket is not None:
+            bucket.acquire()
+        return self.inner.handle_request(request)
+
+    def close(self):
+        self.inner.close()
+
+
+class AsyncLLMRateLimitTransport(httpx.AsyncBaseTransport):
+    def __init__(self, provider, inner=None):
+        self.provider = provider
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request):
+        bucket = llm_request_bucket(self.provider, request)
+        if bucket is not None:
+            await bucket.acquire_async()
+        return await self.inner.handle_async_request(request)
+
+    async def aclose(self):
+        await self.inner.aclose()
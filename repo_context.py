@@ -0,0 +1,83 @@
+from itertools import chain, zip_longest
+import os
+import threading
+
+from dotenv import load_dotenv
+from github import Auth, Github
+
+from cassettes import get_cassette
+from change_tracker import ChangeTracker
+from workflow_state import get_workflow_store
+
+
+load_dotenv()
+
+# GitHub Enterprise, or a local fake server for benchmarks. Shared with the async loop.
+gh_api_url = os.environ.get('GH_API_URL') or 'https://api.github.com'
+
+github_client = None
+github_client_lock = threading.Lock()
+
+
+def get_github_client(token):
+    '''One PyGithub client, and with it one connection pool, shared by every repository.'''
+    global github_client
+    with github_client_lock:
+        if github_client is None:
+            throttle = {}
+            cassette = get_cassette()
+            if cassette and cassette.replaying:
+                # PyGithub spaces requests out by itself (0.25s, 1s between writes); a replay runs at full speed.
+                throttle = {'seconds_between_requests': None, 'seconds_between_writes': None}
+            github_client = Github(base_url=gh_api_url, auth=Auth.Token(token), **throttle)
+        return github_client
+
+
+def parse_repo_names(value, default_base_branch):
+    '''
+    Parse `GH_REPO_NAMES`: a comma-separated list of `owner/name`, each optionally followed by
+    `:branch` to override the base branch. Returns `(repo_name, base_branch)` pairs.
+    '''
+    repos = []
+    for entry in (value or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, branch = entry.partition(':')
+        repos.append((name.strip(), branch.strip() or default_base_branch))
+    return repos
+
+
+class RepoContext:
+    '''
+    Per-repository state of the agent loop. The GitHub client, HTTP cache, LLM clients and worker pool
+    are shared, so each extra repository only adds its change tracker and a lazily loaded repo object.
+    The tracker is backed by the shared workflow store, so it survives restarts.
+    '''
+
+    def __init__(self, name, base_branch, token, full_sync_every):
+        self.name = name
+        self.base_branch = base_branch
+        self.token = token
+        self.change_tracker = ChangeTracker(full_sync_every, store=get_workflow_store(), repo_name=name)
+        self.repo = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'RepoContext({self.name!r})'
+
+    def get_repo(self):
+        with self.lock:
+            if self.repo is None:
+                self.repo = get_github_client(self.token).get_repo(self.name)
+            return self.repo
+
+    def work_key(self, kind, number):
+        '''Work item keys carry the repository, so items from different repos never collide.'''
+        return (self.name, kind, number)
+
+
+def round_robin(groups):
+    '''Interleave lists one item at a time, so a busy repository cannot starve the others.'''
+    missing = object()
+    return [item for item in chain.from_iterable(zip_longest(*groups, fillvalue=missing)) if item is not missing]
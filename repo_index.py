@@ -0,0 +1,221 @@
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+from time import monotonic
+
+from dotenv import load_dotenv
+
+from git_worktrees import get_worktree_engine, run_git
+from prompt_budget import count_tokens, truncate_tokens
+
+
+load_dotenv()
+
+# Give the agents relevant snippets of the target repository instead of the fixed `project_description`.
+repo_index_enabled = os.environ.get('REPO_INDEX') == 'True'
+repo_index_path = os.environ.get('REPO_INDEX_PATH') or '.repo_index.sqlite'
+# Upper bound on the project context added to a prompt.
+repo_index_context_tokens = int(os.environ.get('REPO_INDEX_CONTEXT_TOKENS') or 1500)
+# A branch is re-fetched and re-indexed at most this often.
+repo_index_refresh_seconds = int(os.environ.get('REPO_INDEX_REFRESH_SECONDS') or 60)
+
+chunk_lines = 60
+max_file_bytes = 200_000
+max_query_terms = 32
+skipped_path_pattern = re.compile(r'(^|/)(node_modules|dist|build|vendor|\.git)/|\.(lock|min\.js|map|png|jpe?g|gif|ico|svg|pdf|zip)$')
+symbol_pattern = re.compile(
+    r'^\s*(?:export\s+)?(?:async\s+)?(?:def|class|function|const|let|var|interface|type)\s+([A-Za-z_$][\w$]*)',
+    re.MULTILINE,
+)
+word_pattern = re.compile(r'[A-Za-z_][A-Za-z0-9_]{2,}')
+stop_words = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'not', 'but', 'have', 'has', 'when',
+    'should', 'would', 'could', 'please', 'into', 'can', 'will', 'all', 'any', 'use', 'add', 'make',
+}
+
+
+def read_blobs(mirror, shas):
+    '''Read many blobs with one `git cat-file --batch` process.'''
+    result = subprocess.run(
+        ['git', 'cat-file', '--batch'], cwd=mirror, input=''.join(f'{sha}\n' for sha in shas).encode(),
+        capture_output=True, check=True,
+    )
+    output = result.stdout
+    blobs = {}
+    position = 0
+    for sha in shas:
+        header_end = output.index(b'\n', position)
+        header = output[position:header_end].split()
+        size = int(header[2])
+        blobs[sha] = output[header_end + 1:header_end + 1 + size]
+        position = header_end + 1 + size + 1
+    return blobs
+
+
+def chunk_file(content):
+    '''Split a file into `chunk_lines`-line chunks. Returns `(start_line, symbols, text)` tuples.'''
+    lines = content.splitlines()
+    chunks = []
+    for start in range(0, len(lines), chunk_lines):
+        text = '\n'.join(lines[start:start + chunk_lines])
+        chunks.append((start + 1, ' '.join(symbol_pattern.findall(text)), text))
+    return chunks
+
+
+def match_query(text):
+    '''Turn free text into an FTS5 query matching any of its distinctive words.'''
+    terms = []
+    for word in word_pattern.findall(text or ''):
+        word = word.lower()
+        if word not in stop_words and word not in terms:
+            terms.append(word)
+    return ' OR '.join(f'"{term}"' for term in terms[:max_query_terms])
+
+
+class RepoIndex:
+    '''
+    A BM25 (SQLite FTS5) index of each repository's files, chunked, with the symbols each chunk defines.
+    It is read from the cached bare clones of `git_worktrees` and kept current by re-indexing only the
+    files whose blob changed since the last indexed commit.
+    '''
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.refreshed = {}
+        self.build_locks = {}
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS indexed_commits (
+                repo_name TEXT PRIMARY KEY,
+                branch TEXT NOT NULL,
+                commit_sha TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                repo_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                blob_sha TEXT NOT NULL,
+                PRIMARY KEY (repo_name, path)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                repo_name UNINDEXED, path, start_line UNINDEXED, symbols, content
+            );
+        ''')
+        self.db.commit()
+
+    def build_lock(self, repo_name):
+        with self.lock:
+            return self.build_locks.setdefault(repo_name, threading.Lock())
+
+    def update(self, repo_name, branch, engine):
+        '''
+        Fetch `branch` (normally the base branch) and re-index the files that changed since the last indexed
+        commit. Returns how many files were re-indexed or dropped. A caller that arrives while another is
+        building the repository's index waits for it, so it never searches a partly built index.
+        '''
+        with self.build_lock(repo_name):
+            with self.lock:
+                last_refresh = self.refreshed.get((repo_name, branch))
+                if last_refresh is not None and monotonic() - last_refresh < repo_index_refresh_seconds:
+                    return 0
+                self.refreshed[(repo_name, branch)] = monotonic()
+            return self.build(repo_name, branch, engine)
+
+    def build(self, repo_name, branch, engine):
+        # The mirror is shared with the worktrees, which clone and fetch into it under the same lock.
+        with engine.repo_lock(repo_name):
+            mirror = engine.ensure_mirror(repo_name, branch)
+            commit_sha = run_git(['rev-parse', f'refs/heads/{branch}'], cwd=mirror).strip()
+        with self.lock:
+            row = self.db.execute('SELECT commit_sha FROM indexed_commits WHERE repo_name = ?', (repo_name,)).fetchone()
+            if row and row[0] == commit_sha:
+                return 0
+            indexed = dict(self.db.execute('SELECT path, blob_sha FROM files WHERE repo_name = ?', (repo_name,)))
+
+        current = {}
+        for line in run_git(['ls-tree', '-r', '-l', commit_sha], cwd=mirror).splitlines():
+            meta, path = line.split('\t', 1)
+            mode, kind, blob_sha, size = meta.split()
+            if kind == 'blob' and size != '-' and int(size) <= max_file_bytes and not skipped_path_pattern.search(path):
+                current[path] = blob_sha
+
+        changed = [path for path, blob_sha in current.items() if indexed.get(path) != blob_sha]
+        removed = [path for path in indexed if path not in current]
+        blobs = read_blobs(mirror, sorted({current[path] for path in changed})) if changed else {}
+
+        with self.lock, self.db:
+            for path in changed + removed:
+                self.db.execute('DELETE FROM chunks WHERE repo_name = ? AND path = ?', (repo_name, path))
+                self.db.execute('DELETE FROM files WHERE repo_name = ? AND path = ?', (repo_name, path))
+            for path in changed:
+                data = blobs[current[path]]
+                if b'\0' in data[:8000]:
+                    continue
+                self.db.executemany(
+                    'INSERT INTO chunks (repo_name, path, start_line, symbols, content) VALUES (?, ?, ?, ?, ?)',
+                    [(repo_name, path, *chunk) for chunk in chunk_file(data.decode('utf-8', errors='replace'))],
+                )
+                self.db.execute('INSERT INTO files VALUES (?, ?, ?)', (repo_name, path, current[path]))
+            self.db.execute(
+                'INSERT OR REPLACE INTO indexed_commits VALUES (?, ?, ?)', (repo_name, branch, commit_sha)
+            )
+        print(f'[RepoIndex.update] {repo_name}@{branch}: {len(changed)} changed, {len(removed)} removed')
+        return len(changed) + len(removed)
+
+    def search(self, repo_name, text, limit=8):
+        '''The chunks most relevant to `text`, best first, as `(path, start_line, content)`.'''
+        query = match_query(text)
+        if not query:
+            return []
+        with self.lock:
+            # Column weights: a match in a path or a defined symbol counts for more than one in the body.
+            return self.db.execute('''
+                SELECT path, start_line, content FROM chunks
+                WHERE chunks MATCH ? AND repo_name = ?
+                ORDER BY bm25(chunks, 0, 3.0, 0, 5.0, 1.0) LIMIT ?
+            ''', (query, repo_name, limit)).fetchall()
+
+    def file_tree(self, repo_name):
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT path FROM files WHERE repo_name = ? ORDER BY path', (repo_name,))]
+
+    def project_context(self, repo_name, text, max_tokens=repo_index_context_tokens, model_name=None):
+        '''The file list and the snippets most relevant to `text`, within `max_tokens`.'''
+        # A quarter of the budget at most for the file list, the rest for snippets.
+        tree = truncate_tokens('\n'.join(f'- `{path}`' for path in self.file_tree(repo_name)), max_tokens // 4, model_name)
+        parts = [f'Files:\n{tree}']
+        remaining = max_tokens - count_tokens(tree, model_name)
+        for path, start_line, content in self.search(repo_name, text):
+            snippet = f'`{path}` (from line {start_line}):\n```\n{content}\n```'
+            tokens = count_tokens(snippet, model_name)
+            if tokens > remaining:
+                break
+            parts.append(snippet)
+            remaining -= tokens
+        return '\n\n'.join(parts)
+
+
+repo_index = None
+repo_index_lock = threading.Lock()
+
+
+def get_repo_index():
+    global repo_index
+    with repo_index_lock:
+        if repo_index is None:
+            repo_index = RepoIndex(repo_index_path)
+        return repo_index
+
+
+def get_project_context(repo_name, branch, text, token):
+    '''Project context for a prompt, or None when the index is disabled or unavailable.'''
+    if not repo_index_enabled:
+        return None
+    try:
+        index = get_repo_index()
+        index.update(repo_name, branch, get_worktree_engine(token))
+        return index.project_context(repo_name, text)
+    except Exception as e:
+        print(f'[get_project_context] {repo_name} Error: {e}')
+        return None
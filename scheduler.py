@@ -0,0 +1,161 @@
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from itertools import count
+import os
+import threading
+from time import time
+
+from crewai import Process
+from dotenv import load_dotenv
+
+from comment_streaming import activate_stream
+from crew_memory import ManagedMemoryCrew
+from telemetry import metrics, stage, work_key_attributes
+
+
+load_dotenv()
+
+# Lower runs first. Approvals and replies to a human's feedback keep that person waiting; new plans do not.
+PRIORITY_APPROVAL = 0
+PRIORITY_REPLY = 1
+PRIORITY_NEW = 2
+priority_names = {PRIORITY_APPROVAL: 'approval', PRIORITY_REPLY: 'reply', PRIORITY_NEW: 'new'}
+# Default seconds from queueing to starting an item, by priority. An item past its deadline runs before any that is not.
+priority_deadlines = {PRIORITY_APPROVAL: 60, PRIORITY_REPLY: 300, PRIORITY_NEW: 1800}
+# Every WORK_AGING_SECONDS (default 120) an item waits raises it one priority level, so nothing starves.
+work_aging_seconds = float(os.environ.get('WORK_AGING_SECONDS') or 120)
+
+# `key` is the `(repo_name, kind, number)` of the issue or pull request the tasks belong to. `deadline`
+# (epoch seconds) overrides the priority's default. `action`, when set, is called instead of running
+# `tasks` in a crew, for work that needs no agent, like opening an approved plan's pull request.
+WorkItem = namedtuple('WorkItem', ['key', 'tasks', 'priority', 'deadline', 'action'], defaults=(PRIORITY_NEW, None, None))
+QueuedItem = namedtuple('QueuedItem', ['item', 'future', 'queued_at', 'deadline', 'sequence'])
+
+metrics.describe('agent_work_wait_seconds', 'Time work items waited in the scheduler queue, by priority')
+metrics.describe('agent_work_deadline_missed_total', 'Work items started after their deadline, by priority')
+
+
+class TaskScheduler:
+    '''
+    Runs each issue's or pull request's tasks in its own crew on a bounded worker pool, so one slow
+    LLM call only holds up its own item. `max_rpm` is split evenly between the workers so that all
+    crews together stay under it; there are never more workers than `max_rpm`, so each gets at least one.
+
+    Items wait in one queue that lives across polling passes and is shared by every caller, and start, as
+    workers free up, in this order: items past their deadline, earliest deadline first; then by priority,
+    less one level per `work_aging_seconds` waited; then in the order they were queued. Callers `submit`
+    without waiting, so an approval found by the next pass or webhook overtakes older queued work.
+    An item whose key is already queued or running is not queued again.
+    '''
+
+    def __init__(self, workers, max_rpm):
+        self.workers = max(1, min(workers, max_rpm))
+        self.crew_max_rpm = max(1, max_rpm // self.workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crew')
+        self.lock = threading.Lock()
+        self.pending = []
+        self.running = 0
+        self.sequence = count()
+        # Futures of the items queued or running, by key.
+        self.active = {}
+        self.idle = threading.Condition(self.lock)
+
+    def rank(self, queued, now):
+        if queued.deadline <= now:
+            return 0, queued.deadline, queued.sequence
+        return 1, queued.item.priority - (now - queued.queued_at) / work_aging_seconds, queued.sequence
+
+    def submit(self, item):
+        '''Queue `item` and return a future for its result, or the future of the same key already queued or running.'''
+        now = time()
+        deadline = item.deadline or now + priority_deadlines[item.priority]
+        queued = QueuedItem(item, Future(), now, deadline, next(self.sequence))
+        with self.lock:
+            if item.key in self.active:
+                return self.active[item.key]
+            self.active[item.key] = queued.future
+            self.pending.append(queued)
+        self.dispatch()
+        return queued.future
+
+    def is_active(self, key):
+        '''Whether the item `key` is queued or running.'''
+        with self.lock:
+            return key in self.active
+
+    def outstanding(self):
+        with self.lock:
+            return len(self.active)
+
+    def wait_idle(self):
+        '''Block until nothing is queued or running.'''
+        with self.idle:
+            self.idle.wait_for(lambda: not self.active)
+
+    def dispatch(self):
+        '''Start the best-ranked pending items on any free workers.'''
+        with self.lock:
+            while self.pending and self.running < self.workers:
+                now = time()
+                queued = min(self.pending, key=lambda queued: self.rank(queued, now))
+                self.pending.remove(queued)
+                self.running += 1
+                self.executor.submit(self.run_queued, queued)
+
+    def run_queued(self, queued):
+        try:
+            started = time()
+            priority = priority_names[queued.item.priority]
+            metrics.observe('agent_work_wait_seconds', started - queued.queued_at, priority=priority)
+            if started > queued.deadline:
+                metrics.inc('agent_work_deadline_missed_total', priority=priority)
+                print(f'[TaskScheduler.run_queued] {queued.item.key} ({priority}) started {started - queued.deadline:.0f}s past its deadline')
+            if queued.future.set_running_or_notify_cancel():
+                try:
+                    queued.future.set_result(self.run_item(queued.item))
+                except Exception as e:
+                    print(f'[TaskScheduler.run_queued] Error in {queued.item.key}: {e}')
+                    queued.future.set_exception(e)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.active.pop(queued.item.key, None)
+                if not self.active:
+                    self.idle.notify_all()
+            self.dispatch()
+
+    def run_item(self, item):
+        if item.action is not None:
+            return item.action()
+
+        agents = []
+        for task in item.tasks:
+            if task.agent not in agents:
+                agents.append(task.agent)
+
+        # Memory goes to the shared, bounded store, scoped to this item, rather than new stores per crew.
+        crew = ManagedMemoryCrew(
+            agents=agents,
+            tasks=item.tasks,
+            verbose=2,
+            process=Process.sequential,
+            memory=True,
+            memory_scope=item.key,
+            cache=True,
+            max_rpm=self.crew_max_rpm,
+            share_crew=True
+        )
+        with stage('task', **work_key_attributes(item.key)), activate_stream(item.key):
+            return crew.kickoff()
+
+    def run(self, work_items):
+        '''
+        Run all work items and wait for them. A failing item is reported and left for the next pass;
+        it does not stop the others. Returns `(item, result)` pairs for the items that succeeded.
+        '''
+        futures = {self.submit(item): item for item in work_items}
+        results = []
+        for future in as_completed(futures):
+            if future.exception() is None:
+                results.append((futures[future], future.result()))
+        return results
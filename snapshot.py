@@ -0,0 +1,90 @@
+from collections import namedtuple
+
+
+Message = namedtuple('Message', ['role', 'content'])
+bot_flag_planner = '[coding agent]'
+
+IssueSnapshot = namedtuple('IssueSnapshot', [
+    'issue',
+    'message_history',
+    'refactor_requested',
+    'approved',
+    'planner_has_commented',
+    'plan',
+])
+PullSnapshot = namedtuple('PullSnapshot', ['pull_request', 'refactor_requested'])
+
+
+def classify_comment(body):
+    lowered = body.lower()
+    if lowered.startswith('refactor'):
+        return Message('refactor_request', body)
+    if lowered.startswith(bot_flag_planner):
+        return Message('planner_response', body)
+    if lowered.startswith('approve'):
+        return Message('approval', body)
+    return Message('comment', body)
+
+
+def snapshot_from_bodies(issue, bodies):
+    '''
+    Classify an issue's comment bodies in a single pass.
+    `bodies` must be in chronological order, as returned by `issue.get_comments()`.
+    '''
+    message_history = [classify_comment(body) for body in bodies]
+    last_role = message_history[-1].role if message_history else None
+
+    plan = None
+    for message in reversed(message_history):
+        if message.role == 'planner_response':
+            plan = message.content
+            break
+
+    return IssueSnapshot(
+        issue=issue,
+        message_history=message_history,
+        refactor_requested=last_role == 'refactor_request',
+        approved=last_role == 'approval',
+        planner_has_commented=any(bot_flag_planner in body.lower() for body in bodies),
+        plan=plan,
+    )
+
+
+def snapshot_issue(issue):
+    try:
+        bodies = [comment.body for comment in issue.get_comments()]
+        return snapshot_from_bodies(issue, bodies)
+    except Exception as e:
+        print(f'[snapshot_issue] Error: {e}')
+        raise e
+
+
+def snapshot_pull_request(pull_request):
+    try:
+        bodies = [comment.body for comment in pull_request.get_comments()]
+        refactor_requested = bool(bodies) and bodies[-1].lower().startswith('refactor')
+        return PullSnapshot(pull_request, refactor_requested)
+    except Exception as e:
+        print(f'[snapshot_pull_request] Error: {e}')
+        raise e
+
+
+class LoopSnapshot:
+    '''
+    Comment snapshots for one pass of the agent loop.
+    Each issue's and pull request's comments are fetched at most once per pass.
+    '''
+
+    def __init__(self):
+        self.issues = {}
+        self.pulls = {}
+
+    def issue(self, issue):
+        if issue.number not in self.issues:
+            self.issues[issue.number] = snapshot_issue(issue)
+        return self.issues[issue.number]
+
+    def pull_request(self, pull_request):
+        if pull_request.number not in self.pulls:
+            self.pulls[pull_request.number] = snapshot_pull_request(pull_request)
+        return self.pulls[pull_request.number]
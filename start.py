@@ -1,121 +1,169 @@
-import base64
-from collections import namedtuple
+from functools import partial
+from itertools import takewhile
 import os
+import socket
 from time import sleep, time
-import random
 
-from github import Github, Auth
-from crewai import Agent, Task, Crew, Process
+from crewai import Agent, Task
+from github import UnknownObjectException
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from interpreter import interpreter
 
+from async_loop import start_async_agent_loop
 from agents import (
-    agent_instructor,
-    agent_coder,
+    build_agent_instructor,
+    build_agent_coder,
+    get_planner_prompt,
     get_planner_task_description,
     planner_task_expected_output,
     # get_planner_refactor_task_description,
     get_coder_task_description,
     get_coder_refactor_task_description,
 )
+from cassettes import get_cassette
+from change_tracker import to_datetime
+from comment_streaming import current_stream, register_stream, streaming_enabled
+from code_changes import extract_file_changes
+from git_commits import commit_files, create_branch_with_files
+from github_graphql import fetch_open_items
+from git_worktrees import WorktreeSession, get_worktree_engine, worktree_tool_instructions, worktrees_enabled
+from github_http import install_github_http
+from llms import cto_llm_name
+from model_router import choose_route, get_route_llm, record_outcome
+from poll_scheduler import PollScheduler
+from prompt_budget import compact_message_history, count_tokens
+from repo_index import get_project_context
+from repo_context import RepoContext, parse_repo_names, round_robin
+from scheduler import PRIORITY_APPROVAL, PRIORITY_NEW, PRIORITY_REPLY, TaskScheduler, WorkItem, priority_names
+from snapshot import LoopSnapshot, bot_flag_planner, snapshot_from_bodies
+from telemetry import in_stage, setup_tracing, stage, start_metrics_server, work_key_attributes
+from webhooks import drain_events, start_webhook_server
+from workflow_state import get_workflow_store, hash_plan, plan_branch_name
+from work_queue import get_work_queue, queue_role
 
 
 load_dotenv()
 
-Message = namedtuple('Message', ['role', 'content'])
-bot_flag_planner = '[coding agent]'
 gh_base_branch = os.environ.get('GH_BASE_BRANCH', 'main')
 gh_access_token = os.environ.get('GH_ACCESS_TOKEN', '')
 gh_repo_name = os.environ.get('GH_REPO_NAME', 'kvnn/AIAgentsStarterKit')
-gh_repo = None
-
-def get_github_info(repo_name=gh_repo_name):
-    global gh_repo
+# Comma-separated `owner/name[:base_branch]` list; falls back to the single GH_REPO_NAME.
+gh_repo_names = parse_repo_names(os.environ.get('GH_REPO_NAMES') or gh_repo_name, gh_base_branch)
+gh_fetch_backend = os.environ.get('GH_FETCH_BACKEND', 'rest')
+gh_graphql_url = os.environ.get('GH_GRAPHQL_URL') or 'https://api.github.com/graphql'
+gh_http_cache_path = os.environ.get('GH_HTTP_CACHE_PATH') or '.github_http_cache.sqlite'
+gh_full_sync_every = int(os.environ.get('GH_FULL_SYNC_EVERY') or 60)
+http_cache = install_github_http(gh_http_cache_path)
+repo_contexts = {
+    name: RepoContext(name, base_branch, gh_access_token, gh_full_sync_every)
+    for name, base_branch in gh_repo_names
+}
+# `poll` (default) or `webhook`. Webhook mode reacts to GitHub events and polls only to reconcile.
+gh_event_mode = os.environ.get('GH_EVENT_MODE') or 'poll'
+gh_webhook_secret = os.environ.get('GH_WEBHOOK_SECRET', '')
+gh_webhook_host = os.environ.get('GH_WEBHOOK_HOST') or '0.0.0.0'
+gh_webhook_port = int(os.environ.get('GH_WEBHOOK_PORT') or 8000)
+gh_reconcile_seconds = int(os.environ.get('GH_RECONCILE_SECONDS') or 300)
+agent_workers = int(os.environ.get('AGENT_WORKERS') or 4)
+agent_max_rpm = int(os.environ.get('AGENT_MAX_RPM') or 100)
+scheduler = TaskScheduler(workers=agent_workers, max_rpm=agent_max_rpm)
+# Run the asyncio loop (async_loop.py) instead of the threaded CrewAI loop
+async_mode = os.environ.get('ASYNC_MODE') == 'True'
+
+
+def get_github_info(context, since=None):
+    '''
+    Fetch a repository's open issues and pull requests. With `since`, only items updated at or after it are returned.
+    '''
     try:
-        if not gh_repo:
-            auth = Auth.Token(gh_access_token)
-            gh = Github(auth=auth)
-            gh_repo = gh.get_repo(repo_name)
-        issues = gh_repo.get_issues(state='open')
-        pulls = gh_repo.get_pulls(state='open')
-        pulls_comments = gh_repo.get_pulls_comments()
+        repo = context.get_repo()
+        if gh_fetch_backend == 'graphql':
+            issues, pulls = fetch_open_items(context.name, gh_access_token, gh_graphql_url, context.get_repo, since=since)
+            # Lazy, as on the REST path: nothing is requested unless a caller reads it.
+            return issues, pulls, repo.get_pulls_comments()
+        if since:
+            issues = repo.get_issues(state='open', since=since)
+            # The pulls endpoint has no `since`; read newest-updated first and stop at the bound.
+            pulls = list(takewhile(
+                lambda pull: to_datetime(pull.updated_at) >= since,
+                repo.get_pulls(state='open', sort='updated', direction='desc'),
+            ))
+        else:
+            issues = repo.get_issues(state='open')
+            pulls = repo.get_pulls(state='open')
+        pulls_comments = repo.get_pulls_comments()
         return issues, pulls, pulls_comments
     except Exception as e:
-        print(f'[get_github_info] Error: {e}')
+        print(f'[get_github_info] {context.name} Error: {e}')
         raise e
 
 
-def issue_needs_planner(issue):
-    try:
-        comments = issue.get_comments()
-        
-        message_history = []
-        refactor_requested = False
-        
-        for comment in comments:
-            if comment.body.lower().startswith('refactor'):
-                message_history.append(Message('refactor_request', comment.body))
-            elif comment.body.lower().startswith(bot_flag_planner):
-                message_history.append(Message('planner_response', comment.body))
-            else:
-                message_history.append(Message('comment', comment.body))
-        
-        if message_history and message_history[-1].role == 'refactor_request':
-            refactor_requested = True
-        
-        return refactor_requested, message_history
-    except Exception as e:
-        print(f'[issue_needs_planner] Error: {e}')
-        raise e
+def as_rest_object(item):
+    '''
+    Records from the GraphQL backend are read-only; resolve the PyGithub object before writing.
+    '''
+    if hasattr(item, 'rest_object'):
+        return item.rest_object()
+    return item
 
 
-def issue_approved_by_human(issue):
-    try:
-        comments = issue.get_comments()
-        if comments.totalCount == 0:
-            return False
-        
-        last_comment = comments.reversed[0].body.lower()
-        return last_comment.startswith('approve')
-    except Exception as e:
-        print(f'[issue_approved_by_human] Error: {e}')
-        raise e
+def issue_needs_planner(snapshot):
+    return snapshot.refactor_requested, snapshot.message_history
 
 
-def pull_request_needs_refactoring(pull_request):
-    try:
-        comments = pull_request.get_comments()
-        if comments.totalCount == 0:
-            return False
-        
-        last_comment = comments.reversed[0].body.lower()
-        return last_comment.startswith('refactor')
-    except Exception as e:
-        print(f'[pull_request_needs_refactoring] Error: {e}')
-        raise e
+def issue_approved_by_human(snapshot):
+    return snapshot.approved
+
 
+def pull_request_needs_refactoring(snapshot):
+    return snapshot.refactor_requested
 
-def create_coder_refactor_task(pull_request):
+
+def create_coder_refactor_task(context, pull_request, route=None):
+    '''
+    `route` forces a model tier; by default the router picks one from the prompt size and refactor count.
+    '''
     try:
         print(f'create_coder_refactor_task: {pull_request}')
         
-        issue = pull_request.base.repo.get_issue(pull_request.number)
-        plan = get_plan_from_issue(issue)
+        # A pull request's conversation comments are its issue comments, so the plan can be read from them directly.
+        issue_comments = [comment.body for comment in pull_request.get_issue_comments()]
+        plan = get_plan_from_issue(snapshot_from_bodies(pull_request, issue_comments))
         
         refactor_comments = []
-        comments = pull_request.get_issue_comments()
-        for comment in comments:
-            if comment.body.lower().startswith('refactor'):
-                refactor_comments.append(comment.body)
+        for body in issue_comments:
+            if body.lower().startswith('refactor'):
+                refactor_comments.append(body)
         
         refactor_feedback = '\n'.join(refactor_comments)
+        description = get_coder_refactor_task_description(pull_request, plan, refactor_feedback)
+        route = route or choose_route('coder', description, refactor_rounds=len(refactor_comments))
+
+        project_context = get_project_context(
+            context.name, context.base_branch, f'{plan}\n{refactor_feedback}', gh_access_token
+        )
+        if project_context:
+            description += f'\nRelevant code from the repository:\n{project_context}'
+
+        # With worktrees the coder reads and edits a local checkout of the branch instead of replying with whole files.
+        session = None
+        tools = None
+        if worktrees_enabled:
+            head_ref = pull_request.head_ref if hasattr(pull_request, 'head_ref') else pull_request.head.ref
+            session = WorktreeSession(get_worktree_engine(gh_access_token), context.name, head_ref)
+            tools = session.tools()
+            description += worktree_tool_instructions
         
         task = Task(
-            description=get_coder_refactor_task_description(pull_request, plan, refactor_feedback),
-            agent=agent_coder,
+            description=description,
+            agent=build_agent_coder(get_route_llm(route), tools),
             expected_output='Updated pull request with refactored code',
-            callback=lambda task: callback_coder_refactor_task(task, pull_request)
+            callback=in_stage(
+                'callback',
+                lambda task: callback_coder_refactor_task(task, context, pull_request, route, session),
+                repo=context.name, kind='pull', number=pull_request.number,
+            )
         )
         return task
     except Exception as e:
@@ -123,29 +171,34 @@ def create_coder_refactor_task(pull_request):
         raise e
 
 
-def create_planner_task(issue, message_history):
+def create_planner_task(context, issue, message_history, route=None):
     '''
     Create a task for the architect to create a Technical Spec and Implementation Plan.
     `message_history` is a list of Message objects representing the comment history.
+    `route` forces a model tier; by default the router picks one from the prompt size and refactor count.
     '''
     try:
         print(f'create_planner_task: {issue}')
         
-        history_str = '\n'.join(f'{msg.role.upper()}: {msg.content}' for msg in message_history)
-        
-        prompt = f'''
-            {issue.title}
-            {issue.body}
-            
-            Message History:
-            {history_str}
-        '''
+        body, compacted_history = compact_message_history(issue.title, issue.body, message_history, cto_llm_name)
+        prompt = get_planner_prompt(issue.title, body, compacted_history)
+        print(f'[create_planner_task] {issue}: {count_tokens(prompt, cto_llm_name)} prompt tokens')
+        refactor_rounds = len([message for message in message_history if message.role == 'refactor_request'])
+        route = route or choose_route('planner', prompt, refactor_rounds)
+        register_stream(context.work_key('issue', issue.number), lambda: as_rest_object(issue))
+        project_context = get_project_context(
+            context.name, context.base_branch, f'{issue.title}\n{issue.body}', gh_access_token
+        )
         
         task = Task(
             description=get_planner_task_description(prompt),
-            agent=agent_instructor,
+            agent=build_agent_instructor(get_route_llm(route, streaming=streaming_enabled), project_context),
             expected_output=planner_task_expected_output,
-            callback=lambda task: callback_planner_task(task, issue)
+            callback=in_stage(
+                'callback',
+                lambda task: callback_planner_task(task, context, issue, route, message_history),
+                repo=context.name, kind='issue', number=issue.number,
+            )
         )
         return task
     except Exception as e:
@@ -153,10 +206,24 @@ def create_planner_task(issue, message_history):
         raise e
 
 
-def callback_planner_task(task_output, issue):
+def callback_planner_task(task_output, context, issue, route, message_history):
     try:
         print(f'callback_planner_task: {issue}')
+        escalation = record_outcome(route, task_output.raw_output)
+        if escalation:
+            # We are already on a worker thread, so run the retry inline rather than through the pool.
+            key = context.work_key('issue', issue.number)
+            scheduler.run_item(WorkItem(key, [create_planner_task(context, issue, message_history, escalation)]))
+            return
+
         body = f'''{bot_flag_planner}\n{task_output.raw_output}'''
+        stream = current_stream()
+        if stream is not None and stream.key == context.work_key('issue', issue.number):
+            # The comment was created while streaming; replace the draft with the final plan.
+            stream.finish(body)
+            return
+
+        issue = as_rest_object(issue)
         comment = issue.create_comment(
             body=body
         )
@@ -165,47 +232,54 @@ def callback_planner_task(task_output, issue):
         raise e
 
 
-def callback_coder_task(task_output, issue):
-    base_ref = gh_repo.get_git_ref(f"heads/{gh_base_branch}")
+def callback_coder_task(task_output, context, issue):
+    issue = as_rest_object(issue)
+    repo = context.get_repo()
+    base_ref = repo.get_git_ref(f"heads/{context.base_branch}")
     new_branch_name = f"refs/heads/feature/issue-{issue.id}"
 
     # Create a new branch from the base branch
-    gh_repo.create_git_ref(
+    repo.create_git_ref(
         ref=new_branch_name,
         sha=base_ref.object.sha
     )
-    gh_repo.create_pull(
-        base=gh_base_branch,
+    repo.create_pull(
+        base=context.base_branch,
         head=new_branch_name,
         body=task_output.raw_output,
         issue=issue
     )
 
-def callback_coder_refactor_task(task_output, pull_request):
+def callback_coder_refactor_task(task_output, context, pull_request, route, session=None):
     try:
-        # Extract the refactored code from the task output
-        refactored_code = extract_code_changes(task_output.raw_output)
-        
-        # Get the existing pull request file
-        contents = pull_request.get_files()
-        if contents.totalCount != 1:
-            raise ValueError(f"Expected 1 file in the pull request, but found {contents.totalCount}")
-        
-        file_content = contents[0]
-        file_path = file_content.filename
-        file_sha = file_content.sha
-        
-        # Update the file with the refactored code
+        escalation = record_outcome(route, task_output.raw_output, wrote_files=bool(session and session.has_changes))
+        if escalation:
+            if session:
+                session.close()
+            key = context.work_key('pull', pull_request.number)
+            scheduler.run_item(WorkItem(key, [create_coder_refactor_task(context, pull_request, escalation)]))
+            return
+
+        pull_request = as_rest_object(pull_request)
         commit_message = f"Refactored code for pull request #{pull_request.number}"
-        content = base64.b64encode(refactored_code.encode("utf-8")).decode("utf-8")
-        update_result = pull_request.base.repo.update_file(
-            path=file_path,
-            message=commit_message,
-            content=content,
-            sha=file_sha,
-            branch=pull_request.head.ref
-        )
-        
+
+        if session and session.has_changes:
+            if session.commit_and_push(commit_message):
+                print(f"Pushed {len(session.worktree.written)} files to {pull_request.head.ref}")
+            else:
+                # The files were rewritten with their current contents.
+                print(f"No changes to push to {pull_request.head.ref}")
+        else:
+            # Every file in the task output goes into one commit. A single-file pull request also accepts bare code.
+            pull_files = pull_request.get_files()
+            default_path = pull_files[0].filename if pull_files.totalCount == 1 else None
+            changes = extract_file_changes(task_output.raw_output, default_path)
+            if not changes:
+                raise ValueError(f"No file changes found in the output for pull request #{pull_request.number}")
+
+            commit_files(pull_request.head.repo, pull_request.head.ref, changes, commit_message)
+            print(f"Committed {len(changes)} files to {pull_request.head.ref}")
+
         # Add a comment to the pull request with the refactoring details
         comment_body = f"Refactored code based on the provided feedback:\n\n{task_output.raw_output}"
         pull_request.create_issue_comment(comment_body)
@@ -214,13 +288,16 @@ def callback_coder_refactor_task(task_output, pull_request):
     except Exception as e:
         print(f"[callback_coder_refactor_task] Error: {e}")
         raise e
+    finally:
+        if session:
+            session.close()
 
 def callback_qa_task(task_output, issue):
     # TODO
     pass
 
 
-def create_coder_task(issue, plan):
+def create_coder_task(context, issue, plan):
     '''
     Create a task for the coder to implement the solution based on the Planner's plan
     '''
@@ -229,9 +306,9 @@ def create_coder_task(issue, plan):
 
         task = Task(
             description=get_coder_task_description(issue, plan),
-            agent=agent_coder,
+            agent=build_agent_coder(),
             expected_output='A pull request that implements the solution for the given GitHub issue',
-            callback=lambda task: callback_coder_task(task, issue)
+            callback=lambda task: callback_coder_task(task, context, issue)
         )
         return task
     except Exception as e:
@@ -243,150 +320,399 @@ def create_qa_task(issue, feedback):
     # TODO
     pass
 
-def get_plan_from_issue(issue):
-    try:
-        comments = issue.get_comments()
-        
-        for comment in comments.reversed:
-            if comment.body.lower().startswith(bot_flag_planner):
-                return comment.body
-        
-        return None
-    except Exception as e:
-        print(f'[get_plan_from_issue] Error: {e}')
-        raise e
-
-def planner_has_commented(issue):
-    comments = issue.get_comments()
+def get_plan_from_issue(snapshot):
+    return snapshot.plan
 
-    for comment in comments:
-        if bot_flag_planner in comment.body.lower():
-            return True
 
-    return False
+def planner_has_commented(snapshot):
+    return snapshot.planner_has_commented
 
 
-def is_pull_request_open(issue):
+def is_pull_request_open(context, issue):
     if not issue.pull_request:
         return False
     
     pull_request_url = issue.pull_request.html_url
     pull_number = int(pull_request_url.split('/')[-1])
-    pull_request = gh_repo.get_pull(pull_number)
+    pull_request = context.get_repo().get_pull(pull_number)
     
     return pull_request.state == 'open'
 
 
-def create_pull_request_from_plan(issue, plan):
-    global gh_repo
-
+def create_pull_request_from_plan(context, issue, plan):
+    '''
+    Open the pull request for an approved plan. The branch name is derived from the plan, and every step
+    first checks for what an interrupted earlier attempt left behind, so a retry resumes instead of duplicating.
+    '''
     try:
+        repo = context.get_repo()
+        workflow_store = get_workflow_store()
+        key = ('issue', issue.number)
+
         # Extract necessary information from the plan
         title = issue.title
         description = f'''Automated PR for Issue #{issue.number}
         Plan: {plan}
         '''
-        new_branch_name = f'feature/issue-{issue.number}-{issue.id}-{random.randint(1000, 9999)}'
+        plan_hash = hash_plan(plan)
+        new_branch_name = plan_branch_name(issue.number, plan_hash)
+
+        state = workflow_store.get(context.name, key)
+        if state and state.pull_number and state.plan_hash == plan_hash:
+            pull_request = repo.get_pull(state.pull_number)
+            if pull_request.state == 'open':
+                print(f'[create_pull_request_from_plan] #{issue.number} already has pull request #{state.pull_number}')
+                return pull_request
+            # Closed without the issue being settled: open a new one. `begin_pull_request` clears the stored number.
+            print(f'[create_pull_request_from_plan] #{issue.number} pull request #{state.pull_number} is closed')
 
         # Verify the base branch exists
-        base_branch = gh_base_branch
+        base_branch = context.base_branch
         try:
-            base_branch_commit = gh_repo.get_branch(base_branch).commit.sha
+            base_branch_commit = repo.get_branch(base_branch).commit.sha
         except Exception as e:
             print(f'Error: Base branch "{base_branch}" not found: {e}')
             return None
 
-        # Create a new branch for the pull request
-        gh_repo.create_git_ref(ref=f"refs/heads/{new_branch_name}", sha=base_branch_commit)
+        attempts = workflow_store.begin_pull_request(context.name, key, plan_hash, new_branch_name)
+        print(f'[create_pull_request_from_plan] #{issue.number} attempt {attempts} on {new_branch_name}')
 
-        # Create a new file with the plan content in the new branch
-        gh_repo.create_file(
-            path=f"plan_{issue.id}.md",
-            message=f"Create plan for {title}",
-            content=description,
-            branch=new_branch_name,
-        )
+        # Create the branch with the plan file in one commit. It only exists once complete, so an existing
+        # branch means an earlier attempt got this far.
+        try:
+            repo.get_git_ref(f"heads/{new_branch_name}")
+        except UnknownObjectException:
+            create_branch_with_files(
+                repo,
+                new_branch_name,
+                base_branch_commit,
+                {f"plan_{issue.id}.md": description},
+                f"Create plan for {title}",
+            )
 
         # Create a new pull request
-        pull_request = gh_repo.create_pull(
-            issue=issue,
-            body=description,
-            head=new_branch_name,
-            base=base_branch
-        )
+        existing_pulls = list(repo.get_pulls(state='open', head=f'{repo.owner.login}:{new_branch_name}'))
+        if existing_pulls:
+            pull_request = existing_pulls[0]
+        else:
+            pull_request = repo.create_pull(
+                issue=as_rest_object(issue),
+                body=description,
+                head=new_branch_name,
+                base=base_branch
+            )
 
+        workflow_store.finish_pull_request(context.name, key, pull_request.number)
         return pull_request
     except Exception as e:
         print(f'[create_pull_request_from_plan] Error: {e}')
         raise e
 
 
+def classify_items(context, issues, pulls, leased=False):
+    '''
+    Classify a repository's issues and pull requests, creating planner and refactor tasks for the ones that need them
+    and queueing approved plans' pull requests. Returns the work as one prioritized `WorkItem` per issue or pull
+    request, and the change-tracker keys of every item seen. `leased` items skip the unchanged check: the producer
+    already found them changed, and the 'queued' stage it stored would otherwise count as settled.
+    '''
+    issue_tasks = []
+    coder_tasks = []
+    snapshot = LoopSnapshot()
+    seen_keys = set()
+    change_tracker = context.change_tracker
+
+    for issue in issues:
+        key = ('issue', issue.number)
+        seen_keys.add(key)
+        if not leased and change_tracker.is_unchanged(key, issue.updated_at):
+            continue
+        if not leased and scheduler.is_active(context.work_key('issue', issue.number)):
+            # Still queued or running from an earlier pass; its stage stays unsettled, so it is read again.
+            continue
+
+        print(f'Issue: {issue}')
+        if is_pull_request_open(context, issue):
+            item_stage = 'pull_request_open'
+        else:
+            issue_snapshot = snapshot.issue(issue)
+            refactor_requested, message_history = issue_needs_planner(issue_snapshot)
+            if refactor_requested or not planner_has_commented(issue_snapshot):
+                item_stage = 'needs_planner'
+                issue_tasks.append(WorkItem(
+                    context.work_key('issue', issue.number),
+                    [create_planner_task(context, issue, message_history)],
+                    PRIORITY_REPLY if refactor_requested else PRIORITY_NEW,
+                ))
+            elif issue_approved_by_human(issue_snapshot):
+                item_stage = 'approved'
+                plan = get_plan_from_issue(issue_snapshot)
+                work_key = context.work_key('issue', issue.number)
+                open_pull_request = partial(create_pull_request_from_plan, context, issue, plan)
+                issue_tasks.append(WorkItem(work_key, [], PRIORITY_APPROVAL, action=in_stage(
+                    'approval', open_pull_request, **work_key_attributes(work_key)
+                )))
+                # coder_tasks.append(create_coder_task(context, issue, plan))
+            else:
+                item_stage = 'awaiting_human'
+        change_tracker.record(key, issue.updated_at, item_stage)
+
+    # Iterate over open pull requests to check if refactoring is needed
+    for pull_request in pulls:
+        key = ('pull', pull_request.number)
+        seen_keys.add(key)
+        if not leased and change_tracker.is_unchanged(key, pull_request.updated_at):
+            continue
+        if not leased and scheduler.is_active(context.work_key('pull', pull_request.number)):
+            continue
+
+        if pull_request_needs_refactoring(snapshot.pull_request(pull_request)):
+            item_stage = 'needs_refactor'
+            coder_tasks.append(WorkItem(
+                context.work_key('pull', pull_request.number),
+                [create_coder_refactor_task(context, pull_request)],
+                PRIORITY_REPLY,
+            ))
+        else:
+            item_stage = 'awaiting_human'
+        change_tracker.record(key, pull_request.updated_at, item_stage)
+
+    return issue_tasks, coder_tasks, seen_keys
+
+
+def run_tasks(work_item_groups):
+    '''
+    Queue the work items of several repositories, one group per repository, on the shared worker pool
+    without waiting for them, so the next pass can add more urgent work ahead of what is still queued.
+    Items start in priority order; within a priority they are interleaved round-robin so every
+    repository gets a turn before any gets a second one.
+    '''
+    work_items = round_robin(work_item_groups)
+
+    num_human_tasks = sum(context.change_tracker.count('awaiting_human') for context in repo_contexts.values())
+    num_approvals = len([item for item in work_items if item.action is not None])
+    num_planner_tasks = len([item for item in work_items if item.key[1] == 'issue']) - num_approvals
+    num_by_priority = {name: len([item for item in work_items if item.priority == priority])
+                       for priority, name in priority_names.items()}
+
+    print(f'- Human task count: {num_human_tasks}')
+    print(f'- Approval count: {num_approvals}')
+    print(f'- Planner task count: {num_planner_tasks}')
+    print(f'- Coder task count: {len(work_items) - num_planner_tasks - num_approvals}')
+    print(f'- By priority: {num_by_priority}')
+
+    for item in work_items:
+        scheduler.submit(item)
+    print(f'- Scheduler: {scheduler.outstanding()} queued or running')
+
+    cache_hits, cache_misses = http_cache.stats(reset=True)
+    print(f'- HTTP cache: {cache_hits} hits, {cache_misses} misses')
+    cassette = get_cassette()
+    if cassette:
+        print(f'- Cassette ({cassette.mode}): {dict(cassette.stats)}')
+
+
+def collect_work_items(context):
+    '''One polling pass over a repository. A failing repository is reported and skipped until the next pass.'''
+    try:
+        since = context.change_tracker.since()
+        with stage('github_fetch', repo=context.name, full_sync=since is None):
+            issues, pulls, pulls_comments = get_github_info(context, since=since)
+            # The REST lists are lazy; read them here so the fetch is timed as part of this stage.
+            issues, pulls = list(issues), list(pulls)
+        with stage('classify', repo=context.name, issues=len(issues), pulls=len(pulls)):
+            issue_tasks, coder_tasks, seen_keys = classify_items(context, issues, pulls)
+        context.change_tracker.prune(seen_keys, full_sync=since is None)
+        return issue_tasks + coder_tasks
+    except Exception as e:
+        print(f'[collect_work_items] {context.name} Error: {e}')
+        return []
+
+
+def collect_changed_keys(context):
+    '''
+    A producer's polling pass over a repository: the work keys of every changed issue and pull request,
+    left for the queue workers to classify. A failing repository is reported and skipped until the next pass.
+    '''
+    try:
+        change_tracker = context.change_tracker
+        since = change_tracker.since()
+        with stage('github_fetch', repo=context.name, full_sync=since is None):
+            issues, pulls, pulls_comments = get_github_info(context, since=since)
+            issues, pulls = list(issues), list(pulls)
+        keys = []
+        seen_keys = set()
+        for kind, items in (('issue', issues), ('pull', pulls)):
+            for item in items:
+                key = (kind, item.number)
+                seen_keys.add(key)
+                if change_tracker.is_unchanged(key, item.updated_at):
+                    continue
+                change_tracker.record(key, item.updated_at, 'queued')
+                keys.append(context.work_key(kind, item.number))
+        change_tracker.prune(seen_keys, full_sync=since is None)
+        return keys
+    except Exception as e:
+        print(f'[collect_changed_keys] {context.name} Error: {e}')
+        return []
+
+
+def run_poll_pass():
+    if queue_role == 'producer':
+        keys = round_robin([collect_changed_keys(context) for context in repo_contexts.values()])
+        get_work_queue().enqueue(keys)
+        print(f'- Enqueued: {len(keys)}, queued: {get_work_queue().count("queued")}')
+        return
+    run_tasks([collect_work_items(context) for context in repo_contexts.values()])
+
+
+def classify_leased_key(key):
+    '''Fetch a leased issue or pull request and classify it. Returns its work items, possibly none.'''
+    repo_name, kind, number = key
+    context = repo_contexts[repo_name]
+    repo = context.get_repo()
+    if kind == 'issue':
+        issue_tasks, coder_tasks, seen_keys = classify_items(context, [repo.get_issue(number)], [], leased=True)
+    else:
+        issue_tasks, coder_tasks, seen_keys = classify_items(context, [], [repo.get_pull(number)], leased=True)
+    return issue_tasks + coder_tasks
+
+
+def run_worker_pass(work_queue, worker_id):
+    '''
+    Lease enough items to keep the worker pool busy, with a pass's worth queued behind it, and queue them
+    without waiting. Items complete when their tasks succeed, and go back to the queue when they fail.
+    Returns how many items were leased.
+    '''
+    wanted = max(0, 2 * scheduler.workers - scheduler.outstanding())
+    keys = work_queue.lease(worker_id, wanted, list(repo_contexts)) if wanted else []
+    work_items = []
+    for key in keys:
+        try:
+            items = classify_leased_key(key)
+        except Exception as e:
+            print(f'[run_worker_pass] {key} Error: {e}')
+            work_queue.release(worker_id, key)
+            continue
+        if items:
+            work_items.extend(items)
+        else:
+            work_queue.complete(worker_id, key)
+
+    for item in work_items:
+        scheduler.submit(item).add_done_callback(partial(settle_lease, work_queue, worker_id, item.key))
+    return len(keys)
+
+
+def settle_lease(work_queue, worker_id, key, future):
+    if future.exception() is None:
+        work_queue.complete(worker_id, key)
+    else:
+        work_queue.release(worker_id, key)
+
+
+def start_queue_worker():
+    '''
+    Take work from the shared queue instead of polling GitHub. Run as many worker processes as needed on the
+    machine holding WORK_QUEUE_PATH; a `QUEUE_ROLE=producer` process on the same machine fills the queue.
+    '''
+    work_queue = get_work_queue()
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    work_queue.start_heartbeat(worker_id)
+    print(f'[start_queue_worker] {worker_id} serving {list(repo_contexts)}')
+
+    while True:
+        try:
+            if not run_worker_pass(work_queue, worker_id):
+                sleep(5)
+        except Exception as e:
+            print(f"[start_queue_worker] Error: {e}")
+            raise e
+
+
+def count_changes():
+    return sum(context.change_tracker.changes for context in repo_contexts.values())
+
+
 def start_agent_loop():
     loop_index = 0
     total_duration = 0
+    poll_scheduler = PollScheduler()
 
     while True:
         try:
             print(f'[start_agent_loop] Starting loop {loop_index}...')
             start_time = time()
+            changes = count_changes()
 
-            issue_tasks = []
-            coder_tasks = []
-
-            issues, pulls, pulls_comments = get_github_info()
-
-            for issue in issues:
-                print(f'Issue: {issue}')
-                if not is_pull_request_open(issue):
-                    refactor_requested, message_history = issue_needs_planner(issue)
-                    if refactor_requested or not planner_has_commented(issue):
-                        issue_tasks.append(
-                            create_planner_task(issue, message_history)
-                        )
-                    elif issue_approved_by_human(issue):
-                        plan = get_plan_from_issue(issue)
-                        create_pull_request_from_plan(issue, plan)
-                        # coder_tasks.append(create_coder_task(issue, plan))
-
-            # Iterate over open pull requests to check if refactoring is needed
-            for pull_request in pulls:
-                if pull_request_needs_refactoring(pull_request):
-                    coder_tasks.append(create_coder_refactor_task(pull_request))
-
-            tasks = issue_tasks + coder_tasks
-            
-            num_human_tasks = (
-                len([issue for issue in issues if not issue.pull_request and not issue_needs_planner(issue)[0]]) +
-                len([pull for pull in pulls if not pull_request_needs_refactoring(pull)])
-            )
+            with stage('poll_pass', loop_index=loop_index):
+                run_poll_pass()
 
-            print(f'- Human task count: {num_human_tasks}')
-            print(f'- Planner task count: {len(issue_tasks)}')
-            print(f'- Coder task count: {len(coder_tasks)}')
-
-            if tasks:
-                crew = Crew(
-                    agents=[agent_coder],
-                    tasks=tasks,
-                    verbose=2,
-                    process=Process.sequential,
-                    memory=True,
-                    cache=True,
-                    max_rpm=100,
-                    share_crew=True
-                )
-                
-                result = crew.kickoff()
-            
             loop_index += 1
-            total_duration += time() - start_time
+            pass_duration = time() - start_time
+            total_duration += pass_duration
+            print(f'[start_agent_loop] Loop took {pass_duration:.1f}s, {total_duration / loop_index:.1f}s on average')
 
+            delay, reason = poll_scheduler.next_delay(count_changes() - changes, pass_duration)
+            print(f'[start_agent_loop] Next loop in {delay:.1f}s: {reason}')
             # print(f'[start_agent_loop] result info: {result}')
         except Exception as e:
             print(f"[start_agent_loop] Error: {e}")
             raise e
 
-        sleep(5)
+        sleep(delay)
+
+
+def start_event_loop():
+    '''
+    Process only the issues and pull requests named by incoming webhooks, with a slow polling pass
+    every `gh_reconcile_seconds` to catch anything a missed delivery left behind.
+    '''
+    start_webhook_server(gh_webhook_host, gh_webhook_port, gh_webhook_secret)
+    last_reconcile = None
+
+    while True:
+        try:
+            if last_reconcile is None or time() - last_reconcile >= gh_reconcile_seconds:
+                print('[start_event_loop] Reconciling...')
+                run_poll_pass()
+                last_reconcile = time()
+                continue
+
+            events = drain_events(timeout=max(0, gh_reconcile_seconds - (time() - last_reconcile)))
+            events = [event for event in events if event.repo_name in repo_contexts]
+            if not events:
+                continue
+
+            print(f'[start_event_loop] Events: {events}')
+            if queue_role == 'producer':
+                get_work_queue().enqueue([(event.repo_name, event.kind, event.number) for event in events])
+                continue
+
+            work_item_groups = []
+            for context in repo_contexts.values():
+                repo_events = [event for event in events if event.repo_name == context.name]
+                if not repo_events:
+                    continue
+                repo = context.get_repo()
+                issues = [repo.get_issue(event.number) for event in repo_events if event.kind == 'issue']
+                pulls = [repo.get_pull(event.number) for event in repo_events if event.kind == 'pull']
+                issue_tasks, coder_tasks, seen_keys = classify_items(context, issues, pulls)
+                work_item_groups.append(issue_tasks + coder_tasks)
+            run_tasks(work_item_groups)
+        except Exception as e:
+            print(f"[start_event_loop] Error: {e}")
+            raise e
+
 
 if __name__ == "__main__":
-    start_agent_loop()
+    setup_tracing()
+    start_metrics_server()
+    if queue_role == 'worker':
+        start_queue_worker()
+    elif async_mode:
+        start_async_agent_loop()
+    elif gh_event_mode == 'webhook':
+        start_event_loop()
+    else:
+        start_agent_loop()
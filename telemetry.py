@@ -0,0 +1,238 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import os
+import threading
+from time import monotonic
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from opentelemetry import trace
+
+
+load_dotenv()
+
+# Serve Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics. Unset disables the endpoint.
+metrics_port = int(os.environ.get('METRICS_PORT') or 0)
+metrics_host = os.environ.get('METRICS_HOST') or '0.0.0.0'
+# Spans are exported over OTLP/HTTP when OTEL_EXPORTER_OTLP_ENDPOINT is set, and are no-ops otherwise.
+otel_endpoint = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT')
+# Dollars per 1K prompt and completion tokens, by model. LLM_PRICES (JSON, same shape) adds or overrides entries.
+llm_prices = {
+    'gpt-4o': (0.005, 0.015),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4': (0.03, 0.06),
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    **json.loads(os.environ.get('LLM_PRICES') or '{}'),
+}
+
+duration_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+tracer = trace.get_tracer('coding-agent')
+
+
+class Metrics:
+    '''
+    A minimal in-process registry of counters and duration histograms, rendered in the Prometheus text format.
+    Label values are given as keyword arguments.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            buckets, total, count = self.histograms.get(key, ([0] * len(duration_buckets), 0, 0))
+            index = bisect_left(duration_buckets, value)
+            if index < len(buckets):
+                buckets[index] += 1
+            self.histograms[key] = (buckets, total + value, count + 1)
+
+    def total(self, name, **labels):
+        '''The sum of a counter, or the number of observations of a histogram, over series matching `labels`.'''
+        wanted = set(labels.items())
+        with self.lock:
+            counters = [value for (series, series_labels), value in self.counters.items()
+                        if series == name and wanted <= set(series_labels)]
+            histograms = [count for (series, series_labels), (_, _, count) in self.histograms.items()
+                          if series == name and wanted <= set(series_labels)]
+        return sum(counters) + sum(histograms)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {self.help.get(name, name)}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), (buckets, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(duration_buckets, buckets):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+metrics = Metrics()
+metrics.describe('agent_stage_seconds', 'Duration of each agent loop stage')
+metrics.describe('agent_stage_errors_total', 'Agent loop stages that raised')
+metrics.describe('agent_llm_seconds', 'Duration of each LLM call')
+metrics.describe('agent_llm_tokens_total', 'LLM tokens, by model and direction (prompt or completion)')
+metrics.describe('agent_llm_cost_dollars_total', 'Estimated LLM cost from llm_prices')
+metrics.describe('agent_github_requests_total', 'GitHub REST requests, by method and status')
+
+
+@contextmanager
+def stage(name, **attributes):
+    '''
+    Time one stage of the loop: a `{name}` span with `attributes` (repo, issue or pull request number, ...)
+    and an `agent_stage_seconds{stage=name}` observation. Only `repo` becomes a metric label, so that
+    the number of series stays bounded.
+    '''
+    labels = {'stage': name}
+    if 'repo' in attributes:
+        labels['repo'] = attributes['repo']
+    start = monotonic()
+    with tracer.start_as_current_span(name, attributes={key: value for key, value in attributes.items() if value is not None}):
+        try:
+            yield
+        except Exception:
+            metrics.inc('agent_stage_errors_total', **labels)
+            raise
+        finally:
+            metrics.observe('agent_stage_seconds', monotonic() - start, **labels)
+
+
+def in_stage(name, function, **attributes):
+    '''Wrap `function`, e.g. a task callback, so that every call runs as a stage.'''
+    def wrapper(*args, **kwargs):
+        with stage(name, **attributes):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def work_key_attributes(key):
+    '''Span attributes for a work item key `(repo_name, kind, number)`.'''
+    repo_name, kind, number = key
+    return {'repo': repo_name, 'kind': kind, 'number': number}
+
+
+def llm_cost(model_name, prompt_tokens, completion_tokens):
+    name = (model_name or '').split('/')[-1]
+    # Match dated snapshots like gpt-4o-2024-05-13 to their base model, longest prefix first.
+    for prefix in sorted(llm_prices, key=len, reverse=True):
+        if name.startswith(prefix):
+            prompt_price, completion_price = llm_prices[prefix]
+            return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    return 0.0
+
+
+def record_github_request(method, status):
+    metrics.inc('agent_github_requests_total', method=method, status=status)
+
+
+class LLMTelemetryHandler(BaseCallbackHandler):
+    '''An `llm` span per call, under the calling thread's current stage, plus latency, token and cost metrics.'''
+
+    def __init__(self, model_name):
+        self.model_name = model_name or 'default'
+        self.calls = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        span = tracer.start_span('llm', attributes={'model': self.model_name})
+        self.calls[run_id] = (span, monotonic())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.on_llm_start(serialized, messages, run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span, start = self.calls.pop(run_id, (None, monotonic()))
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        cost = llm_cost(self.model_name, prompt_tokens, completion_tokens)
+
+        metrics.observe('agent_llm_seconds', monotonic() - start, model=self.model_name)
+        metrics.inc('agent_llm_tokens_total', prompt_tokens, model=self.model_name, direction='prompt')
+        metrics.inc('agent_llm_tokens_total', completion_tokens, model=self.model_name, direction='completion')
+        metrics.inc('agent_llm_cost_dollars_total', cost, model=self.model_name)
+        if span is not None:
+            span.set_attributes({'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'cost': cost})
+            span.end()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span, start = self.calls.pop(run_id, (None, monotonic()))
+        metrics.observe('agent_llm_seconds', monotonic() - start, model=self.model_name)
+        if span is not None:
+            span.record_exception(error)
+            span.end()
+
+
+def setup_tracing():
+    '''Export spans over OTLP/HTTP if an endpoint is configured.'''
+    if not otel_endpoint:
+        return
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({'service.name': 'coding-agent'}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+def start_metrics_server(host=metrics_host, port=metrics_port):
+    '''Serve `/metrics` from a daemon thread, like the webhook server.'''
+    if not port:
+        return
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    import uvicorn
+
+    app = FastAPI()
+
+    @app.get('/metrics')
+    def get_metrics():
+        return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+    thread = threading.Thread(
+        target=uvicorn.run,
+        kwargs={'app': app, 'host': host, 'port': port, 'log_level': 'warning'},
+        daemon=True,
+    )
+    thread.start()
+    print(f'[start_metrics_server] Serving metrics on http://{host}:{port}/metrics')
+    return thread
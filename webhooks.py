@@ -0,0 +1,108 @@
+from collections import namedtuple
+import hashlib
+import hmac
+import json
+import queue
+import threading
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, HTTPException, Request
+import uvicorn
+
+
+WorkEvent = namedtuple('WorkEvent', ['repo_name', 'kind', 'number'])
+
+# Webhook events that can move an issue or pull request through the workflow.
+handled_events = ('issues', 'issue_comment', 'pull_request_review_comment')
+
+event_queue = queue.Queue()
+webhook_secret = ''
+app = FastAPI()
+
+
+def verify_signature(secret, body, signature_header):
+    '''Check GitHub's `X-Hub-Signature-256` header, an HMAC-SHA256 of the raw body.'''
+    if not secret:
+        return True
+    if not signature_header or not signature_header.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len('sha256='):])
+
+
+def events_from_payload(event_name, payload):
+    '''Map a webhook payload to the issue or pull request it affects.'''
+    if event_name not in handled_events:
+        return []
+
+    repo_name = payload['repository']['full_name']
+    if event_name == 'pull_request_review_comment':
+        return [WorkEvent(repo_name, 'pull', payload['pull_request']['number'])]
+
+    issue = payload['issue']
+    # Issue events also fire for pull requests; those carry a `pull_request` key.
+    kind = 'pull' if 'pull_request' in issue else 'issue'
+    return [WorkEvent(repo_name, kind, issue['number'])]
+
+
+def parse_payload(content_type, body):
+    '''
+    The JSON payload of a delivery, sent as `application/json` or as the `payload` field of an
+    `application/x-www-form-urlencoded` form (both are GitHub webhook settings). None if it is neither.
+    '''
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    try:
+        if media_type == 'application/json':
+            return json.loads(body)
+        if media_type == 'application/x-www-form-urlencoded':
+            return json.loads(parse_qs(body.decode('utf-8'))['payload'][0])
+    except (ValueError, KeyError):
+        pass
+    return None
+
+
+@app.post('/webhooks/github')
+async def receive_webhook(request: Request):
+    body = await request.body()
+    if not verify_signature(webhook_secret, body, request.headers.get('X-Hub-Signature-256')):
+        raise HTTPException(status_code=401, detail='Invalid signature')
+
+    payload = parse_payload(request.headers.get('Content-Type'), body)
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail='Expected a JSON or form-encoded payload')
+
+    events = events_from_payload(request.headers.get('X-GitHub-Event'), payload)
+    for event in events:
+        event_queue.put(event)
+    return {'queued': len(events)}
+
+
+def drain_events(timeout):
+    '''
+    Block up to `timeout` seconds for the next event, then return it with everything else queued, de-duplicated.
+    '''
+    try:
+        events = [event_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while True:
+        try:
+            events.append(event_queue.get_nowait())
+        except queue.Empty:
+            break
+    return list(dict.fromkeys(events))
+
+
+def start_webhook_server(host, port, secret):
+    global webhook_secret
+    webhook_secret = secret
+    if not secret:
+        print('[start_webhook_server] Warning: GH_WEBHOOK_SECRET is empty, signatures are not checked')
+
+    thread = threading.Thread(
+        target=uvicorn.run,
+        kwargs={'app': app, 'host': host, 'port': port, 'log_level': 'warning'},
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,190 @@
+import os
+import socket
+import sqlite3
+import threading
+from time import sleep, time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# `producer` polls GitHub (or receives webhooks) and only enqueues changed issues and pull requests;
+# `worker` leases them and runs the agents. Unset runs both in one process, without the queue.
+queue_role = os.environ.get('QUEUE_ROLE') or ''
+work_queue_path = os.environ.get('WORK_QUEUE_PATH') or '.work_queue.sqlite'
+# A worker that stops heartbeating for this long loses its leases to the other workers.
+work_queue_lease_seconds = int(os.environ.get('WORK_QUEUE_LEASE_SECONDS') or 600)
+work_queue_max_attempts = int(os.environ.get('WORK_QUEUE_MAX_ATTEMPTS') or 3)
+# SQLite's locking (and WAL's shared memory) is only reliable between processes on one machine.
+network_filesystems = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', 'ceph', 'glusterfs', 'fuse.sshfs', '9p')
+
+
+def filesystem_type(path):
+    '''The type of the filesystem holding `path`, from /proc/mounts, or None where that is not available.'''
+    try:
+        with open('/proc/mounts') as file:
+            mounts = [line.split()[1:3] for line in file]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    matches = [(mount_point, kind) for mount_point, kind in mounts
+               if path == mount_point or path.startswith(mount_point.rstrip('/') + '/')]
+    return max(matches, key=lambda match: len(match[0]))[1] if matches else None
+
+
+class WorkQueue:
+    '''
+    A work queue shared by several processes on one machine through one SQLite file. Keys are
+    `(repo_name, kind, number)`. The file must be on a local filesystem, and every process opening it on
+    the same host; both are checked, since leases could otherwise be lost or granted twice.
+
+    A worker leases items for `lease_seconds` and extends the lease with heartbeats while it works, so an
+    item is never worked on twice at once, and a crashed worker's items are picked up again once its
+    leases expire. An item enqueued again while leased is marked dirty and re-queued when it completes.
+    '''
+
+    def __init__(self, path, lease_seconds, max_attempts):
+        kind = filesystem_type(os.path.dirname(os.path.abspath(path)))
+        if kind in network_filesystems:
+            raise ValueError(f'WORK_QUEUE_PATH {path} is on {kind}; SQLite needs a local filesystem')
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # Autocommit, so that the explicit BEGIN IMMEDIATE below takes the write lock before reading.
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS work_items (
+                repo_name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                dirty INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (repo_name, kind, number)
+            );
+            CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state, seq);
+            CREATE TABLE IF NOT EXISTS queue_host (host TEXT NOT NULL);
+        ''')
+        self.check_host(path)
+
+    def check_host(self, path):
+        '''Claim the queue for this machine, or refuse one that another machine already uses.'''
+        host = socket.gethostname()
+        def statements():
+            row = self.db.execute('SELECT host FROM queue_host').fetchone()
+            if row is None:
+                self.db.execute('INSERT INTO queue_host VALUES (?)', (host,))
+            return row[0] if row else host
+        owner = self.transaction(statements)
+        if owner != host:
+            raise ValueError(
+                f'WORK_QUEUE_PATH {path} is used by workers on {owner}; run every queue process on one machine '
+                f'(or delete the file if {owner} was this machine under another name)'
+            )
+
+    def transaction(self, statements):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements()
+                self.db.execute('COMMIT')
+                return result
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def enqueue(self, keys):
+        '''Queue keys in order. Keys already queued keep their place; leased keys are re-queued when done.'''
+        def statements():
+            for repo_name, kind, number in keys:
+                self.db.execute('''
+                    INSERT INTO work_items (repo_name, kind, number, state, seq)
+                    VALUES (?, ?, ?, 'queued', (SELECT COALESCE(MAX(seq), 0) + 1 FROM work_items))
+                    ON CONFLICT (repo_name, kind, number) DO UPDATE SET
+                        dirty = CASE WHEN state = 'leased' THEN 1 ELSE dirty END,
+                        attempts = CASE WHEN state = 'failed' THEN 0 ELSE attempts END,
+                        seq = CASE WHEN state = 'failed' THEN excluded.seq ELSE seq END,
+                        state = CASE WHEN state = 'failed' THEN 'queued' ELSE state END
+                ''', (repo_name, kind, number))
+        self.transaction(statements)
+
+    def lease(self, owner, limit, repo_names):
+        '''Lease up to `limit` queued or expired items of the given repositories, oldest first.'''
+        def statements():
+            now = time()
+            placeholders = ', '.join('?' for _ in repo_names)
+            rows = self.db.execute(f'''
+                SELECT repo_name, kind, number FROM work_items
+                WHERE (state = 'queued' OR (state = 'leased' AND lease_expires < ?))
+                    AND repo_name IN ({placeholders})
+                ORDER BY seq LIMIT ?
+            ''', (now, *repo_names, limit)).fetchall()
+            for row in rows:
+                self.db.execute('''
+                    UPDATE work_items SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1
+                    WHERE repo_name = ? AND kind = ? AND number = ?
+                ''', (owner, now + self.lease_seconds, *row))
+            return [tuple(row) for row in rows]
+        return self.transaction(statements)
+
+    def heartbeat(self, owner):
+        '''Extend every lease held by `owner`.'''
+        self.transaction(lambda: self.db.execute(
+            "UPDATE work_items SET lease_expires = ? WHERE owner = ? AND state = 'leased'",
+            (time() + self.lease_seconds, owner),
+        ))
+
+    def start_heartbeat(self, owner):
+        def beat():
+            while True:
+                sleep(self.lease_seconds / 3)
+                try:
+                    self.heartbeat(owner)
+                except Exception as e:
+                    print(f'[WorkQueue.heartbeat] Error: {e}')
+        thread = threading.Thread(target=beat, daemon=True, name='work-queue-heartbeat')
+        thread.start()
+        return thread
+
+    def complete(self, owner, key):
+        '''Finish a leased item. Does nothing if the lease has expired and another worker holds the item.'''
+        def statements():
+            self.db.execute('''
+                UPDATE work_items SET state = 'queued', owner = NULL, lease_expires = NULL, attempts = 0, dirty = 0
+                WHERE repo_name = ? AND kind = ? AND number = ? AND owner = ? AND state = 'leased' AND dirty = 1
+            ''', (*key, owner))
+            self.db.execute('''
+                DELETE FROM work_items
+                WHERE repo_name = ? AND kind = ? AND number = ? AND owner = ? AND state = 'leased'
+            ''', (*key, owner))
+        self.transaction(statements)
+
+    def release(self, owner, key):
+        '''Return a failed item to the queue, or park it as `failed` after `max_attempts`.'''
+        self.transaction(lambda: self.db.execute('''
+            UPDATE work_items SET
+                state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                owner = NULL, lease_expires = NULL
+            WHERE repo_name = ? AND kind = ? AND number = ? AND owner = ? AND state = 'leased'
+        ''', (self.max_attempts, *key, owner)))
+
+    def count(self, state):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM work_items WHERE state = ?', (state,)).fetchone()[0]
+
+
+work_queue = None
+work_queue_lock = threading.Lock()
+
+
+def get_work_queue():
+    global work_queue
+    with work_queue_lock:
+        if work_queue is None:
+            work_queue = WorkQueue(work_queue_path, work_queue_lease_seconds, work_queue_max_attempts)
+        return work_queue
@@ -0,0 +1,122 @@
+from collections import namedtuple
+import hashlib
+import os
+import sqlite3
+import threading
+from time import time
+
+from dotenv import load_dotenv
+
+from change_tracker import to_datetime
+
+
+load_dotenv()
+
+workflow_state_path = os.environ.get('WORKFLOW_STATE_PATH') or '.workflow_state.sqlite'
+
+WorkflowState = namedtuple('WorkflowState', ['updated_at', 'stage', 'plan_hash', 'branch', 'pull_number', 'attempts'])
+
+
+def hash_plan(plan):
+    return hashlib.sha256((plan or '').encode('utf-8')).hexdigest()[:12]
+
+
+def plan_branch_name(issue_number, plan_hash):
+    '''The same issue and plan always map to the same branch, so a retried attempt reuses it.'''
+    return f'feature/issue-{issue_number}-{plan_hash}'
+
+
+class WorkflowStore:
+    '''
+    Durable per-item workflow state: stage, plan hash, branch, pull request number and attempt count,
+    keyed by repository and `('issue', number)` or `('pull', number)`.
+
+    Steps with side effects on GitHub record their intent (`begin_pull_request`) before acting and their
+    result (`finish_pull_request`) after, so a restart finds the interrupted step and resumes it.
+    '''
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS workflow (
+                repo_name TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                number INTEGER NOT NULL,
+                updated_at TEXT,
+                stage TEXT NOT NULL,
+                plan_hash TEXT,
+                branch TEXT,
+                pull_number INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                changed_at REAL NOT NULL,
+                PRIMARY KEY (repo_name, kind, number)
+            )
+        ''')
+        self.db.commit()
+
+    def items(self, repo_name):
+        '''Every stored item of a repository as `{key: (updated_at, stage)}`, the shape `ChangeTracker` keeps.'''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT kind, number, updated_at, stage FROM workflow WHERE repo_name = ? AND updated_at IS NOT NULL',
+                (repo_name,),
+            ).fetchall()
+        return {(kind, number): (to_datetime(updated_at), stage) for kind, number, updated_at, stage in rows}
+
+    def get(self, repo_name, key):
+        with self.lock:
+            row = self.db.execute('''
+                SELECT updated_at, stage, plan_hash, branch, pull_number, attempts FROM workflow
+                WHERE repo_name = ? AND kind = ? AND number = ?
+            ''', (repo_name, *key)).fetchone()
+        return WorkflowState(*row) if row else None
+
+    def record_stage(self, repo_name, key, updated_at, stage):
+        with self.lock, self.db:
+            self.db.execute('''
+                INSERT INTO workflow (repo_name, kind, number, updated_at, stage, changed_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (repo_name, kind, number) DO UPDATE SET
+                    updated_at = excluded.updated_at, stage = excluded.stage, changed_at = excluded.changed_at
+            ''', (repo_name, *key, to_datetime(updated_at).isoformat(), stage, time()))
+
+    def begin_pull_request(self, repo_name, key, plan_hash, branch):
+        '''Record the intent to open a pull request for a plan. Returns the attempt number for that plan.'''
+        with self.lock, self.db:
+            self.db.execute('''
+                INSERT INTO workflow (repo_name, kind, number, stage, plan_hash, branch, attempts, changed_at)
+                VALUES (?, ?, ?, 'creating_pull_request', ?, ?, 1, ?)
+                ON CONFLICT (repo_name, kind, number) DO UPDATE SET
+                    attempts = CASE WHEN plan_hash = excluded.plan_hash THEN attempts + 1 ELSE 1 END,
+                    stage = excluded.stage, plan_hash = excluded.plan_hash, branch = excluded.branch,
+                    pull_number = NULL, changed_at = excluded.changed_at
+            ''', (repo_name, *key, plan_hash, branch, time()))
+            return self.db.execute(
+                'SELECT attempts FROM workflow WHERE repo_name = ? AND kind = ? AND number = ?',
+                (repo_name, *key),
+            ).fetchone()[0]
+
+    def finish_pull_request(self, repo_name, key, pull_number):
+        with self.lock, self.db:
+            self.db.execute('''
+                UPDATE workflow SET stage = 'pull_request_open', pull_number = ?, changed_at = ?
+                WHERE repo_name = ? AND kind = ? AND number = ?
+            ''', (pull_number, time(), repo_name, *key))
+
+    def delete(self, repo_name, key):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM workflow WHERE repo_name = ? AND kind = ? AND number = ?', (repo_name, *key))
+
+
+workflow_store = None
+workflow_store_lock = threading.Lock()
+
+
+def get_workflow_store():
+    global workflow_store
+    with workflow_store_lock:
+        if workflow_store is None:
+            workflow_store = WorkflowStore(workflow_state_path)
+        return workflow_store